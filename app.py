@@ -1,16 +1,28 @@
 import os
 import csv
+import time
 import glob
+import queue
 import base64
+import hashlib
 import requests
 import tempfile
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timezone
 import json
 from werkzeug.utils import secure_filename
 from src.whatsapp_bot import WhatsAppBot
+from src.bot_pool import BotPool
+from src.selector_cache import SelectorCache
+from src.delivery_tracker import DeliveryTracker
+from src.send_coalescer import SendCoalescer
+from src.browser_watchdog import BrowserWatchdog
+from src.send_timings import SendTimer
+from src.rate_limiter import RateLimiter
+from src.media_cache import MediaPreprocessor
+from src.outbox import Outbox
 from src.database import Database
 from src.logger import get_logger, app_logger, scheduler_logger
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -38,10 +50,41 @@ PDF_GENERATOR_URL = os.getenv('PDF_GENERATOR_URL', 'http://localhost:5173/api/si
 # Bot Configuration - stored in settings file
 SETTINGS_FILE = os.path.join(DATA_FOLDER, 'settings.json')
 
+# Browser memory samples per browser mode (default / lean)
+MEMORY_STATS_FILE = os.path.join(DATA_FOLDER, 'browser_memory.json')
+
+# Seconds to wait for a busy session to read its QR code before answering 'busy'
+QR_CODE_TIMEOUT = 10
+
+# Login event stream: how often the in-memory login state is compared, and the keep-alive interval (seconds)
+LOGIN_EVENTS_INTERVAL = 1
+LOGIN_EVENTS_KEEPALIVE = 15
+
+# Keep-alive interval of an outbox job's progress stream (seconds)
+OUTBOX_EVENTS_KEEPALIVE = 15
+
 # Default settings
 DEFAULT_SETTINGS = {
     'headless': True,  # Browser hidden by default
-    'default_country_code': '91'  # India
+    'default_country_code': '91',  # India
+    'sessions': 1,  # Number of parallel WhatsApp sessions
+    'navigation_mode': 'in_app',  # 'in_app' switches chats without reloading, 'reload' loads the send URL
+    'prefill_text': True,  # Let WhatsApp prefill short text messages from the send URL
+    'invalid_number_ttl_days': 30,  # Skip numbers WhatsApp reported invalid for this many days
+    'lean_browser': False,  # Block media, drop the disk cache and use low-memory flags
+    'attach_browser': False,  # Keep browsers running across restarts and reattach to them
+    'recycle_after_sends': 300,  # Restart a session's browser after this many sends...
+    'recycle_above_mb': 1500,  # ...when it uses more memory than this...
+    'recycle_after_failures': 3,  # ...or after this many failed sends in a row
+    'rate_limit_enabled': True,  # Pace sends adaptively per session instead of the fixed delay
+    'rate_limit_per_minute': 12,  # Starting rate of each session
+    'rate_limit_max_per_minute': 30,  # The rate speeds up after successes, but not beyond this
+    'rate_limit_burst': 3,  # Sends that may go out back to back
+    'rate_limit_jitter': 0.3,  # Random extra wait, as a fraction of the send interval
+    'compress_images': True,  # Downscale and recompress images (sent as photos) before uploading
+    'image_max_dimension': 1600,  # Longest side of a compressed image in pixels
+    'image_quality': 80,  # JPEG quality of a compressed image
+    'idempotency_window_seconds': 300  # A repeated single send within this window returns the first result (0 = off)
 }
 
 def load_settings():
@@ -76,6 +119,275 @@ def get_default_country_code():
     settings = load_settings()
     return settings.get('default_country_code', '91')
 
+def get_bot_options():
+    """Get WhatsAppBot options from settings"""
+    settings = load_settings()
+    return {
+        'navigation_mode': settings.get('navigation_mode', 'in_app'),
+        'prefill': bool(settings.get('prefill_text', True)),
+        'selector_cache': selector_cache,
+        'delivery_tracker': delivery_tracker,
+        'lean': bool(settings.get('lean_browser', False)),
+        'attach': bool(settings.get('attach_browser', False)),
+        'watchdog': browser_watchdog,
+        'rate_limiter': rate_limiter,
+        'media_preprocessor': media_preprocessor,
+    }
+
+def get_invalid_number_ttl():
+    """Get how many days a number reported invalid is skipped"""
+    settings = load_settings()
+    try:
+        return max(0, int(settings.get('invalid_number_ttl_days', 30)))
+    except (TypeError, ValueError):
+        return 30
+
+def is_known_invalid(phone):
+    """True if WhatsApp reported this number as invalid recently"""
+    ttl = get_invalid_number_ttl()
+    return ttl > 0 and db.is_invalid_number(phone, ttl)
+
+def get_send_status(phone, success, invalid):
+    """History status for a finished send; numbers WhatsApp rejected are cached as invalid"""
+    if success:
+        return 'sent'
+    if invalid:
+        db.add_invalid_number(phone)
+        return 'invalid'
+    return 'failed'
+
+def get_attachment_paths(data):
+    """Attachments of a send request: attachment_path and/or an attachment_paths list"""
+    paths = list(data.get('attachment_paths') or [])
+    if data.get('attachment_path'):
+        paths.insert(0, data['attachment_path'])
+    # Keep order, drop duplicates
+    return list(dict.fromkeys(path for path in paths if path))
+
+def coalesced_send(session, phone, message, history_message=None, attachments=None, file_type='document'):
+    """
+    Send through the coalescer and record the message in history as soon as it went out.
+    session is a bot or a session factory such as BotPool.session.
+    Returns the coalescer result with the history 'status' added.
+    """
+    def record(result):
+        result['status'] = get_send_status(phone, result['success'], result['invalid'])
+        db.add_message_history(phone, message if history_message is None else history_message,
+                               result['status'], result['message_id'], result['timings'])
+    
+    return send_coalescer.send(session, phone, message, attachments, file_type, on_sent=record)
+
+def split_known_invalid(items, number_key):
+    """
+    Split items into (index, item) pairs to send and pairs whose number WhatsApp
+    already reported as invalid, so those can be skipped without opening a chat.
+    """
+    ttl = get_invalid_number_ttl()
+    pending, skipped = [], []
+    for index, item in enumerate(items):
+        number = item.get(number_key, '')
+        if ttl > 0 and number and db.is_invalid_number(number, ttl):
+            skipped.append((index, item))
+        else:
+            pending.append((index, item))
+    return pending, skipped
+
+def record_browser_memory(pool):
+    """
+    Sample the RSS of every running session and add it to the per-mode totals
+    in browser_memory.json. Returns the current samples.
+    """
+    samples = []
+    for bot in pool.bots if pool else []:
+        rss = bot.get_memory_usage()
+        if rss is not None:
+            samples.append({'session': bot.session_id, 'mode': 'lean' if bot.lean else 'default', 'rss_mb': rss})
+    if not samples:
+        return samples
+    
+    stats = {}
+    try:
+        if os.path.exists(MEMORY_STATS_FILE):
+            with open(MEMORY_STATS_FILE, 'r') as f:
+                stats = json.load(f)
+    except:
+        stats = {}
+    for sample in samples:
+        entry = stats.setdefault(sample['mode'], {'samples': 0, 'avg_mb': 0, 'peak_mb': 0})
+        entry['samples'] += 1
+        entry['avg_mb'] = round(entry['avg_mb'] + (sample['rss_mb'] - entry['avg_mb']) / entry['samples'], 1)
+        entry['peak_mb'] = max(entry['peak_mb'], sample['rss_mb'])
+        entry['last_sampled'] = datetime.now().isoformat(timespec='seconds')
+    try:
+        with open(MEMORY_STATS_FILE, 'w') as f:
+            json.dump(stats, f, indent=2)
+    except Exception as e:
+        logger.warning(f"Could not save browser memory stats: {e}")
+    return samples
+
+def get_browser_memory_report():
+    """Average RSS per mode and how much lean mode saves against the default browser"""
+    stats = {}
+    try:
+        if os.path.exists(MEMORY_STATS_FILE):
+            with open(MEMORY_STATS_FILE, 'r') as f:
+                stats = json.load(f)
+    except:
+        pass
+    report = {'modes': stats, 'lean_saving_mb': None, 'lean_saving_percent': None}
+    default, lean = stats.get('default'), stats.get('lean')
+    if default and lean and default['avg_mb']:
+        report['lean_saving_mb'] = round(default['avg_mb'] - lean['avg_mb'], 1)
+        report['lean_saving_percent'] = round(100 * report['lean_saving_mb'] / default['avg_mb'], 1)
+    return report
+
+def get_latency_breakdown(timings):
+    """
+    Aggregate send timings per kind (text/attachment): total time and WebDriver commands
+    per send, and for every span its percentiles and share of the total time.
+    """
+    def percentiles(values):
+        ordered = sorted(values)
+        pick = lambda pct: ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+        return {'p50': round(pick(50), 1), 'p90': round(pick(90), 1), 'p99': round(pick(99), 1),
+                'avg': round(sum(ordered) / len(ordered), 1)}
+    
+    breakdown = {}
+    for kind in sorted({row['kind'] for row in timings}):
+        rows = [row for row in timings if row['kind'] == kind]
+        total = sum(row['total_ms'] for row in rows)
+        spans = {}
+        for name in SendTimer.SPANS:
+            values = [row['spans'][name] for row in rows if name in row['spans']]
+            if values:
+                spans[name] = {**percentiles(values), 'count': len(values),
+                               'share_percent': round(100 * sum(values) / total, 1) if total else None}
+        breakdown[kind] = {
+            'count': len(rows),
+            'failed': sum(1 for row in rows if row['status'] != 'sent'),
+            'total_ms': percentiles([row['total_ms'] for row in rows]),
+            'commands': percentiles([row['commands'] for row in rows]),
+            'spans': spans,
+        }
+    return breakdown
+
+def get_login_state(session_id=0):
+    """QR code and login state of a session from memory (kept fresh by its worker): {'status', 'qr', 'hash', 'error'}"""
+    bot = bot_pool.get_bot(session_id) if bot_pool is not None else None
+    if bot is None:
+        return {'status': 'not_initialized', 'qr': None, 'hash': None,
+                'error': 'Bot not initialized. Please initialize first.'}
+    return bot_pool.login_state(bot, QR_CODE_TIMEOUT)
+
+def get_watchdog_thresholds():
+    """Get browser recycling thresholds from settings"""
+    settings = load_settings()
+    return {
+        'max_sends': int(settings.get('recycle_after_sends', 300)),
+        'max_rss_mb': int(settings.get('recycle_above_mb', 1500)),
+        'max_consecutive_failures': int(settings.get('recycle_after_failures', 3)),
+    }
+
+def get_rate_limits():
+    """Get rate limiter settings"""
+    settings = load_settings()
+    return {
+        'enabled': bool(settings.get('rate_limit_enabled', True)),
+        'rate': float(settings.get('rate_limit_per_minute', 12)),
+        'max_rate': float(settings.get('rate_limit_max_per_minute', 30)),
+        'burst': int(settings.get('rate_limit_burst', 3)),
+        'jitter': float(settings.get('rate_limit_jitter', 0.3)),
+    }
+
+def get_media_settings():
+    """Get image preprocessing settings"""
+    settings = load_settings()
+    return {
+        'enabled': bool(settings.get('compress_images', True)),
+        'max_dimension': int(settings.get('image_max_dimension', 1600)),
+        'quality': int(settings.get('image_quality', 80)),
+    }
+
+def get_idempotency_window():
+    """Seconds within which a repeated single send returns the first result instead of sending"""
+    settings = load_settings()
+    try:
+        return max(0, int(settings.get('idempotency_window_seconds', 300)))
+    except (TypeError, ValueError):
+        return 300
+
+def get_idempotency_key(explicit, phone, *content):
+    """
+    (key, fingerprint) of a single send. fingerprint hashes the normalized phone number and
+    the content (message, attachments); the key is the client's (Idempotency-Key header or
+    idempotency_key field), or one derived from the fingerprint.
+    """
+    digest = hashlib.sha256()
+    for part in (send_coalescer.normalize(phone),) + content:
+        digest.update(str(part).encode('utf-8') + b'\0')
+    fingerprint = digest.hexdigest()[:32]
+    key = request.headers.get('Idempotency-Key') or explicit
+    if key:
+        return f'key:{key}', fingerprint
+    return f'{send_coalescer.normalize(phone)}:{fingerprint}', fingerprint
+
+def attachment_fingerprint(path):
+    """Identifies an attachment in a derived idempotency key without reading it"""
+    return f'{os.path.basename(path)}:{os.path.getsize(path)}'
+
+def run_idempotent(key, fingerprint, phone, send):
+    """
+    Run send() -> (response dict, status code) once per idempotency key within the window.
+    A repeat gets the stored successful response (with 'duplicate': True) without touching
+    the browser; a repeat while the first request is still sending gets 409, and a key reused
+    for another recipient or message gets 422. Failures are not stored, so a retry sends again.
+    A 202 (queued) answer leaves the claim in progress: whoever finishes the send calls
+    finish_idempotent with the final outcome.
+    """
+    window = get_idempotency_window()
+    if window <= 0:
+        body, code = send()
+        return jsonify(body), code
+    
+    earlier = db.claim_send_request(key, phone, fingerprint, window)
+    if earlier:
+        if earlier['fingerprint'] != fingerprint:
+            return jsonify({'success': False, 'idempotency_key': key,
+                            'error': 'This idempotency key was used for another recipient or message'}), 422
+        if earlier['status'] != 'done':
+            return jsonify({'success': False, 'status': 'in_progress', 'idempotency_key': key,
+                            'error': 'This message is still being sent'}), 409
+        logger.info(f"Repeated send to {phone} answered with the earlier result")
+        return jsonify(dict(earlier['response'], duplicate=True, idempotency_key=key)), earlier['response_code']
+    
+    try:
+        body, code = send()
+    except Exception:
+        db.release_send_request(key)
+        raise
+    if code != 202:
+        finish_idempotent(key, body, code)
+    return jsonify(dict(body, idempotency_key=key)), code
+
+def finish_idempotent(key, body, code):
+    """Store a successful send's response for the repeats of key, or release key so a retry sends again"""
+    if 200 <= code < 300:
+        db.complete_send_request(key, code, body)
+    else:
+        db.release_send_request(key)
+
+def get_send_delay(delay):
+    """Fixed pause between a session's sends: none while the rate limiter paces them"""
+    return 0 if rate_limiter.settings['enabled'] else delay
+
+def get_session_count():
+    """Get number of parallel WhatsApp sessions from settings"""
+    settings = load_settings()
+    try:
+        return max(1, int(settings.get('sessions', 1)))
+    except (TypeError, ValueError):
+        return 1
+
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 if not os.path.exists(ATTACHMENTS_FOLDER):
@@ -92,14 +404,51 @@ app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100 MB max file size
 # Initialize database in data folder
 db = Database(os.path.join(DATA_FOLDER, 'whatsapp_bot.db'))
 
+# Selector hit statistics, shared by every bot session
+selector_cache = SelectorCache(os.path.join(DATA_FOLDER, 'selector_stats.json'))
+
+# Writes the final tick status of sent messages back to message_history
+delivery_tracker = DeliveryTracker(on_settle=db.update_delivery_status)
+
+# Groups sends to the same number (scheduler, bulk and single sends) into one chat visit
+send_coalescer = SendCoalescer()
+
+# Recycles a session's browser (same profile, no QR scan) when it grows or stops responding
+browser_watchdog = BrowserWatchdog(**get_watchdog_thresholds())
+
+# Paces each session's sends, backing off on failures and speeding up after successes
+rate_limiter = RateLimiter(**get_rate_limits())
+
+# Shrunk copies of images, processed once per picture and shared by every recipient
+media_preprocessor = MediaPreprocessor(os.path.join(DATA_FOLDER, 'media_cache'), **get_media_settings())
+
+# Bulk jobs are stored in SQLite and sent in the background, so a campaign outlives its HTTP request
+outbox = Outbox(db, lambda: bot_pool, get_send_delay)
+# Claims of single sends cut off by a restart would answer 409 until they expire
+db.release_unfinished_send_requests()
+
 # Initialize scheduler
 scheduler = BackgroundScheduler()
 scheduler.start()
 
-# Global WhatsApp bot instance
+# Global WhatsApp bot pool - whatsapp_bot is its primary session (QR code / login status)
+bot_pool = None
 whatsapp_bot = None
 
 
+def ensure_bot_pool():
+    """Start the bot pool on first use and return it"""
+    global bot_pool, whatsapp_bot
+    
+    if bot_pool is None:
+        pool = BotPool(get_session_count(), **get_bot_options())
+        pool.initialize()
+        bot_pool = pool
+        whatsapp_bot = pool.primary
+        outbox.start()
+    return bot_pool
+
+
 def allowed_file(filename, allowed_extensions=ALLOWED_EXTENSIONS):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
@@ -125,24 +474,33 @@ def serve_data_file(filename):
 @app.route('/api/initialize-bot', methods=['POST'])
 def initialize_bot():
     """Initialize the WhatsApp bot"""
-    global whatsapp_bot
+    global bot_pool, whatsapp_bot
     
     try:
-        # Close existing bot if any
-        if whatsapp_bot is not None:
+        # Close existing bots if any (in attach mode their browsers stay up and are reattached below)
+        if bot_pool is not None:
             try:
-                whatsapp_bot.close()
+                record_browser_memory(bot_pool)
+                bot_pool.close()
             except:
                 pass
+            bot_pool = None
+            whatsapp_bot = None
         
         headless = get_headless_mode()
-        whatsapp_bot = WhatsAppBot()
-        whatsapp_bot.initialize(headless=headless)
+        pool = BotPool(get_session_count(), **get_bot_options())
+        pool.initialize(headless=headless)
+        bot_pool = pool
+        whatsapp_bot = pool.primary
+        # Jobs cut off by a restart continue once a session is logged in
+        outbox.start()
         
         return jsonify({
             'success': True, 
             'message': 'Bot initialized successfully',
-            'headless': headless
+            'headless': headless,
+            'sessions': pool.size,
+            'attached': pool.primary.attached
         })
         
     except Exception as e:
@@ -152,11 +510,15 @@ def initialize_bot():
 @app.route('/api/close-bot', methods=['POST'])
 def close_bot():
     """Close the WhatsApp bot"""
-    global whatsapp_bot
+    global bot_pool, whatsapp_bot
     
     try:
-        if whatsapp_bot is not None:
-            whatsapp_bot.close()
+        if bot_pool is not None:
+            # Last memory sample of this run, taken after whatever work it did
+            record_browser_memory(bot_pool)
+            # An explicit close shuts the browsers down, even in attach mode
+            bot_pool.close(keep_browser=False)
+            bot_pool = None
             whatsapp_bot = None
         
         return jsonify({
@@ -170,18 +532,11 @@ def close_bot():
 
 @app.route('/api/get-qr-code', methods=['GET'])
 def get_qr_code():
-    """Get QR code for WhatsApp login"""
-    global whatsapp_bot
-    
+    """Get QR code for WhatsApp login (?session=N for additional sessions)"""
     try:
-        if whatsapp_bot is None:
-            return jsonify({
-                'success': False, 
-                'status': 'not_initialized',
-                'error': 'Bot not initialized. Please initialize first.'
-            })
-        
-        qr_data = whatsapp_bot.get_qr_code_base64()
+        qr_data = get_login_state(request.args.get('session', 0, type=int))
+        if qr_data['status'] in ('not_initialized', 'busy'):
+            return jsonify({'success': False, 'status': qr_data['status'], 'error': qr_data['error']})
         
         return jsonify({
             'success': True,
@@ -194,6 +549,33 @@ def get_qr_code():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/login-events')
+def login_events():
+    """
+    Server-sent events with the QR code and login state (?session=N). An event is only
+    pushed when the state or the QR code changes; idle streams just get keep-alives.
+    """
+    session_id = request.args.get('session', 0, type=int)
+    
+    def stream():
+        last, quiet = None, 0
+        while True:
+            state = get_login_state(session_id)
+            key = (state['status'], state['hash'])
+            if state['status'] != 'busy' and key != last:
+                last, quiet = key, 0
+                yield f"data: {json.dumps(state)}\n\n"
+            else:
+                quiet += LOGIN_EVENTS_INTERVAL
+                if quiet >= LOGIN_EVENTS_KEEPALIVE:
+                    quiet = 0
+                    yield ": keep-alive\n\n"
+            time.sleep(LOGIN_EVENTS_INTERVAL)
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/api/settings', methods=['GET'])
 def get_settings():
     """Get current settings"""
@@ -214,7 +596,57 @@ def update_settings():
         if 'default_country_code' in data:
             settings['default_country_code'] = str(data['default_country_code']).strip().replace('+', '')
         
+        if 'sessions' in data:
+            settings['sessions'] = max(1, int(data['sessions']))
+        
+        if data.get('navigation_mode') in WhatsAppBot.NAVIGATION_MODES:
+            settings['navigation_mode'] = data['navigation_mode']
+        
+        if 'prefill_text' in data:
+            settings['prefill_text'] = bool(data['prefill_text'])
+        
+        if 'invalid_number_ttl_days' in data:
+            settings['invalid_number_ttl_days'] = max(0, int(data['invalid_number_ttl_days']))
+        
+        if 'lean_browser' in data:
+            settings['lean_browser'] = bool(data['lean_browser'])
+        
+        if 'attach_browser' in data:
+            settings['attach_browser'] = bool(data['attach_browser'])
+        
+        for key in ('recycle_after_sends', 'recycle_above_mb', 'recycle_after_failures'):
+            if key in data:
+                settings[key] = max(1, int(data[key]))
+        
+        if 'rate_limit_enabled' in data:
+            settings['rate_limit_enabled'] = bool(data['rate_limit_enabled'])
+        
+        for key in ('rate_limit_per_minute', 'rate_limit_max_per_minute'):
+            if key in data:
+                settings[key] = max(0.5, float(data[key]))
+        
+        if 'rate_limit_burst' in data:
+            settings['rate_limit_burst'] = max(1, int(data['rate_limit_burst']))
+        
+        if 'rate_limit_jitter' in data:
+            settings['rate_limit_jitter'] = min(1.0, max(0.0, float(data['rate_limit_jitter'])))
+        
+        if 'compress_images' in data:
+            settings['compress_images'] = bool(data['compress_images'])
+        
+        if 'image_max_dimension' in data:
+            settings['image_max_dimension'] = max(320, int(data['image_max_dimension']))
+        
+        if 'image_quality' in data:
+            settings['image_quality'] = min(95, max(30, int(data['image_quality'])))
+        
+        if 'idempotency_window_seconds' in data:
+            settings['idempotency_window_seconds'] = max(0, int(data['idempotency_window_seconds']))
+        
         if save_settings(settings):
+            browser_watchdog.configure(**get_watchdog_thresholds())
+            rate_limiter.configure(**get_rate_limits())
+            media_preprocessor.configure(**get_media_settings())
             return jsonify({'success': True, 'message': 'Settings saved'})
         else:
             return jsonify({'success': False, 'error': 'Failed to save settings'}), 500
@@ -235,7 +667,14 @@ def check_login():
                 'message': 'Bot not initialized'
             })
         
-        logged_in = whatsapp_bot.is_logged_in()
+        # Answered from the state the session's worker keeps in memory - no browser access
+        logged_in = bot_pool.check_login(whatsapp_bot)
+        if logged_in is None:
+            return jsonify({
+                'logged_in': False,
+                'status': 'busy',
+                'message': 'WhatsApp session is busy, try again shortly'
+            })
         
         return jsonify({
             'logged_in': logged_in,
@@ -251,6 +690,148 @@ def check_login():
         })
 
 
+@app.route('/api/pool/status', methods=['GET'])
+def pool_status():
+    """Get status of every WhatsApp session in the pool"""
+    try:
+        if bot_pool is None:
+            return jsonify({'success': True, 'sessions': [], 'size': get_session_count()})
+        return jsonify({'success': True, 'sessions': bot_pool.status(), 'size': bot_pool.size})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/selector-stats', methods=['GET'])
+def get_selector_stats():
+    """Which XPath matched for each selector, hit/miss counts and skipped selectors"""
+    try:
+        return jsonify({'success': True, 'stats': selector_cache.stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/selector-stats', methods=['DELETE'])
+def reset_selector_stats():
+    """Forget learned selector order"""
+    try:
+        selector_cache.reset()
+        return jsonify({'success': True, 'message': 'Selector stats reset'})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/latency-breakdown', methods=['GET'])
+def latency_breakdown():
+    """Where send time goes: per-step percentiles over the last ?limit= timed sends (optionally one ?kind=)"""
+    try:
+        limit = request.args.get('limit', 500, type=int)
+        kind = request.args.get('kind')
+        timings = db.get_send_timings(limit, kind)
+        return jsonify({'success': True, 'sends': len(timings), 'breakdown': get_latency_breakdown(timings)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/browser-memory', methods=['GET'])
+def get_browser_memory():
+    """Current browser RSS per session, plus lean vs default averages over past samples"""
+    try:
+        samples = record_browser_memory(bot_pool)
+        report = get_browser_memory_report()
+        return jsonify({
+            'success': True,
+            'sessions': samples,
+            'available': WhatsAppBot.memory_reporting_available(),
+            **report
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/media-cache', methods=['GET'])
+def get_media_cache_stats():
+    """Image preprocessing settings, cache size and how many upload bytes it saved"""
+    try:
+        return jsonify({'success': True, **media_preprocessor.stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/media-cache', methods=['DELETE'])
+def clear_media_cache():
+    """Delete the processed images; they are recreated on the next send"""
+    try:
+        count = media_preprocessor.clear()
+        return jsonify({'success': True, 'message': f'Removed {count} cached files'})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/rate-limiter', methods=['GET'])
+def get_rate_limiter_stats():
+    """Rate limiter settings and each session's current adaptive rate"""
+    try:
+        return jsonify({'success': True, **rate_limiter.stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/watchdog', methods=['GET'])
+def get_watchdog_stats():
+    """Browser recycling thresholds and per-session counters"""
+    try:
+        return jsonify({'success': True, **browser_watchdog.stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/watchdog/recycle', methods=['POST'])
+def recycle_browser():
+    """Restart a session's browser on its profile now (?session=N, default 0)"""
+    try:
+        if bot_pool is None:
+            return jsonify({'success': False, 'error': 'Bot not initialized'}), 400
+        bot = bot_pool.get_bot(request.args.get('session', 0, type=int))
+        if bot is None:
+            return jsonify({'success': False, 'error': 'Unknown session'}), 404
+        bot_pool.submit(lambda bot: browser_watchdog.recycle(bot, 'requested through the API'),
+                        session_id=bot.session_id).result()
+        return jsonify({'success': True, 'logged_in': bool(bot_pool.check_login(bot))})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/invalid-numbers', methods=['GET'])
+def get_invalid_numbers():
+    """Numbers currently skipped because WhatsApp reported them invalid"""
+    try:
+        numbers = db.get_invalid_numbers(get_invalid_number_ttl())
+        return jsonify({'success': True, 'numbers': numbers, 'ttl_days': get_invalid_number_ttl()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/invalid-numbers', methods=['DELETE'])
+def clear_invalid_numbers():
+    """Forget all cached invalid numbers"""
+    try:
+        count = db.clear_invalid_numbers()
+        return jsonify({'success': True, 'message': f'Cleared {count} invalid numbers'})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/invalid-numbers/<phone>', methods=['DELETE'])
+def remove_invalid_number(phone):
+    """Forget one cached invalid number so it is tried again"""
+    try:
+        if db.remove_invalid_number(phone):
+            return jsonify({'success': True, 'message': 'Number removed from invalid list'})
+        return jsonify({'success': False, 'error': 'Number not in invalid list'}), 404
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/send')
 def send_page():
     """Send message page"""
@@ -267,43 +848,91 @@ def send_message():
         data = request.json
         phone = data.get('phone')
         message = data.get('message', '')
-        attachment_path = data.get('attachment_path')
+        attachment_paths = get_attachment_paths(data)
         file_type = data.get('file_type', 'image')  # image, video, audio, document
         
         if not phone:
             return jsonify({'success': False, 'error': 'Phone is required'}), 400
         
-        if not message and not attachment_path:
+        if not message and not attachment_paths:
             return jsonify({'success': False, 'error': 'Message or attachment is required'}), 400
         
-        # Initialize bot if not already done
-        if whatsapp_bot is None:
-            whatsapp_bot = WhatsAppBot()
-            whatsapp_bot.initialize()
+        attachment_paths = [path for path in attachment_paths if os.path.exists(path)]
+        # Retries of the same send (e.g. after a client timeout) get the first result
+        key, fingerprint = get_idempotency_key(data.get('idempotency_key'), phone, message, file_type,
+                                               *(attachment_fingerprint(path) for path in attachment_paths))
         
-        # Send message with or without attachment
-        if attachment_path and os.path.exists(attachment_path):
-            success = whatsapp_bot.send_message_with_attachment(phone, message, attachment_path, file_type)
-        else:
-            success = whatsapp_bot.send_message(phone, message)
+        def send():
+            # Numbers WhatsApp rejected recently are not tried again
+            if is_known_invalid(phone):
+                db.add_message_history(phone, message, 'invalid')
+                return {'success': False, 'status': 'invalid', 'error': 'Phone number is not on WhatsApp'}, 400
+            
+            # Send message with or without attachments on the first idle session
+            # (all attachments go through one dialog, captioned once)
+            if data.get('wait') is False:
+                # Queue on a session's worker and answer right away; the outcome lands in history,
+                # and repeats of the request get it once it is known
+                def report_outcome(future):
+                    if future.exception():
+                        logger.error(f"Queued send to {phone} failed: {future.exception()}")
+                        db.release_send_request(key)
+                        return
+                    finish_idempotent(key, *send_response(future.result()))
+                
+                ensure_bot_pool().submit(coalesced_send, phone, message, attachments=attachment_paths,
+                                         file_type=file_type).add_done_callback(report_outcome)
+                return {'success': True, 'queued': True, 'message': 'Message queued'}, 202
+            return send_response(coalesced_send(ensure_bot_pool().session, phone, message,
+                                                attachments=attachment_paths, file_type=file_type))
+        
+        def send_response(result):
+            if result['success']:
+                return {'success': True, 'message': 'Message sent successfully'}, 200
+            elif result['status'] == 'invalid':
+                return {'success': False, 'status': 'invalid', 'error': 'Phone number is not on WhatsApp'}, 400
+            else:
+                return {'success': False, 'error': 'Failed to send message'}, 500
         
-        if success:
-            # Save to database
-            db.add_message_history(phone, message, 'sent')
-            return jsonify({'success': True, 'message': 'Message sent successfully'})
-        else:
-            db.add_message_history(phone, message, 'failed')
-            return jsonify({'success': False, 'error': 'Failed to send message'}), 500
+        return run_idempotent(key, fingerprint, phone, send)
             
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def reconcile_sent(bot, item, phone, text, history_message, result):
+    """
+    Settle a recipient left in flight by a restart by looking for text in its chat, sent
+    since the item was checkpointed: result with status 'sent' if it is there (logged to
+    history as history_message), None to send again when it is not, and a 'failed' result
+    when the chat cannot tell (sending again could deliver it twice).
+    """
+    # updated_at is the in_flight checkpoint, in SQLite's UTC format
+    since = datetime.strptime(item['updated_at'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+    found = bot.find_sent_message(phone, text, since=since) if text else None
+    if found:
+        db.add_message_history(phone, history_message, 'sent')
+        return dict(result, status='sent', reconciled=True)
+    if found is False:
+        return None
+    return dict(result, status='failed', error='Interrupted by a restart; could not check whether it was sent')
+
+
+def send_bulk_item(bot, payload, item):
+    """Outbox handler for /api/send-bulk: one contact"""
+    # Sent and saved to database through the coalescer
+    result = coalesced_send(bot, item['phone'], payload['message'])
+    return {'phone': item['phone'], 'success': result['success'], 'status': result['status']}
+
+
+def reconcile_send_bulk_item(bot, payload, item):
+    return reconcile_sent(bot, item, item['phone'], payload['message'], payload['message'],
+                          {'phone': item['phone'], 'success': True})
+
+
 @app.route('/api/send-bulk', methods=['POST'])
 def send_bulk_messages():
-    """API endpoint to send bulk messages"""
-    global whatsapp_bot
-    
+    """API endpoint to queue bulk messages; returns the outbox job ID"""
     try:
         data = request.json
         contacts = data.get('contacts', [])
@@ -313,25 +942,16 @@ def send_bulk_messages():
         if not contacts or not message:
             return jsonify({'success': False, 'error': 'Contacts and message are required'}), 400
         
-        # Initialize bot if not already done
-        if whatsapp_bot is None:
-            whatsapp_bot = WhatsAppBot()
-            whatsapp_bot.initialize()
-        
-        results = whatsapp_bot.send_bulk_messages(contacts, message, delay)
-        
-        # Save to database
-        for result in results:
-            status = 'sent' if result['success'] else 'failed'
-            db.add_message_history(result['phone'], message, status)
-        
-        success_count = sum(1 for r in results if r['success'])
+        ensure_bot_pool()
+        phones = [contact.get('phone') if isinstance(contact, dict) else contact for contact in contacts]
+        job_id = outbox.enqueue('send_bulk', {'message': message, 'delay': delay},
+                                [{'phone': phone, 'payload': {'phone': phone}} for phone in phones])
         
         return jsonify({
             'success': True,
-            'message': f'Sent {success_count} out of {len(contacts)} messages',
-            'results': results
-        })
+            'job_id': job_id,
+            'message': f'Queued {len(phones)} messages (job #{job_id})'
+        }), 202
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -599,38 +1219,78 @@ def send_with_attachment():
         # Save file temporarily
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Initialize bot if not already done
-        if whatsapp_bot is None:
-            whatsapp_bot = WhatsAppBot()
-            whatsapp_bot.initialize()
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(0)
+        key, fingerprint = get_idempotency_key(request.form.get('idempotency_key'), phone, message, filename, size)
         
-        # Send message with attachment
-        success = whatsapp_bot.send_message_with_attachment(phone, message, filepath)
-        
-        # Clean up file after sending
-        try:
-            os.remove(filepath)
-        except:
-            pass
+        def send():
+            file.save(filepath)
+            
+            # Send message with attachment; the coalescer merges it with other sends to phone and logs to history
+            result = coalesced_send(ensure_bot_pool().session, phone, message, f"{message} [Attachment: {filename}]",
+                                    attachments=[filepath])
+            success = result['success']
+            
+            # Clean up file after sending
+            try:
+                os.remove(filepath)
+            except:
+                pass
+            
+            if success:
+                return {'success': True, 'message': 'Message with attachment sent successfully'}, 200
+            else:
+                return {'success': False, 'error': 'Failed to send message'}, 500
         
-        if success:
-            db.add_message_history(phone, f"{message} [Attachment: {filename}]", 'sent')
-            return jsonify({'success': True, 'message': 'Message with attachment sent successfully'})
-        else:
-            db.add_message_history(phone, f"{message} [Attachment: {filename}]", 'failed')
-            return jsonify({'success': False, 'error': 'Failed to send message'}), 500
+        return run_idempotent(key, fingerprint, phone, send)
             
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def auto_send_item(bot, payload, item):
+    """Outbox handler for /api/auto-send-attachments: one contact and its matched file"""
+    match = item['payload']
+    message = payload['message']
+    file_name = Path(match['file']).name
+    try:
+        # Ensure absolute path
+        abs_file_path = os.path.abspath(match['file'])
+        
+        # Sent and saved to database through the coalescer
+        result = coalesced_send(bot, match['phone'], message, f"{message} [Auto-sent: {file_name}]",
+                                attachments=[abs_file_path])
+        status = result['status']
+        return {
+            'contact': match['contact'],
+            'phone': match['phone'],
+            'file': file_name,
+            'status': status
+        }
+            
+    except Exception as send_error:
+        return {
+            'contact': match['contact'],
+            'phone': match['phone'],
+            'file': file_name,
+            'status': 'error',
+            'error': str(send_error)
+        }
+
+
+def reconcile_auto_send_item(bot, payload, item):
+    match = item['payload']
+    # Only a caption is time-stamped; a bare file name is found but cannot be dated (settles as failed)
+    file_name = Path(match['file']).name
+    text = payload['message'] or file_name
+    return reconcile_sent(bot, item, match['phone'], text, f"{payload['message']} [Auto-sent: {file_name}]",
+                          {'contact': match['contact'], 'phone': match['phone'], 'file': file_name})
+
+
 @app.route('/api/auto-send-attachments', methods=['POST'])
 def auto_send_attachments():
-    """Fully automated: Match attachments in folder to contacts by name and send"""
-    global whatsapp_bot
-    
+    """Fully automated: Match attachments in folder to contacts by name and queue the sends"""
     try:
         data = request.json
         message = data.get('message', '')  # Optional message to send with attachments
@@ -654,19 +1314,13 @@ def auto_send_attachments():
             return jsonify({'success': False, 'error': f'No files found in {attachments_path}'}), 400
         
         # Initialize bot if needed
-        if whatsapp_bot is None:
-            whatsapp_bot = WhatsAppBot()
-            try:
-                whatsapp_bot.initialize()
-            except Exception as init_error:
-                whatsapp_bot = None
-                return jsonify({'success': False, 'error': f'Failed to initialize bot: {str(init_error)}'}), 500
+        try:
+            ensure_bot_pool()
+        except Exception as init_error:
+            return jsonify({'success': False, 'error': f'Failed to initialize bot: {str(init_error)}'}), 500
         
         # Match files to contacts by name
-        results = []
-        matched_count = 0
-        sent_count = 0
-        failed_count = 0
+        items = []
         
         for contact in contacts:
             # Preserve Unicode characters (Gujarati, Hindi, etc.)
@@ -686,78 +1340,27 @@ def auto_send_attachments():
                     matched_file = file_path
                     break
             
+            match = {'contact': contact['name'], 'phone': contact['phone'], 'file': matched_file}
             if matched_file:
-                matched_count += 1
-                try:
-                    # Send the attachment
-                    import time
-                    time.sleep(delay)
-                    
-                    # Ensure absolute path
-                    abs_file_path = os.path.abspath(matched_file)
-                    
-                    success = whatsapp_bot.send_message_with_attachment(
-                        contact['phone'], 
-                        message, 
-                        abs_file_path
-                    )
-                    
-                    if success:
-                        sent_count += 1
-                        db.add_message_history(
-                            contact['phone'], 
-                            f"{message} [Auto-sent: {Path(matched_file).name}]", 
-                            'sent'
-                        )
-                        results.append({
-                            'contact': contact['name'],
-                            'phone': contact['phone'],
-                            'file': Path(matched_file).name,
-                            'status': 'sent'
-                        })
-                    else:
-                        failed_count += 1
-                        db.add_message_history(
-                            contact['phone'], 
-                            f"{message} [Auto-sent: {Path(matched_file).name}]", 
-                            'failed'
-                        )
-                        results.append({
-                            'contact': contact['name'],
-                            'phone': contact['phone'],
-                            'file': Path(matched_file).name,
-                            'status': 'failed'
-                        })
-                        
-                except Exception as send_error:
-                    failed_count += 1
-                    results.append({
-                        'contact': contact['name'],
-                        'phone': contact['phone'],
-                        'file': Path(matched_file).name,
-                        'status': 'error',
-                        'error': str(send_error)
-                    })
+                items.append({'phone': contact['phone'], 'payload': match})
             else:
-                results.append({
-                    'contact': contact['name'],
-                    'phone': contact['phone'],
-                    'file': None,
-                    'status': 'no_match'
-                })
+                # Settled right away, kept in the job so its results cover every contact
+                items.append({'phone': contact['phone'], 'payload': match, 'status': 'no_match',
+                              'result': dict(match, status='no_match')})
+        
+        matched_count = sum(1 for item in items if item['payload']['file'])
+        job_id = outbox.enqueue('auto_send_attachments', {'message': message, 'delay': delay}, items)
         
         return jsonify({
             'success': True,
-            'message': f'Automation complete: {sent_count} sent, {failed_count} failed, {matched_count} matched out of {len(contacts)} contacts',
+            'job_id': job_id,
+            'message': f'Queued {matched_count} matched out of {len(contacts)} contacts (job #{job_id})',
             'statistics': {
                 'total_contacts': len(contacts),
                 'matched': matched_count,
-                'sent': sent_count,
-                'failed': failed_count,
                 'no_match': len(contacts) - matched_count
-            },
-            'results': results
-        })
+            }
+        }), 202
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -859,17 +1462,16 @@ def schedule_message():
         # Save scheduled message to database
         schedule_id = db.add_scheduled_message(phone, message, scheduled_time)
         
-        # Schedule the job
+        # Schedule the job - it only queues the send, so the scheduler thread is free right away
+        def record_scheduled_result(future):
+            try:
+                db.update_scheduled_message_status(schedule_id, future.result()['status'])
+            except Exception as e:
+                scheduler_logger.error(f"Scheduled message {schedule_id} failed: {e}")
+                db.update_scheduled_message_status(schedule_id, 'failed')
+        
         def send_scheduled_message():
-            global whatsapp_bot
-            if whatsapp_bot is None:
-                whatsapp_bot = WhatsAppBot()
-                whatsapp_bot.initialize()
-            
-            success = whatsapp_bot.send_message(phone, message)
-            status = 'sent' if success else 'failed'
-            db.update_scheduled_message_status(schedule_id, status)
-            db.add_message_history(phone, message, status)
+            ensure_bot_pool().submit(coalesced_send, phone, message).add_done_callback(record_scheduled_result)
         
         scheduled_datetime = datetime.strptime(scheduled_time, '%Y-%m-%dT%H:%M')
         scheduler.add_job(send_scheduled_message, 'date', run_date=scheduled_datetime, id=f'msg_{schedule_id}')
@@ -942,105 +1544,135 @@ def upload_attachment():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def personalize(payload, contact):
+    """A contact's own 'message', or the job's message with {name} filled in"""
+    if contact.get('message') is not None:
+        return contact['message']
+    message = payload['message']
+    return message.replace('{name}', contact.get('name', '')) if message else ''
+
+
+def bulk_history_text(payload, contact):
+    """Personalized bulk message as it is logged to history"""
+    attachment_paths = payload['attachment_paths']
+    personalized_message = personalize(payload, contact)
+    if len(attachment_paths) > 1:
+        names = ', '.join(os.path.basename(path) for path in attachment_paths)
+        return f"[Attachments: {names}] {personalized_message}"
+    if attachment_paths:
+        return f"[Attachment: {os.path.basename(attachment_paths[0])}] {personalized_message}"
+    return personalized_message
+
+
+def bulk_send_item(bot, payload, item):
+    """Outbox handler for /api/bulk-send: one contact"""
+    contact = item['payload']
+    name = contact.get('name', '')
+    number = contact.get('number', '')
+    
+    if not number:
+        return {
+            'name': name,
+            'number': number,
+            'status': 'failed',
+            'error': 'No phone number'
+        }
+    
+    try:
+        logger.info(f"Processing {item['position'] + 1} on session {bot.session_id}: {name} -> {number}")
+        
+        # Personalize message with name
+        personalized_message = personalize(payload, contact)
+        
+        # Attachments (if any) go in one dialog with the caption; the coalescer logs to history
+        result = coalesced_send(bot, number, personalized_message, bulk_history_text(payload, contact),
+                                payload['attachments'], payload['attachment_type'])
+        status = result['status']
+        if result['success']:
+            logger.info(f"Message sent to {number}")
+        else:
+            logger.warning(f"Failed to send message to {number}" + (" (invalid number)" if status == 'invalid' else ""))
+        
+        return {
+            'name': name,
+            'number': number,
+            'status': status
+        }
+            
+    except Exception as e:
+        logger.error(f"Error sending to {name} ({number}): {str(e)}")
+        return {
+            'name': name,
+            'number': number,
+            'status': 'failed',
+            'error': str(e)
+        }
+
+
+def reconcile_bulk_send_item(bot, payload, item):
+    contact = item['payload']
+    text = personalize(payload, contact)
+    if not text and payload['attachment_type'] == 'document' and payload['attachments']:
+        text = os.path.basename(payload['attachments'][-1])
+    return reconcile_sent(bot, item, contact.get('number', ''), text, bulk_history_text(payload, contact),
+                          {'name': contact.get('name', ''), 'number': contact.get('number', '')})
+
+
 @app.route('/api/bulk-send', methods=['POST'])
 def bulk_send():
-    """Send bulk messages with optional attachment"""
+    """Queue bulk messages with optional attachment; returns the outbox job ID"""
     global whatsapp_bot
     
     try:
-        if not whatsapp_bot or not whatsapp_bot.is_logged_in():
+        if not whatsapp_bot or not bot_pool.check_login(whatsapp_bot):
             return jsonify({'success': False, 'error': 'WhatsApp not initialized. Please initialize first.'}), 400
         
         data = request.get_json()
         contacts = data.get('contacts', [])
         message = data.get('message', '')
-        attachment_path = data.get('attachment_path')
+        attachment_paths = get_attachment_paths(data)
         attachment_type = data.get('attachment_type', 'document')  # image, document, audio, video
         delay = int(data.get('delay', 5))
         
         if not contacts:
             return jsonify({'success': False, 'error': 'No contacts provided'}), 400
         
-        if not message and not attachment_path:
+        if not message and not attachment_paths and not any(contact.get('message') for contact in contacts):
             return jsonify({'success': False, 'error': 'Please provide a message or attachment'}), 400
         
-        logger.info(f"Starting bulk send to {len(contacts)} contacts")
+        logger.info(f"Queueing bulk send to {len(contacts)} contacts")
         logger.debug(f"Message: {message[:50]}..." if message else "No message")
-        logger.debug(f"Attachment: {attachment_path}" if attachment_path else "No attachment")
-        
-        results = []
-        import time
-        
-        for i, contact in enumerate(contacts):
-            name = contact.get('name', '')
-            number = contact.get('number', '')
-            
-            if not number:
-                results.append({
-                    'name': name,
-                    'number': number,
-                    'status': 'failed',
-                    'error': 'No phone number'
-                })
-                continue
-            
-            try:
-                logger.info(f"Processing {i+1}/{len(contacts)}: {name} -> {number}")
-                
-                # Personalize message with name
-                personalized_message = message.replace('{name}', name) if message else ''
-                
-                if attachment_path and os.path.exists(attachment_path):
-                    # Send with attachment (pass file_type for correct WhatsApp option)
-                    success = whatsapp_bot.send_message_with_attachment(number, personalized_message, attachment_path, attachment_type)
-                else:
-                    # Send text only
-                    success = whatsapp_bot.send_message(number, personalized_message)
-                
-                status = 'sent' if success else 'failed'
-                if success:
-                    logger.info(f"Message sent to {number}")
-                else:
-                    logger.warning(f"Failed to send message to {number}")
-                
-                # Log to history
-                msg_log = f"{personalized_message}"
-                if attachment_path:
-                    msg_log = f"[Attachment: {os.path.basename(attachment_path)}] {personalized_message}"
-                db.add_message_history(number, msg_log, status)
-                
-                results.append({
-                    'name': name,
-                    'number': number,
-                    'status': status
-                })
-                
-                # Delay between messages (except for last one)
-                if i < len(contacts) - 1:
-                    logger.debug(f"Waiting {delay} seconds before next message...")
-                    time.sleep(delay)
-                    
-            except Exception as e:
-                logger.error(f"Error sending to {name} ({number}): {str(e)}")
-                results.append({
-                    'name': name,
-                    'number': number,
-                    'status': 'failed',
-                    'error': str(e)
-                })
-        
-        sent_count = sum(1 for r in results if r['status'] == 'sent')
-        failed_count = sum(1 for r in results if r['status'] == 'failed')
+        logger.debug(f"Attachments: {', '.join(attachment_paths)}" if attachment_paths else "No attachment")
+        payload = {
+            'message': message,
+            'attachment_paths': attachment_paths,
+            'attachments': [path for path in attachment_paths if os.path.exists(path)],
+            'attachment_type': attachment_type,
+            'delay': delay,
+        }
+        
+        # Numbers WhatsApp already rejected are settled right away, without opening a chat
+        items = [{'phone': contact.get('number', ''), 'payload': contact} for contact in contacts]
+        _, skipped = split_known_invalid(contacts, 'number')
+        for i, contact in skipped:
+            logger.info(f"Skipping {contact['number']}: known invalid number")
+            db.add_message_history(contact['number'], bulk_history_text(payload, contact), 'invalid')
+            items[i]['status'] = 'invalid'
+            items[i]['result'] = {
+                'name': contact.get('name', ''),
+                'number': contact['number'],
+                'status': 'invalid',
+                'error': 'Phone number is not on WhatsApp'
+            }
         
-        logger.info(f"Bulk send complete: {sent_count} sent, {failed_count} failed")
+        job_id = outbox.enqueue('bulk_send', payload, items)
         
         return jsonify({
             'success': True,
-            'message': f'Sent {sent_count}/{len(contacts)} messages',
-            'sent': sent_count,
-            'failed': failed_count,
-            'results': results
-        })
+            'job_id': job_id,
+            'message': f'Queued {len(contacts) - len(skipped)}/{len(contacts)} messages (job #{job_id})',
+            'invalid': len(skipped)
+        }), 202
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1179,7 +1811,7 @@ def send_single_invitation():
     global whatsapp_bot
     
     try:
-        if not whatsapp_bot or not whatsapp_bot.is_logged_in():
+        if not whatsapp_bot or not bot_pool.check_login(whatsapp_bot):
             return jsonify({'success': False, 'error': 'WhatsApp not initialized. Please initialize first.'}), 400
         
         data = request.get_json()
@@ -1192,23 +1824,100 @@ def send_single_invitation():
         if not all([name, number, sangeet, jaan]):
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
         
+        key, fingerprint = get_idempotency_key(data.get('idempotency_key'), number, message, name, sangeet, jaan)
+        
+        def send():
+            # Generate PDF
+            response = requests.post(PDF_GENERATOR_URL, json={
+                'name': name,
+                'sangeet': sangeet,
+                'jaan': jaan
+            }, timeout=30)
+            
+            if response.status_code != 200:
+                return {'success': False, 'error': 'PDF generation failed'}, 500
+            
+            result = response.json()
+            if not result.get('success'):
+                return {'success': False, 'error': 'PDF generation failed'}, 500
+            
+            # Save PDF to uploads/documents folder
+            pdf_data = base64.b64decode(result['pdf_base64'])
+            pdf_filename = f"{name}.pdf"
+            pdf_subfolder = os.path.join(UPLOAD_FOLDER, 'documents')
+            os.makedirs(pdf_subfolder, exist_ok=True)
+            pdf_path = os.path.join(pdf_subfolder, pdf_filename)
+            
+            with open(pdf_path, 'wb') as f:
+                f.write(pdf_data)
+            
+            # Send via WhatsApp (PDF = document type); the coalescer logs to history
+            result = coalesced_send(bot_pool.session, number, message, f"[Invitation PDF: {pdf_filename}] {message}",
+                                    attachments=[pdf_path], file_type='document')
+            success, status = result['success'], result['status']
+            
+            return {
+                'success': success,
+                'message': f'Invitation {"sent" if success else "failed"} to {name}',
+                'status': status
+            }, 200
+            
+        return run_idempotent(key, fingerprint, number, send)
+        
+    except requests.exceptions.ConnectionError:
+        return jsonify({'success': False, 'error': 'Cannot connect to PDF generator'}), 500
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+def send_invitation_item(bot, payload, item):
+    """Outbox handler for /api/invitations/send-bulk: generate one PDF and send it"""
+    inv = item['payload']
+    message = payload['message']
+    try:
+        logger.info(f"Processing invitation {item['position'] + 1} on session {bot.session_id}: {inv['name']} -> {inv['number']}")
+        
         # Generate PDF
+        logger.debug(f"Calling PDF API: {PDF_GENERATOR_URL}")
         response = requests.post(PDF_GENERATOR_URL, json={
-            'name': name,
-            'sangeet': sangeet,
-            'jaan': jaan
+            'name': inv['name'],
+            'sangeet': inv['sangeet'],
+            'jaan': inv['jaan']
         }, timeout=30)
         
+        logger.debug(f"PDF API response status: {response.status_code}")
+        
         if response.status_code != 200:
-            return jsonify({'success': False, 'error': 'PDF generation failed'}), 500
+            logger.error(f"PDF generation failed for {inv['name']}")
+            return {
+                'name': inv['name'],
+                'number': inv['number'],
+                'status': 'failed',
+                'error': 'PDF generation failed'
+            }
         
-        result = response.json()
-        if not result.get('success'):
-            return jsonify({'success': False, 'error': 'PDF generation failed'}), 500
+        # Check if response is JSON or raw PDF
+        content_type = response.headers.get('Content-Type', '')
         
-        # Save PDF to uploads/documents folder
-        pdf_data = base64.b64decode(result['pdf_base64'])
-        pdf_filename = f"{name}.pdf"
+        if 'application/json' in content_type:
+            # JSON response with base64 PDF
+            result = response.json()
+            if not result.get('success'):
+                logger.error(f"PDF API returned error for {inv['name']}")
+                return {
+                    'name': inv['name'],
+                    'number': inv['number'],
+                    'status': 'failed',
+                    'error': 'PDF generation failed'
+                }
+            pdf_data = base64.b64decode(result['pdf_base64'])
+        else:
+            # Raw PDF response
+            pdf_data = response.content
+        
+        # Save PDF to uploads/documents
+        logger.debug(f"Saving PDF for {inv['name']}")
+        pdf_filename = f"{inv['name']}.pdf"
         pdf_subfolder = os.path.join(UPLOAD_FOLDER, 'documents')
         os.makedirs(pdf_subfolder, exist_ok=True)
         pdf_path = os.path.join(pdf_subfolder, pdf_filename)
@@ -1216,32 +1925,51 @@ def send_single_invitation():
         with open(pdf_path, 'wb') as f:
             f.write(pdf_data)
         
-        # Send via WhatsApp (PDF = document type)
-        success = whatsapp_bot.send_message_with_attachment(number, message, pdf_path, 'document')
-        status = 'sent' if success else 'failed'
+        logger.debug(f"PDF saved to {pdf_path}")
         
-        # Log to history
-        db.add_message_history(number, f"[Invitation PDF: {pdf_filename}] {message}", status)
+        # Send via WhatsApp (PDF = document type)
+        logger.info(f"Sending WhatsApp invitation to {inv['number']}")
+        # Sent and logged to history through the coalescer
+        result = coalesced_send(bot, inv['number'], message, f"[Invitation PDF: {pdf_filename}] {message}",
+                                attachments=[pdf_path], file_type='document')
+        status = result['status']
+        if result['success']:
+            logger.info(f"Invitation sent to {inv['number']}")
+        else:
+            logger.warning(f"Failed to send invitation to {inv['number']}")
         
-        return jsonify({
-            'success': success,
-            'message': f'Invitation {"sent" if success else "failed"} to {name}',
+        return {
+            'name': inv['name'],
+            'number': inv['number'],
             'status': status
-        })
-        
-    except requests.exceptions.ConnectionError:
-        return jsonify({'success': False, 'error': 'Cannot connect to PDF generator'}), 500
+        }
+            
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        logger.error(f"Error sending invitation to {inv['name']}: {str(e)}", exc_info=True)
+        return {
+            'name': inv['name'],
+            'number': inv['number'],
+            'status': 'failed',
+            'error': str(e)
+        }
+
+
+def reconcile_invitation_item(bot, payload, item):
+    inv = item['payload']
+    # The caption carries a time stamp; the PDF alone only shows up under its file name
+    pdf_filename = f"{inv['name']}.pdf"
+    return reconcile_sent(bot, item, inv['number'], payload['message'] or pdf_filename,
+                          f"[Invitation PDF: {pdf_filename}] {payload['message']}",
+                          {'name': inv['name'], 'number': inv['number']})
 
 
 @app.route('/api/invitations/send-bulk', methods=['POST'])
 def send_bulk_invitations():
-    """Send invitations to all contacts in the CSV"""
+    """Queue invitations to all contacts in the CSV; returns the outbox job ID"""
     global whatsapp_bot
     
     try:
-        if not whatsapp_bot or not whatsapp_bot.is_logged_in():
+        if not whatsapp_bot or not bot_pool.check_login(whatsapp_bot):
             return jsonify({'success': False, 'error': 'WhatsApp not initialized. Please initialize first.'}), 400
         
         data = request.get_json()
@@ -1271,115 +1999,123 @@ def send_bulk_invitations():
         
         logger.info(f"Found {len(invitations)} invitations to send")
         
-        results = []
-        import time
-        
-        for i, inv in enumerate(invitations):
-            try:
-                logger.info(f"Processing invitation {i+1}/{len(invitations)}: {inv['name']} -> {inv['number']}")
-                
-                # Generate PDF
-                logger.debug(f"Calling PDF API: {PDF_GENERATOR_URL}")
-                response = requests.post(PDF_GENERATOR_URL, json={
-                    'name': inv['name'],
-                    'sangeet': inv['sangeet'],
-                    'jaan': inv['jaan']
-                }, timeout=30)
-                
-                logger.debug(f"PDF API response status: {response.status_code}")
-                
-                if response.status_code != 200:
-                    logger.error(f"PDF generation failed for {inv['name']}")
-                    results.append({
-                        'name': inv['name'],
-                        'number': inv['number'],
-                        'status': 'failed',
-                        'error': 'PDF generation failed'
-                    })
-                    continue
-                
-                # Check if response is JSON or raw PDF
-                content_type = response.headers.get('Content-Type', '')
-                
-                if 'application/json' in content_type:
-                    # JSON response with base64 PDF
-                    result = response.json()
-                    if not result.get('success'):
-                        logger.error(f"PDF API returned error for {inv['name']}")
-                        results.append({
-                            'name': inv['name'],
-                            'number': inv['number'],
-                            'status': 'failed',
-                            'error': 'PDF generation failed'
-                        })
-                        continue
-                    pdf_data = base64.b64decode(result['pdf_base64'])
-                else:
-                    # Raw PDF response
-                    pdf_data = response.content
-                
-                # Save PDF to uploads/documents
-                logger.debug(f"Saving PDF for {inv['name']}")
-                pdf_filename = f"{inv['name']}.pdf"
-                pdf_subfolder = os.path.join(UPLOAD_FOLDER, 'documents')
-                os.makedirs(pdf_subfolder, exist_ok=True)
-                pdf_path = os.path.join(pdf_subfolder, pdf_filename)
-                
-                with open(pdf_path, 'wb') as f:
-                    f.write(pdf_data)
-                
-                logger.debug(f"PDF saved to {pdf_path}")
-                
-                # Send via WhatsApp (PDF = document type)
-                logger.info(f"Sending WhatsApp invitation to {inv['number']}")
-                success = whatsapp_bot.send_message_with_attachment(inv['number'], message, pdf_path, 'document')
-                status = 'sent' if success else 'failed'
-                if success:
-                    logger.info(f"Invitation sent to {inv['number']}")
-                else:
-                    logger.warning(f"Failed to send invitation to {inv['number']}")
-                
-                # Log to history
-                db.add_message_history(inv['number'], f"[Invitation PDF: {pdf_filename}] {message}", status)
-                
-                results.append({
-                    'name': inv['name'],
-                    'number': inv['number'],
-                    'status': status
-                })
-                
-                # Delay between messages (except for last one)
-                if i < len(invitations) - 1:
-                    logger.debug(f"Waiting {delay} seconds before next invitation...")
-                    time.sleep(delay)
-                    
-            except Exception as e:
-                logger.error(f"Error sending invitation to {inv['name']}: {str(e)}", exc_info=True)
-                results.append({
-                    'name': inv['name'],
-                    'number': inv['number'],
-                    'status': 'failed',
-                    'error': str(e)
-                })
-        
-        sent_count = sum(1 for r in results if r['status'] == 'sent')
-        failed_count = sum(1 for r in results if r['status'] == 'failed')
+        # Numbers WhatsApp already rejected get no PDF and no chat
+        items = [{'phone': inv['number'], 'payload': inv} for inv in invitations]
+        _, skipped = split_known_invalid(invitations, 'number')
+        for i, inv in skipped:
+            logger.info(f"Skipping invitation for {inv['name']} ({inv['number']}): known invalid number")
+            db.add_message_history(inv['number'], f"[Invitation PDF: {inv['name']}.pdf] {message}", 'invalid')
+            items[i]['status'] = 'invalid'
+            items[i]['result'] = {
+                'name': inv['name'],
+                'number': inv['number'],
+                'status': 'invalid',
+                'error': 'Phone number is not on WhatsApp'
+            }
         
-        logger.info(f"Invitations complete: {sent_count} sent, {failed_count} failed")
+        job_id = outbox.enqueue('invitations', {'message': message, 'delay': delay}, items)
         
         return jsonify({
             'success': True,
-            'message': f'Sent {sent_count}/{len(invitations)} invitations',
-            'sent': sent_count,
-            'failed': failed_count,
-            'results': results
-        })
+            'job_id': job_id,
+            'total': len(invitations),
+            'message': f'Queued {len(invitations) - len(skipped)}/{len(invitations)} invitations (job #{job_id})',
+            'invalid': len(skipped)
+        }), 202
         
     except Exception as e:
         logger.error(f"Invitations error: {str(e)}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# ============== OUTBOX JOBS ==============
+
+# Job kinds, the handler that sends to one of their recipients, and how a recipient
+# left in flight by a restart is checked against its chat before it is sent again
+outbox.register('send_bulk', send_bulk_item, reconcile_send_bulk_item)
+outbox.register('auto_send_attachments', auto_send_item, reconcile_auto_send_item)
+outbox.register('bulk_send', bulk_send_item, reconcile_bulk_send_item)
+outbox.register('invitations', send_invitation_item, reconcile_invitation_item)
+
+
+@app.route('/api/outbox/jobs', methods=['GET'])
+def list_outbox_jobs():
+    """Most recent outbox jobs with their recipient counts"""
+    try:
+        limit = request.args.get('limit', 20, type=int)
+        return jsonify({'success': True, 'jobs': db.get_outbox_jobs(limit)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/outbox/jobs/<int:job_id>', methods=['GET'])
+def get_outbox_job(job_id):
+    """Status of an outbox job, with every recipient's result unless ?results=0"""
+    try:
+        job = outbox.status(job_id, with_results=request.args.get('results', '1') != '0')
+        if not job:
+            return jsonify({'success': False, 'error': 'Job not found'}), 404
+        return jsonify({'success': True, 'job': job})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/outbox/jobs/<int:job_id>/events')
+def outbox_job_events(job_id):
+    """
+    Server-sent events for an outbox job: an 'item' event as each recipient is settled and a
+    'job' event with the status and counts whenever the job changes state. Recipients settled
+    before the stream opened are replayed first, so a page that reconnects catches up.
+    The stream ends once the job is completed or cancelled.
+    """
+    if not db.get_outbox_job(job_id):
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    def event(name, data):
+        return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+    
+    def stream():
+        # Subscribe before reading the snapshot so nothing settles unseen in between
+        events = outbox.subscribe(job_id)
+        try:
+            for item in db.get_outbox_items(job_id):
+                if item['status'] not in Outbox.UNSETTLED:
+                    yield event('item', item)
+            job = db.get_outbox_job(job_id)
+            yield event('job', job)
+            while job['status'] not in Outbox.FINISHED:
+                try:
+                    name, data = events.get(timeout=OUTBOX_EVENTS_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield event(name, data)
+                if name == 'job':
+                    job = data
+        finally:
+            outbox.unsubscribe(job_id, events)
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/outbox/jobs/<int:job_id>/<action>', methods=['POST'])
+def control_outbox_job(job_id, action):
+    """Pause, resume or cancel an outbox job"""
+    try:
+        controls = {'pause': outbox.pause, 'resume': outbox.resume, 'cancel': outbox.cancel}
+        if action not in controls:
+            return jsonify({'success': False, 'error': f'Unknown action: {action}'}), 400
+        job = db.get_outbox_job(job_id)
+        if not job:
+            return jsonify({'success': False, 'error': 'Job not found'}), 404
+        if not controls[action](job_id):
+            return jsonify({'success': False, 'error': f"Cannot {action} a job that is {job['status']}"}), 409
+        return jsonify({'success': True, 'job': db.get_outbox_job(job_id)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 if __name__ == '__main__':
     logger.info("=" * 50)
     logger.info("WhatsApp Automation Bot Starting")
@@ -0,0 +1,179 @@
+"""
+Bot Latency Benchmark
+Drives a real browser through WhatsAppBot against the offline stand-in
+(fake_whatsapp.py) and reports p50/p90/p99 per send and per bot step.
+
+Usage:  python benchmarks/bench_bot.py --messages 50 --attachments 10 --bulk 20
+        python benchmarks/bench_bot.py --navigation-mode reload --chat-ms 600 --json run.json
+"""
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import functools
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.whatsapp_bot import WhatsAppBot
+from src.selector_cache import SelectorCache
+from benchmarks.fake_whatsapp import FakeWhatsAppServer, add_latency_arguments, latencies_from_args
+
+# Bot internals timed on every call; _wait_for and _find_element are split by what they wait for
+TIMED_STEPS = [
+    '_open_chat', '_open_chat_in_app', '_settle_deliveries', '_run_send_macro', '_type_and_send',
+    '_insert_text', '_wait_for', '_wait_for_outgoing', '_find_element', '_track_last_message',
+]
+
+
+class Timings:
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, name, seconds):
+        self.samples.setdefault(name, []).append(seconds * 1000)
+
+    def instrument(self, bot):
+        """Wrap the bot's step methods so every call is timed"""
+        for name in TIMED_STEPS:
+            method = getattr(bot, name, None)
+            if method:
+                setattr(bot, name, self._wrap(name, method))
+
+    def _wrap(self, name, method):
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            label = name
+            if name == '_wait_for' and len(args) >= 3:
+                label = f'{name}:{args[2]}'
+            elif name == '_wait_for' and 'label' in kwargs:
+                label = f"{name}:{kwargs['label']}"
+            elif name == '_find_element' and kwargs.get('name'):
+                label = f"{name}:{kwargs['name']}"
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.add(label, time.perf_counter() - start)
+        return timed
+
+    def summary(self):
+        return {name: summarize(values) for name, values in self.samples.items()}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50': round(percentile(values, 50), 1),
+        'p90': round(percentile(values, 90), 1),
+        'p99': round(percentile(values, 99), 1),
+        'max': round(max(values), 1),
+    }
+
+
+def random_number(prefix='91'):
+    return prefix + ''.join(random.choice('0123456789') for _ in range(10))
+
+
+def run(args):
+    timings = Timings()
+    profile_dir = tempfile.mkdtemp(prefix='bench_profile_')
+    cache_file = Path(profile_dir) / 'selector_cache.json'
+    attachment = Path(profile_dir) / 'bench_document.txt'
+    attachment.write_text('benchmark attachment\n' * 100)
+    failures = 0
+
+    with FakeWhatsAppServer(latencies=latencies_from_args(args), invalid_prefix=args.invalid_prefix) as server:
+        bot = WhatsAppBot(session_id=args.session_id, navigation_mode=args.navigation_mode,
+                          selector_cache=SelectorCache(cache_file), send_macro=not args.no_macro,
+                          prefill=not args.no_prefill, lean=args.lean, base_url=server.url)
+        # Keep the benchmark browser away from the real WhatsApp profiles
+        bot.profile_name = profile_dir
+        try:
+            start = time.perf_counter()
+            if not bot.initialize(headless=not args.show_browser, browser=args.browser):
+                print("Browser did not start")
+                return 1
+            timings.add('initialize', time.perf_counter() - start)
+            if not bot.wait_for_login(timeout=30):
+                print("Stand-in page did not load")
+                return 1
+            timings.instrument(bot)
+
+            def timed_send(label, send, *send_args, expect=True):
+                nonlocal failures
+                start = time.perf_counter()
+                ok = send(*send_args)
+                timings.add(label, time.perf_counter() - start)
+                # The bot's own spans (see SendTimer) next to the wrapped internals
+                for name, ms in (bot.last_timings or {}).get('spans', {}).items():
+                    timings.add(f'{label}.{name}', ms / 1000)
+                failures += 0 if ok == expect else 1
+
+            for i in range(args.messages):
+                timed_send('send_message', bot.send_message, random_number(), f'Benchmark message {i}')
+            for i in range(args.attachments):
+                timed_send('send_attachment', bot.send_message_with_attachment,
+                           random_number(), f'Benchmark caption {i}', str(attachment))
+            for _ in range(args.invalid):
+                timed_send('send_invalid', bot.send_message, random_number(args.invalid_prefix), 'Never delivered',
+                           expect=False)
+            if args.bulk:
+                contacts = [random_number() for _ in range(args.bulk)]
+                start = time.perf_counter()
+                results = bot.send_bulk_messages(contacts, 'Benchmark bulk message', delay=0)
+                elapsed = time.perf_counter() - start
+                timings.add('send_bulk_total', elapsed)
+                timings.add('send_bulk_per_message', elapsed / len(contacts))
+                failures += sum(1 for r in results if not r['success'])
+        finally:
+            bot.close(keep_browser=False)
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+    report(timings.summary(), failures)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'failures': failures, 'timings': timings.summary()}, f, indent=2)
+    return 1 if failures else 0
+
+
+def report(summary, failures):
+    print(f"\n{'step':<40}{'count':>7}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}   (ms)")
+    for name in sorted(summary):
+        row = summary[name]
+        print(f"{name:<40}{row['count']:>7}{row['p50']:>10}{row['p90']:>10}{row['p99']:>10}{row['max']:>10}")
+    print(f"\nFailed sends: {failures}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark WhatsAppBot against the offline WhatsApp Web stand-in')
+    parser.add_argument('--messages', type=int, default=20, help='single text sends')
+    parser.add_argument('--attachments', type=int, default=5, help='single attachment sends')
+    parser.add_argument('--invalid', type=int, default=2, help='sends to invalid numbers')
+    parser.add_argument('--bulk', type=int, default=10, help='contacts in one send_bulk_messages call')
+    parser.add_argument('--navigation-mode', choices=['in_app', 'reload'], default='in_app')
+    parser.add_argument('--browser', default=None, help='chrome, brave, edge or firefox')
+    parser.add_argument('--session-id', type=int, default=90, help='picks the debug port (9222 + id)')
+    parser.add_argument('--no-macro', action='store_true', help='type with WebDriver calls instead of the send macro')
+    parser.add_argument('--no-prefill', action='store_true', help='do not prefill text through the chat link')
+    parser.add_argument('--lean', action='store_true', help='run the browser in lean mode')
+    parser.add_argument('--show-browser', action='store_true', help='do not run headless')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', metavar='FILE', help='also write the results as JSON')
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
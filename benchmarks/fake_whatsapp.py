@@ -0,0 +1,116 @@
+"""
+Fake WhatsApp Web
+An offline stand-in for web.whatsapp.com that reproduces the parts of the page
+the bot drives - login panel, wa.me in-app navigation, composer, attachment menu
+and preview, outgoing bubbles with clock/tick icons and the invalid-number dialog -
+with configurable latencies, so bot changes can be measured without an account.
+
+Run standalone:  python benchmarks/fake_whatsapp.py --port 8765 --chat-ms 300
+and point a bot at it with WhatsAppBot(base_url='http://127.0.0.1:8765').
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+from pathlib import Path
+
+from flask import Flask
+from werkzeug.serving import make_server
+
+PAGE_FILE = Path(__file__).with_name('fake_whatsapp.html')
+
+DEFAULT_LATENCIES = {
+    # Server delay before the page is returned (network + WhatsApp's bootstrap download)
+    'page_ms': 200,
+    # Time from page load until the chat list (or the QR code) shows up
+    'boot_ms': 500,
+    # Time to open a chat, or to show the invalid-number dialog
+    'chat_ms': 250,
+    # Clock icon -> single tick for text messages
+    'sent_ms': 300,
+    # Single tick -> double tick
+    'delivered_ms': 700,
+    # Clock icon -> single tick for each attachment
+    'upload_ms': 800,
+    # Attach button -> attachment menu
+    'menu_ms': 100,
+    # File chosen -> preview with caption box
+    'preview_ms': 300,
+}
+
+
+def create_app(latencies=None, invalid_prefix='000', logged_in=True):
+    """
+    Flask app serving the stand-in page on / and /send.
+    Numbers starting with invalid_prefix get the invalid-number dialog;
+    with logged_in=False only the QR code is shown.
+    """
+    config = dict(DEFAULT_LATENCIES)
+    config.update(latencies or {})
+    config.update({'invalid_prefix': invalid_prefix, 'logged_in': logged_in})
+    template = PAGE_FILE.read_text(encoding='utf-8')
+
+    app = Flask(__name__)
+
+    @app.route('/')
+    @app.route('/send')
+    def page():
+        time.sleep(config['page_ms'] / 1000)
+        return template.replace('__CONFIG__', json.dumps(config))
+
+    @app.route('/favicon.ico')
+    def favicon():
+        return '', 204
+
+    return app
+
+
+class FakeWhatsAppServer:
+    """Serve the stand-in on a background thread: with FakeWhatsAppServer() as server: server.url"""
+
+    def __init__(self, host='127.0.0.1', port=0, **options):
+        self._server = make_server(host, port, create_app(**options), threaded=True)
+        self.url = f'http://{host}:{self._server.server_port}'
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_latency_arguments(parser):
+    for key, value in DEFAULT_LATENCIES.items():
+        parser.add_argument('--' + key.replace('_', '-'), type=int, default=value, metavar='MS')
+    parser.add_argument('--invalid-prefix', default='000',
+                        help='numbers starting with this get the invalid-number dialog')
+
+
+def latencies_from_args(args):
+    return {key: getattr(args, key) for key in DEFAULT_LATENCIES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline WhatsApp Web stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--logged-out', action='store_true', help='show the QR code instead of the chat list')
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    app = create_app(latencies_from_args(args), args.invalid_prefix, not args.logged_out)
+    print(f"Fake WhatsApp Web on http://{args.host}:{args.port}")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+WhatsApp Bot Pool
+Runs several WhatsAppBot sessions side by side and spreads recipients across them
+"""
+import time
+import queue
+import threading
+from contextlib import contextmanager
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from src.whatsapp_bot import WhatsAppBot
+from src.bot_worker import BotWorker
+from src.logger import bot_logger
+
+logger = bot_logger
+
+
+class BotPool:
+    """Manages N WhatsAppBot sessions, each with its own profile and debug port"""
+
+    def __init__(self, size=1, **bot_options):
+        """bot_options are passed to every WhatsAppBot (e.g. navigation_mode)"""
+        self.size = max(1, int(size))
+        self.bots = [WhatsAppBot(session_id=i, **bot_options) for i in range(self.size)]
+        # One lock per session - whoever holds it owns that browser
+        self._locks = [threading.Lock() for _ in self.bots]
+        # One owner thread per session for queued commands; it takes the same lock per command
+        self.workers = [BotWorker(bot, lock) for bot, lock in zip(self.bots, self._locks)]
+
+    @property
+    def primary(self):
+        """Session 0 - used for the dashboard QR code and login status"""
+        return self.bots[0]
+
+    def get_bot(self, session_id):
+        if 0 <= session_id < len(self.bots):
+            return self.bots[session_id]
+        return None
+
+    def lock_for(self, bot):
+        """The lock that gives exclusive use of bot's browser"""
+        return self._locks[bot.session_id]
+
+    def worker_for(self, bot):
+        return self.workers[bot.session_id]
+
+    def submit(self, command, *args, session_id=None, **kwargs):
+        """
+        Queue command(bot, *args, **kwargs) on a session's worker and return a Future.
+        Without session_id the least loaded started session that is not known
+        to be logged out is used (no browser access, so this never blocks).
+        """
+        if session_id is not None:
+            worker = self.workers[session_id]
+        else:
+            candidates = [w for w in self.workers if w.bot.driver and w.last_login is not False] or [self.workers[0]]
+            worker = min(candidates, key=lambda w: (w.pending() + w.busy + self._locks[w.bot.session_id].locked(),
+                                                    w.bot.session_id))
+        return worker.submit(command, *args, **kwargs)
+    
+    def initialize(self, headless=False, browser=None):
+        """Start every session. Only a failure of the primary session is fatal."""
+        self.primary.initialize(headless=headless, browser=browser)
+        for bot in self.bots[1:]:
+            try:
+                bot.initialize(headless=headless, browser=browser)
+            except Exception as e:
+                logger.warning(f"Session {bot.session_id} failed to start: {e}")
+        return True
+
+    def close(self, keep_browser=None):
+        """Close every session; keep_browser=None leaves attach-mode browsers running"""
+        for worker in self.workers:
+            worker.stop()
+        for bot in self.bots:
+            try:
+                bot.close(keep_browser=keep_browser)
+            except:
+                pass
+
+    def login_state(self, bot, timeout=5):
+        """
+        Login screen state of a session ({'status', 'qr', 'hash', 'error', ...}) from memory,
+        as kept fresh by its worker. The browser is only read if the session was never probed.
+        """
+        if not bot.driver:
+            return {'status': 'not_initialized', 'qr': None, 'hash': None, 'error': 'Bot not initialized'}
+        if bot.login_state is not None:
+            return bot.login_state
+        try:
+            return self.worker_for(bot).get_qr_code().result(timeout)
+        except FutureTimeout:
+            return {'status': 'busy', 'qr': None, 'hash': None, 'error': 'WhatsApp session is busy'}
+
+    def check_login(self, bot, timeout=5):
+        """
+        Whether a session is logged in, answered from memory (see login_state).
+        None if a busy session was never seen logged in or out.
+        """
+        status = self.login_state(bot, timeout)['status']
+        if status in ('logged_in', 'qr_ready'):
+            return status == 'logged_in'
+        if status == 'busy':
+            return self.worker_for(bot).last_login
+        return False
+
+    def ready_bots(self):
+        """Sessions that have a browser and are logged in to WhatsApp"""
+        return [bot for bot in self.bots if bot.driver and self.check_login(bot)]
+
+    def status(self):
+        return [{
+            'session': bot.session_id,
+            'profile': bot.profile_name,
+            'debug_port': bot.debug_port,
+            'initialized': bot.driver is not None,
+            'attached': bot.attached,
+            'logged_in': bool(self.check_login(bot)),
+            'busy': self._locks[bot.session_id].locked(),
+            'queued': self.workers[bot.session_id].pending(),
+        } for bot in self.bots]
+
+    @contextmanager
+    def session(self, timeout=None):
+        """Borrow an idle logged-in session, waiting on the primary if all are busy"""
+        candidates = self.ready_bots() or [self.primary]
+        for bot in candidates:
+            lock = self._locks[bot.session_id]
+            if lock.acquire(blocking=False):
+                try:
+                    yield bot
+                finally:
+                    lock.release()
+                return
+        bot = candidates[0]
+        lock = self._locks[bot.session_id]
+        if not lock.acquire(timeout=-1 if timeout is None else timeout):
+            raise TimeoutError("No WhatsApp session became available")
+        try:
+            yield bot
+        finally:
+            lock.release()
+
+    def dispatch(self, items, handler, delay=0, stop=None):
+        """
+        Run handler(bot, index, item) for every item, handing items to idle sessions.
+        Each session waits `delay` seconds between its own sends, and for its rate limiter's
+        token (if any) before each one. The session is only locked per item, so single sends
+        and the worker get their turn in between.
+        Once the optional stop event is set, sessions finish their current item and
+        leave the rest unhandled (their result stays None).
+        Returns handler results in the same order as items.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        work = queue.Queue()
+        for index, item in enumerate(items):
+            work.put((index, item))
+
+        bots = self.ready_bots() or [self.primary]
+        logger.info(f"Dispatching {len(items)} items across {len(bots)} session(s)")
+
+        def worker(bot):
+            lock = self._locks[bot.session_id]
+            while True:
+                if stop and stop.is_set():
+                    return
+                try:
+                    index, item = work.get_nowait()
+                except queue.Empty:
+                    return
+                if bot.rate_limiter:
+                    # Wait for the session's token before taking its lock, so single sends
+                    # and the worker's probes can use the session meanwhile
+                    bot.rate_limiter.acquire(bot.session_id)
+                    if stop and stop.is_set():
+                        return
+                with lock:
+                    try:
+                        results[index] = handler(bot, index, item)
+                    except Exception as e:
+                        logger.error(f"Session {bot.session_id} failed on item {index}: {e}", exc_info=True)
+                if delay > 0 and not work.empty():
+                    if stop:
+                        stop.wait(delay)
+                    else:
+                        time.sleep(delay)
+
+        threads = [threading.Thread(target=worker, args=(bot,), daemon=True) for bot in bots]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
@@ -0,0 +1,145 @@
+"""
+Bot Worker
+One owner thread per WhatsAppBot that runs queued commands (sends submitted
+through BotPool.submit, QR code reads) one at a time and hands results back through futures.
+While idle it re-reads the login screen so the login state is always in memory,
+and reads the ticks of the session's sent messages.
+"""
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+from src.logger import bot_logger
+
+logger = bot_logger
+
+
+class BotWorker:
+    """
+    Commands are callables taking the bot as first argument. Each runs on the worker
+    thread while holding the bot's pool lock, so it never interleaves with a caller
+    that borrowed the same bot through BotPool.session() or dispatch().
+    """
+
+    _STOP = object()
+    # Seconds between background reads of the login screen while the session is idle (0 = off)
+    PROBE_INTERVAL = 3
+
+    def __init__(self, bot, lock=None, probe_interval=None):
+        self.bot = bot
+        self.lock = lock or threading.Lock()
+        self.probe_interval = self.PROBE_INTERVAL if probe_interval is None else probe_interval
+        self._last_probe = 0
+        # Last known login state (QR reads and background probes), for callers that cannot wait
+        self.last_login = None
+        self._queue = queue.Queue()
+        # Read-only commands (QR code) already queued, by name
+        self._shared = {}
+        self._shared_lock = threading.Lock()
+        self._running = False
+        self._thread = threading.Thread(target=self._run, name=f'bot-worker-{bot.session_id}', daemon=True)
+        self._thread.start()
+
+    @property
+    def busy(self):
+        """True while a command runs or is queued"""
+        return self._running or not self._queue.empty()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def submit(self, command, *args, **kwargs):
+        """Queue command(bot, *args, **kwargs) and return a Future for its result"""
+        future = Future()
+        if threading.current_thread() is self._thread:
+            # A command that submits to its own worker would wait on itself forever
+            self._execute(future, command, args, kwargs)
+        else:
+            self._queue.put((future, command, args, kwargs))
+        return future
+
+    def _submit_shared(self, name, command):
+        """Queue a read-only command once; callers arriving while it is queued share its future"""
+        with self._shared_lock:
+            future = self._shared.get(name)
+            if future is None or future.done():
+                future = self.submit(command)
+                self._shared[name] = future
+            return future
+
+    # Commands
+    def get_qr_code(self):
+        return self._submit_shared('get_qr_code', self._read_login_screen)
+
+    def _read_login_screen(self, bot):
+        state = bot.get_qr_code_base64()
+        # The login screen answers the login question too
+        if state['status'] in ('logged_in', 'qr_ready'):
+            self.last_login = state['status'] == 'logged_in'
+        return state
+
+    def _probe_due_in(self):
+        """Seconds until the next background probe, None if probing is off"""
+        if not self.probe_interval:
+            return None
+        return max(0, self._last_probe + self.probe_interval - time.monotonic())
+
+    def _probe(self):
+        """
+        Refresh the cached login state and collect delivery ticks,
+        unless someone borrowed the browser meanwhile
+        """
+        self._last_probe = time.monotonic()
+        if not self.bot.driver or not self.lock.acquire(blocking=False):
+            return
+        try:
+            if self._read_login_screen(self.bot)['status'] == 'logged_in':
+                self.bot.check_deliveries()
+        except Exception as e:
+            logger.debug(f"Session {self.bot.session_id} login probe failed: {e}")
+        finally:
+            self.lock.release()
+
+    def _execute(self, future, command, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(command(self.bot, *args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def _run(self):
+        while True:
+            try:
+                job = self._queue.get(timeout=self._probe_due_in())
+            except queue.Empty:
+                self._probe()
+                continue
+            if job is self._STOP:
+                return
+            future, command, args, kwargs = job
+            self._running = True
+            try:
+                with self.lock:
+                    self._execute(future, command, args, kwargs)
+            except Exception as e:
+                logger.error(f"Session {self.bot.session_id} worker failed: {e}", exc_info=True)
+            finally:
+                self._running = False
+
+    def stop(self, timeout=None):
+        """Cancel queued commands, let the running one finish and end the thread"""
+        cancelled = 0
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not self._STOP and job[0].cancel():
+                cancelled += 1
+        if cancelled:
+            logger.info(f"Session {self.bot.session_id} worker cancelled {cancelled} queued command(s)")
+        self._queue.put(self._STOP)
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout)
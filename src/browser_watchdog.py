@@ -0,0 +1,124 @@
+"""
+Browser Watchdog
+Keeps an eye on each bot's browser - sends since start, consecutive failures,
+memory use and WebDriver responsiveness - and restarts it on the same profile
+(no QR rescan) when it becomes unhealthy
+"""
+import time
+import threading
+
+from src.logger import bot_logger
+
+logger = bot_logger
+
+
+class BrowserWatchdog:
+    DEFAULTS = {
+        # Restart after this many sends, since a long-lived tab keeps growing
+        'max_sends': 300,
+        # Restart when the browser's resident memory goes above this (needs psutil)
+        'max_rss_mb': 1500,
+        # Restart after this many failed sends in a row
+        'max_consecutive_failures': 3,
+        # A browser that does not answer a trivial script within this many seconds is hung
+        'probe_timeout': 10,
+        # Check memory at most every this many sends (it walks the process tree)
+        'rss_check_every': 10,
+    }
+
+    def __init__(self, **thresholds):
+        self.thresholds = dict(self.DEFAULTS)
+        self.configure(**thresholds)
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def configure(self, **thresholds):
+        """Update thresholds; unknown keys and None values are ignored"""
+        for key, value in thresholds.items():
+            if key in self.DEFAULTS and value is not None:
+                self.thresholds[key] = value
+
+    def _entry(self, bot):
+        with self._lock:
+            return self._state.setdefault(bot.session_id, {
+                'sends': 0, 'consecutive_failures': 0, 'rss_mb': None,
+                'recycles': 0, 'last_recycle': None, 'last_reason': None,
+            })
+
+    def is_responsive(self, bot):
+        """True if the browser runs a trivial script within probe_timeout seconds"""
+        if not bot.driver:
+            return False
+        answer = []
+
+        def probe():
+            try:
+                answer.append(bot.driver.execute_script('return 1') == 1)
+            except Exception:
+                answer.append(False)
+
+        thread = threading.Thread(target=probe, daemon=True)
+        thread.start()
+        thread.join(self.thresholds['probe_timeout'])
+        return bool(answer and answer[0])
+
+    def check(self, bot):
+        """Reason the browser should be recycled before the next send, or None if it is healthy"""
+        entry = self._entry(bot)
+        if not bot.driver:
+            return None
+        if entry['sends'] >= self.thresholds['max_sends']:
+            return f"{entry['sends']} sends since start"
+        if entry['consecutive_failures'] >= self.thresholds['max_consecutive_failures']:
+            return f"{entry['consecutive_failures']} failed sends in a row"
+        if entry['sends'] and entry['sends'] % self.thresholds['rss_check_every'] == 0:
+            entry['rss_mb'] = bot.get_memory_usage()
+            if entry['rss_mb'] is not None and entry['rss_mb'] > self.thresholds['max_rss_mb']:
+                return f"browser uses {entry['rss_mb']} MB"
+        return None
+
+    def before_send(self, bot):
+        """Recycle the browser first if it crossed a threshold"""
+        reason = self.check(bot)
+        if reason:
+            self.recycle(bot, reason)
+
+    def after_send(self, bot, success):
+        """
+        Count the send. A failure is followed by a responsiveness probe; if the browser
+        is dead or hung it is recycled and True is returned so the caller can retry.
+        """
+        entry = self._entry(bot)
+        entry['sends'] += 1
+        # An invalid number is WhatsApp's answer, not a browser problem
+        if success or bot.last_number_invalid:
+            entry['consecutive_failures'] = 0
+            return False
+        entry['consecutive_failures'] += 1
+        if not self.is_responsive(bot):
+            self.recycle(bot, "browser stopped responding")
+            return bool(bot.driver)
+        return False
+
+    def recycle(self, bot, reason):
+        logger.warning(f"Recycling browser of session {bot.session_id}: {reason}")
+        entry = self._entry(bot)
+        start = time.time()
+        try:
+            bot.restart()
+            logger.info(f"Session {bot.session_id} browser recycled in {time.time() - start:.1f}s")
+        except Exception as e:
+            logger.error(f"Could not recycle session {bot.session_id}: {e}", exc_info=True)
+        entry.update({
+            'sends': 0, 'consecutive_failures': 0, 'rss_mb': None,
+            'recycles': entry['recycles'] + 1,
+            'last_recycle': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'last_reason': reason,
+        })
+
+    def stats(self):
+        with self._lock:
+            return {
+                'thresholds': dict(self.thresholds),
+                'sessions': {session_id: dict(entry) for session_id, entry in self._state.items()},
+            }
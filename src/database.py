@@ -1,4 +1,5 @@
 import sqlite3
+import json
 import os
 from datetime import datetime
 from contextlib import contextmanager
@@ -79,6 +80,24 @@ class Database:
                 )
             ''')
             
+            # Columns added after the first release
+            self._add_missing_columns(cursor, 'message_history', {
+                'wa_message_id': 'TEXT',
+                'delivery_status': 'TEXT',
+            })
+            
+            # Per-send timing spans and WebDriver command counts (one row per timed history entry)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS send_timings (
+                    history_id INTEGER PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    total_ms REAL NOT NULL,
+                    commands INTEGER NOT NULL,
+                    spans TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
             # Create scheduled messages table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS scheduled_messages (
@@ -91,8 +110,68 @@ class Database:
                 )
             ''')
             
+            # Bulk jobs queued for the background sender, one outbox row per recipient
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS outbox_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT DEFAULT 'queued',
+                    total INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    phone TEXT,
+                    payload TEXT NOT NULL,
+                    status TEXT DEFAULT 'pending',
+                    result TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (job_id) REFERENCES outbox_jobs(id) ON DELETE CASCADE
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_job_status ON outbox (job_id, status)')
+            
+            # Idempotency keys of single sends and the response they got, so a retried request is not sent twice
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS send_requests (
+                    idempotency_key TEXT NOT NULL,
+                    phone TEXT,
+                    fingerprint TEXT,
+                    status TEXT NOT NULL DEFAULT 'in_progress',
+                    response_code INTEGER,
+                    response TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_send_requests_key ON send_requests (idempotency_key)')
+            
+            # Create invalid numbers table (numbers WhatsApp reported as not on WhatsApp)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS invalid_numbers (
+                    phone TEXT PRIMARY KEY,
+                    checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
             conn.commit()
     
+    def _add_missing_columns(self, cursor, table, columns):
+        """Add columns that an older database file does not have yet"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row['name'] for row in cursor.fetchall()}
+        for name, column_type in columns.items():
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+                logger.info(f"Added column {table}.{name}")
+    
     # Contact operations
     def add_contact(self, name, phone):
         """Add a new contact"""
@@ -241,15 +320,61 @@ class Database:
             return contacts
 
     # Message history operations
-    def add_message_history(self, phone, message, status='sent'):
-        """Add a message to history"""
+    def add_message_history(self, phone, message, status='sent', wa_message_id=None, timings=None):
+        """
+        Add a message to history. wa_message_id links it to the bubble whose ticks are tracked;
+        timings (the bot's last_timings) are stored alongside in send_timings.
+        """
+        delivery_status = 'pending' if wa_message_id else None
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                'INSERT INTO message_history (phone, message, status) VALUES (?, ?, ?)',
-                (phone, message, status)
+                'INSERT INTO message_history (phone, message, status, wa_message_id, delivery_status) VALUES (?, ?, ?, ?, ?)',
+                (phone, message, status, wa_message_id, delivery_status)
             )
-            return cursor.lastrowid
+            history_id = cursor.lastrowid
+            if timings:
+                cursor.execute(
+                    'INSERT INTO send_timings (history_id, kind, total_ms, commands, spans) VALUES (?, ?, ?, ?, ?)',
+                    (history_id, timings['kind'], timings['total_ms'], timings['commands'], json.dumps(timings['spans']))
+                )
+            return history_id
+    
+    def get_send_timings(self, limit=500, kind=None):
+        """Get the most recent send timings with their history status, spans decoded"""
+        query = '''
+            SELECT t.*, h.phone, h.status FROM send_timings t
+            JOIN message_history h ON h.id = t.history_id
+        '''
+        params = []
+        if kind:
+            query += ' WHERE t.kind = ?'
+            params.append(kind)
+        query += ' ORDER BY t.history_id DESC LIMIT ?'
+        params.append(limit)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = [dict(row) for row in cursor.fetchall()]
+        for row in rows:
+            row['spans'] = json.loads(row['spans'])
+        return rows
+    
+    def update_delivery_status(self, wa_message_id, delivery_status):
+        """Store the settled tick status of a sent message; a failed delivery also fails the message"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if delivery_status == 'failed':
+                cursor.execute(
+                    "UPDATE message_history SET delivery_status = ?, status = 'failed' WHERE wa_message_id = ?",
+                    (delivery_status, wa_message_id)
+                )
+            else:
+                cursor.execute(
+                    'UPDATE message_history SET delivery_status = ? WHERE wa_message_id = ?',
+                    (delivery_status, wa_message_id)
+                )
+            return cursor.rowcount > 0
     
     def get_message_history(self, limit=100):
         """Get message history"""
@@ -310,6 +435,222 @@ class Database:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM scheduled_messages WHERE id = ?', (schedule_id,))
     
+    # Outbox operations
+    @staticmethod
+    def _outbox_row(row):
+        row = dict(row)
+        for key in ('payload', 'result'):
+            if row.get(key) is not None:
+                row[key] = json.loads(row[key])
+        return row
+    
+    def add_outbox_job(self, kind, payload, items):
+        """
+        Queue a bulk job. items are dicts with 'phone' and 'payload', plus optionally a final
+        'status' and 'result' for recipients that are settled without sending (e.g. known invalid).
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'INSERT INTO outbox_jobs (kind, payload, total) VALUES (?, ?, ?)',
+                (kind, json.dumps(payload), len(items))
+            )
+            job_id = cursor.lastrowid
+            cursor.executemany(
+                'INSERT INTO outbox (job_id, position, phone, payload, status, result) VALUES (?, ?, ?, ?, ?, ?)',
+                [(job_id, position, item.get('phone'), json.dumps(item['payload']), item.get('status', 'pending'),
+                  json.dumps(item['result']) if item.get('result') is not None else None)
+                 for position, item in enumerate(items)]
+            )
+            return job_id
+    
+    def get_outbox_job(self, job_id):
+        """Get a job with its recipient counts per status"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM outbox_jobs WHERE id = ?', (job_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            job = self._outbox_row(row)
+            cursor.execute('SELECT status, COUNT(*) as count FROM outbox WHERE job_id = ? GROUP BY status', (job_id,))
+            job['counts'] = {r['status']: r['count'] for r in cursor.fetchall()}
+            return job
+    
+    def get_outbox_jobs(self, limit=20):
+        """Get the most recent jobs with their recipient counts"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM outbox_jobs ORDER BY id DESC LIMIT ?', (limit,))
+            job_ids = [row['id'] for row in cursor.fetchall()]
+        return [self.get_outbox_job(job_id) for job_id in job_ids]
+    
+    def next_outbox_job(self):
+        """Oldest job that is waiting to be sent"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM outbox_jobs WHERE status IN ('queued', 'running') ORDER BY id LIMIT 1")
+            row = cursor.fetchone()
+            return self._outbox_row(row) if row else None
+    
+    def set_outbox_job_status(self, job_id, status, only_from=None):
+        """Change a job's status; with only_from, only if its current status is one of those"""
+        query = 'UPDATE outbox_jobs SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?'
+        params = [status, job_id]
+        if only_from:
+            query += f" AND status IN ({', '.join('?' for _ in only_from)})"
+            params.extend(only_from)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            return cursor.rowcount > 0
+    
+    def requeue_interrupted_outbox_jobs(self):
+        """Queue the jobs a previous run left running again, so they resume; returns their IDs"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM outbox_jobs WHERE status = 'running'")
+            job_ids = [row['id'] for row in cursor.fetchall()]
+            cursor.execute("UPDATE outbox_jobs SET status = 'queued', updated_at = CURRENT_TIMESTAMP WHERE status = 'running'")
+            return job_ids
+    
+    def get_outbox_items(self, job_id, statuses=None):
+        """Get a job's recipients in their original order, optionally only those in the given statuses"""
+        query = 'SELECT * FROM outbox WHERE job_id = ?'
+        params = [job_id]
+        if statuses:
+            query += f" AND status IN ({', '.join('?' for _ in statuses)})"
+            params.extend(statuses)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query + ' ORDER BY position', params)
+            return [self._outbox_row(row) for row in cursor.fetchall()]
+    
+    def start_outbox_item(self, item_id):
+        """Checkpoint a recipient as in flight right before it is sent"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE outbox SET status = 'in_flight', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (item_id,)
+            )
+    
+    def update_outbox_item(self, item_id, status, result=None):
+        """Record the outcome of one recipient"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'UPDATE outbox SET status = ?, result = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                (status, json.dumps(result) if result is not None else None, item_id)
+            )
+    
+    def cancel_outbox_items(self, job_id):
+        """Cancel a job's recipients that were not sent yet (or were left in flight by a restart)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE outbox SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP WHERE job_id = ? AND status IN ('pending', 'in_flight')",
+                (job_id,)
+            )
+            return cursor.rowcount
+    
+    # Idempotency operations
+    def claim_send_request(self, idempotency_key, phone, fingerprint, window_seconds):
+        """
+        Claim an idempotency key for a send. Returns None if the caller now owns it, or the
+        earlier claim: 'in_progress', or 'done' within window_seconds with its response.
+        Claims in progress never expire, however long the send waits for a session.
+        The unique index makes the claim atomic across threads.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM send_requests WHERE status = 'done' AND created_at < datetime('now', '-' || ? || ' seconds')",
+                (window_seconds,)
+            )
+            try:
+                cursor.execute(
+                    'INSERT INTO send_requests (idempotency_key, phone, fingerprint) VALUES (?, ?, ?)',
+                    (idempotency_key, phone, fingerprint)
+                )
+                return None
+            except sqlite3.IntegrityError:
+                cursor.execute('SELECT * FROM send_requests WHERE idempotency_key = ?', (idempotency_key,))
+                row = dict(cursor.fetchone())
+                row['response'] = json.loads(row['response']) if row['response'] else None
+                return row
+    
+    def complete_send_request(self, idempotency_key, response_code, response):
+        """Store the response of a claimed send for its repeats"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE send_requests SET status = 'done', response_code = ?, response = ? WHERE idempotency_key = ?",
+                (response_code, json.dumps(response), idempotency_key)
+            )
+    
+    def release_send_request(self, idempotency_key):
+        """Drop a claim whose send failed or did not produce a response, so a retry sends again"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM send_requests WHERE idempotency_key = ?', (idempotency_key,))
+    
+    def release_unfinished_send_requests(self):
+        """Drop claims still in progress, e.g. when the process starts and no send can be running"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM send_requests WHERE status = 'in_progress'")
+            return cursor.rowcount
+    
+    # Invalid number operations
+    @staticmethod
+    def _phone_key(phone):
+        """Numbers are cached by their digits only, as WhatsApp sees them"""
+        return ''.join(filter(str.isdigit, str(phone)))
+    
+    def add_invalid_number(self, phone):
+        """Remember that WhatsApp reported a number as invalid"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'INSERT OR REPLACE INTO invalid_numbers (phone, checked_at) VALUES (?, CURRENT_TIMESTAMP)',
+                (self._phone_key(phone),)
+            )
+    
+    def is_invalid_number(self, phone, ttl_days=30):
+        """True if the number was reported invalid within the last ttl_days"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT 1 FROM invalid_numbers WHERE phone = ? AND checked_at >= datetime('now', '-' || ? || ' days')",
+                (self._phone_key(phone), ttl_days)
+            )
+            return cursor.fetchone() is not None
+    
+    def get_invalid_numbers(self, ttl_days=30):
+        """Get cached invalid numbers that have not expired"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM invalid_numbers WHERE checked_at >= datetime('now', '-' || ? || ' days') ORDER BY checked_at DESC",
+                (ttl_days,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def remove_invalid_number(self, phone):
+        """Forget a cached invalid number so it is tried again"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM invalid_numbers WHERE phone = ?', (self._phone_key(phone),))
+            return cursor.rowcount > 0
+    
+    def clear_invalid_numbers(self):
+        """Forget all cached invalid numbers"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM invalid_numbers')
+            return cursor.rowcount
+    
     # Statistics operations
     def get_statistics(self):
         """Get statistics for the dashboard"""
@@ -328,6 +669,10 @@ class Database:
             cursor.execute("SELECT COUNT(*) as count FROM message_history WHERE status = 'failed'")
             failed_messages = cursor.fetchone()['count']
             
+            # Messages skipped or rejected because the number is not on WhatsApp
+            cursor.execute("SELECT COUNT(*) as count FROM message_history WHERE status = 'invalid'")
+            invalid_messages = cursor.fetchone()['count']
+            
             # Total contacts
             cursor.execute('SELECT COUNT(*) as count FROM contacts')
             total_contacts = cursor.fetchone()['count']
@@ -340,6 +685,7 @@ class Database:
                 'total_messages': total_messages,
                 'sent_messages': sent_messages,
                 'failed_messages': failed_messages,
+                'invalid_messages': invalid_messages,
                 'total_contacts': total_contacts,
                 'scheduled_messages': scheduled_messages
             }
@@ -352,4 +698,6 @@ class Database:
                 "DELETE FROM message_history WHERE created_at < datetime('now', '-' || ? || ' days')",
                 (days,)
             )
-            return cursor.rowcount
+            removed = cursor.rowcount
+            cursor.execute('DELETE FROM send_timings WHERE history_id NOT IN (SELECT id FROM message_history)')
+            return removed
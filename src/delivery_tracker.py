@@ -0,0 +1,66 @@
+"""
+Delivery Tracker
+Follows outgoing messages by their WhatsApp data-id until their clock icon
+turns into a tick, so the bot can move on right after pressing send
+"""
+import time
+import threading
+
+from src.logger import bot_logger
+
+logger = bot_logger
+
+
+class DeliveryTracker:
+    PENDING = 'pending'
+    # Final states - the message left the outbox (or failed to)
+    SETTLED = ('sent', 'delivered', 'read', 'failed')
+    # Reported when a message could not be confirmed before its chat was left
+    UNCONFIRMED = 'unconfirmed'
+
+    def __init__(self, on_settle=None, timeout=600):
+        """on_settle(message_id, status) is called once per message when its status is final"""
+        self.on_settle = on_settle
+        self.timeout = timeout
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def track(self, message_id, phone, session_id=0):
+        """Start following a message sent from the given bot session"""
+        with self._lock:
+            self._pending[message_id] = {'phone': phone, 'session_id': session_id, 'sent_at': time.time()}
+
+    def pending_ids(self, session_id=None):
+        with self._lock:
+            return [message_id for message_id, entry in self._pending.items()
+                    if session_id is None or entry['session_id'] == session_id]
+
+    def update(self, statuses, leaving=False):
+        """
+        Apply statuses read from the page ({message_id: status or None if not on screen}).
+        Messages still pending (or off screen) stay tracked until timeout, then they are
+        reported as unconfirmed. With leaving=True they will not be seen again (the browser
+        is closing or restarting), so they are reported as unconfirmed right away.
+        """
+        settled = []
+        now = time.time()
+        with self._lock:
+            for message_id, status in statuses.items():
+                entry = self._pending.get(message_id)
+                if entry is None:
+                    continue
+                if status in self.SETTLED:
+                    settled.append((message_id, status))
+                elif leaving or now - entry['sent_at'] > self.timeout:
+                    settled.append((message_id, self.UNCONFIRMED))
+            for message_id, _ in settled:
+                self._pending.pop(message_id, None)
+
+        for message_id, status in settled:
+            logger.debug(f"Message {message_id} settled as {status}")
+            if self.on_settle:
+                try:
+                    self.on_settle(message_id, status)
+                except Exception as e:
+                    logger.error(f"Delivery callback failed for {message_id}: {e}")
+        return settled
@@ -0,0 +1,162 @@
+"""
+Media Cache
+Downscales and recompresses images before they are uploaded, without their
+metadata, and keeps the result under a hash of the original's content so a
+bulk campaign processes each picture once
+"""
+import os
+import hashlib
+import threading
+from pathlib import Path
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None  # Without Pillow images are sent as they are
+
+from src.logger import bot_logger
+
+logger = bot_logger
+
+
+class MediaPreprocessor:
+    DEFAULTS = {
+        # Off: every file is uploaded untouched
+        'enabled': True,
+        # Longest side in pixels; WhatsApp scales photos down to about this anyway
+        'max_dimension': 1600,
+        # JPEG quality of the processed image
+        'quality': 80,
+    }
+    # Animated GIFs and vector images are left alone
+    IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff', '.heic'}
+
+    def __init__(self, cache_dir, **settings):
+        self.cache_dir = Path(cache_dir)
+        self.settings = dict(self.DEFAULTS)
+        self.configure(**settings)
+        self._lock = threading.Lock()
+        # Per cache key, so two sessions never process the same picture at once
+        self._key_locks = {}
+        # (path, size, mtime) -> content hash, so a file is not re-read for every recipient
+        self._hashes = {}
+        # bytes_saved adds up over every upload that used a processed copy
+        self._stats = {'hits': 0, 'processed': 0, 'skipped': 0, 'bytes_saved': 0}
+
+    @staticmethod
+    def available():
+        return Image is not None
+
+    def configure(self, **settings):
+        """Update settings; unknown keys and None values are ignored"""
+        for key, value in settings.items():
+            if key in self.DEFAULTS and value is not None:
+                self.settings[key] = value
+
+    def _content_hash(self, file_path):
+        stat = os.stat(file_path)
+        identity = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._hashes.get(identity)
+        if cached:
+            return cached
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        with self._lock:
+            self._hashes[identity] = content_hash
+        return content_hash
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def prepare(self, file_path):
+        """
+        Path to upload for file_path: the cached processed copy of an image, or file_path itself
+        when preprocessing is off, Pillow is missing, the file is not a still image,
+        or processing would not make it smaller.
+        """
+        if not self.settings['enabled'] or Image is None:
+            return file_path
+        if Path(file_path).suffix.lower() not in self.IMAGE_EXTENSIONS:
+            return file_path
+        try:
+            max_dimension, quality = int(self.settings['max_dimension']), int(self.settings['quality'])
+            key = f"{self._content_hash(file_path)[:32]}_{max_dimension}_{quality}"
+            target = self.cache_dir / f'{key}.jpg'
+            skipped = self.cache_dir / f'{key}.original'
+            with self._key_lock(key):
+                if target.exists():
+                    self._count('hits', os.path.getsize(file_path) - target.stat().st_size)
+                    return str(target)
+                if skipped.exists():
+                    self._count('hits')
+                    return file_path
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                if self._process(file_path, target, max_dimension, quality):
+                    self._count('processed', os.path.getsize(file_path) - os.path.getsize(target))
+                    return str(target)
+                # Remember that this picture is best sent as is
+                skipped.touch()
+                self._count('skipped')
+                return file_path
+        except Exception as e:
+            logger.warning(f"Could not preprocess {file_path}, sending the original: {e}")
+            return file_path
+
+    def _process(self, file_path, target, max_dimension, quality):
+        """Write the downscaled, metadata-free JPEG to target; False if it would not be smaller"""
+        with Image.open(file_path) as image:
+            if getattr(image, 'is_animated', False):
+                return False
+            # Apply the EXIF rotation before the EXIF data is dropped
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+            partial = target.with_suffix('.part')
+            # No exif/icc arguments: metadata is not carried over
+            image.save(partial, 'JPEG', quality=quality, optimize=True, progressive=True)
+        if os.path.getsize(partial) >= os.path.getsize(file_path):
+            partial.unlink()
+            return False
+        os.replace(partial, target)
+        logger.info(f"Preprocessed {Path(file_path).name}: {os.path.getsize(file_path) // 1024} KB -> "
+                    f"{os.path.getsize(target) // 1024} KB")
+        return True
+
+    def _count(self, name, saved=0):
+        with self._lock:
+            self._stats[name] += 1
+            self._stats['bytes_saved'] += max(0, saved)
+
+    def stats(self):
+        files = list(self.cache_dir.glob('*.jpg')) if self.cache_dir.exists() else []
+        with self._lock:
+            return {
+                'available': self.available(),
+                'settings': dict(self.settings),
+                'files': len(files),
+                'size_bytes': sum(f.stat().st_size for f in files),
+                **self._stats,
+            }
+
+    def clear(self):
+        """Delete every cached image; returns how many files were removed"""
+        removed = 0
+        if self.cache_dir.exists():
+            for f in self.cache_dir.iterdir():
+                if f.suffix in ('.jpg', '.original', '.part'):
+                    f.unlink(missing_ok=True)
+                    removed += 1
+        with self._lock:
+            self._hashes.clear()
+        return removed
@@ -0,0 +1,217 @@
+"""
+Outbox
+Background sender for bulk jobs. Endpoints store a job with one outbox row per
+recipient and return its ID right away; a worker thread drains the jobs oldest
+first through the bot pool and checkpoints every recipient as it goes
+(pending -> in_flight -> sent / failed / ...), so a restart resumes where it stopped.
+Progress is published to subscribers (the job's event stream) as it happens.
+"""
+import queue
+import threading
+
+from src.logger import bot_logger
+
+logger = bot_logger
+
+
+class Outbox:
+    # Jobs that will not send anything more
+    FINISHED = ('completed', 'cancelled', 'failed')
+    # Recipients still to be sent; in_flight ones were being sent when the process stopped
+    UNSETTLED = ('pending', 'in_flight')
+    # Seconds between checks for new jobs or a logged-in session while idle
+    POLL_INTERVAL = 5
+
+    def __init__(self, db, get_pool, send_delay=None):
+        """
+        get_pool() returns the BotPool, or None while no session was started.
+        send_delay(delay) turns a job's requested delay into the pause between a session's sends.
+        """
+        self.db = db
+        self._get_pool = get_pool
+        self._send_delay = send_delay or (lambda delay: delay)
+        self._handlers = {}
+        self._reconcilers = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        # The job being sent, and the event / reason that stops it early
+        self._current = None
+        self._halt = threading.Event()
+        self._halt_reason = None
+        self._thread = None
+        # job_id -> queues of the open event streams for that job
+        self._subscribers = {}
+        interrupted = db.requeue_interrupted_outbox_jobs()
+        if interrupted:
+            logger.warning(f"Outbox jobs {interrupted} were interrupted and resume once a session is ready")
+
+    def register(self, kind, handler, reconcile=None):
+        """
+        handler(bot, payload, item) sends to one recipient and returns its result dict,
+        whose 'status' becomes the outbox row's status. payload is the job's payload.
+        reconcile(bot, payload, item) is asked first for recipients left in flight by a restart:
+        it returns their result if they can be settled without sending (e.g. the message is
+        already in the chat), or None to send again. Without it they are sent again.
+        """
+        self._handlers[kind] = handler
+        if reconcile:
+            self._reconcilers[kind] = reconcile
+
+    def start(self):
+        """Start the worker thread (once); called on first use so only the serving process sends"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='outbox', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def subscribe(self, job_id):
+        """Queue that receives ('job', job) and ('item', item) events of job_id until unsubscribed"""
+        events = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(job_id, []).append(events)
+        return events
+
+    def unsubscribe(self, job_id, events):
+        with self._lock:
+            subscribers = self._subscribers.get(job_id, [])
+            if events in subscribers:
+                subscribers.remove(events)
+            if not subscribers:
+                self._subscribers.pop(job_id, None)
+
+    def _publish(self, job_id, kind, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(job_id, []))
+        for events in subscribers:
+            events.put((kind, data))
+
+    def _publish_job(self, job_id):
+        """Send the job's status and counts to its subscribers"""
+        if self._subscribers.get(job_id):
+            self._publish(job_id, 'job', self.db.get_outbox_job(job_id))
+
+    def enqueue(self, kind, payload, items):
+        """Store a job (see Database.add_outbox_job) and return its ID"""
+        if kind not in self._handlers:
+            raise ValueError(f"No outbox handler for {kind}")
+        job_id = self.db.add_outbox_job(kind, payload, items)
+        logger.info(f"Queued outbox job {job_id} ({kind}) with {len(items)} recipient(s)")
+        self.start()
+        return job_id
+
+    def pause(self, job_id):
+        """Stop sending a job after the recipients in progress; True if it was waiting or running"""
+        with self._lock:
+            if not self.db.set_outbox_job_status(job_id, 'paused', only_from=('queued', 'running')):
+                return False
+            if self._current == job_id:
+                self._halt_reason = 'paused'
+                self._halt.set()
+        logger.info(f"Outbox job {job_id} paused")
+        self._publish_job(job_id)
+        return True
+
+    def resume(self, job_id):
+        """Queue a paused job again; recipients already handled are not sent again"""
+        if not self.db.set_outbox_job_status(job_id, 'queued', only_from=('paused',)):
+            return False
+        logger.info(f"Outbox job {job_id} resumed")
+        self._publish_job(job_id)
+        self.start()
+        return True
+
+    def cancel(self, job_id):
+        """Drop a job's unsent recipients; the ones in progress still finish"""
+        with self._lock:
+            if not self.db.set_outbox_job_status(job_id, 'cancelled', only_from=('queued', 'running', 'paused')):
+                return False
+            if self._current == job_id:
+                # The worker cancels the remaining rows once the sessions have stopped
+                self._halt_reason = 'cancelled'
+                self._halt.set()
+            else:
+                self.db.cancel_outbox_items(job_id)
+        logger.info(f"Outbox job {job_id} cancelled")
+        if self._current != job_id:
+            self._publish_job(job_id)
+        return True
+
+    def _run(self):
+        waiting_for = None
+        while True:
+            self._wake.clear()
+            try:
+                job = self.db.next_outbox_job()
+                pool = self._get_pool()
+                if job and pool and pool.ready_bots():
+                    waiting_for = None
+                    self._run_job(job, pool)
+                    continue
+                if job and waiting_for != job['id']:
+                    waiting_for = job['id']
+                    logger.info(f"Outbox job {job['id']} waits for a logged-in WhatsApp session")
+            except Exception as e:
+                logger.error(f"Outbox worker failed: {e}", exc_info=True)
+            self._wake.wait(self.POLL_INTERVAL)
+
+    def _run_job(self, job, pool):
+        job_id = job['id']
+        handler = self._handlers.get(job['kind'])
+        if handler is None:
+            logger.error(f"Outbox job {job_id} has unknown kind {job['kind']}")
+            self.db.set_outbox_job_status(job_id, 'failed')
+            return
+        with self._lock:
+            if not self.db.set_outbox_job_status(job_id, 'running', only_from=('queued', 'running')):
+                return
+            self._current = job_id
+            self._halt_reason = None
+            self._halt.clear()
+        self._publish_job(job_id)
+
+        items = self.db.get_outbox_items(job_id, statuses=self.UNSETTLED)
+        logger.info(f"Outbox job {job_id} ({job['kind']}): {len(items)} recipient(s) to send")
+        reconcile = self._reconcilers.get(job['kind'])
+
+        def send(bot, index, item):
+            result = None
+            if item['status'] == 'in_flight' and reconcile:
+                try:
+                    result = reconcile(bot, job['payload'], item)
+                except Exception as e:
+                    logger.warning(f"Outbox job {job_id} could not reconcile {item['phone']}: {e}")
+                if result is not None:
+                    logger.info(f"Outbox job {job_id}: {item['phone']} settled as {result.get('status')} without sending")
+            if result is None:
+                self.db.start_outbox_item(item['id'])
+                try:
+                    result = handler(bot, job['payload'], item)
+                except Exception as e:
+                    logger.error(f"Outbox job {job_id} failed on {item['phone']}: {e}", exc_info=True)
+                    result = {'status': 'failed', 'error': str(e)}
+            status = result.get('status', 'failed')
+            self.db.update_outbox_item(item['id'], status, result)
+            self._publish(job_id, 'item', dict(item, status=status, result=result))
+
+        try:
+            pool.dispatch(items, send, self._send_delay(job['payload'].get('delay', 0)), stop=self._halt)
+        finally:
+            with self._lock:
+                self._current = None
+                reason = self._halt_reason
+                if reason == 'cancelled':
+                    self.db.cancel_outbox_items(job_id)
+                elif reason is None:
+                    self.db.set_outbox_job_status(job_id, 'completed', only_from=('running',))
+        counts = self.db.get_outbox_job(job_id)['counts']
+        logger.info(f"Outbox job {job_id} {reason or 'completed'}: {counts}")
+        self._publish_job(job_id)
+
+    def status(self, job_id, with_results=False):
+        """A job with its counts and, with_results, every recipient's result in order"""
+        job = self.db.get_outbox_job(job_id)
+        if job and with_results:
+            job['results'] = [item['result'] or {**item['payload'], 'status': item['status']}
+                              for item in self.db.get_outbox_items(job_id)]
+        return job
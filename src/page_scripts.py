@@ -0,0 +1,461 @@
+"""
+JavaScript snippets injected into WhatsApp Web by WhatsAppBot
+Kept here so the bot code stays readable and scripts can be reused
+"""
+
+# Resolve as soon as one of the XPaths matches, using a MutationObserver.
+# arguments: xpaths (list), timeout in ms, require visible (bool), callback
+# Returns the index of the matching XPath, or -1 on timeout.
+WAIT_FOR_XPATH = """
+var xpaths = arguments[0], timeoutMs = arguments[1], visible = arguments[2];
+var done = arguments[arguments.length - 1];
+function match() {
+    for (var i = 0; i < xpaths.length; i++) {
+        var node = document.evaluate(xpaths[i], document, null,
+            XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+        if (node && (!visible || node.getClientRects().length > 0)) {
+            return i;
+        }
+    }
+    return -1;
+}
+var found = match();
+if (found >= 0) {
+    done(found);
+    return;
+}
+var finished = false, timer = null;
+var observer = new MutationObserver(function () {
+    if (!finished) {
+        var index = match();
+        if (index >= 0) finish(index);
+    }
+});
+function finish(result) {
+    finished = true;
+    observer.disconnect();
+    clearTimeout(timer);
+    done(result);
+}
+timer = setTimeout(function () { finish(-1); }, timeoutMs);
+observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true});
+"""
+
+# Count nodes matching an XPath.
+# arguments: xpath
+COUNT_XPATH = """
+return document.evaluate(arguments[0], document, null,
+    XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null).snapshotLength;
+"""
+
+# Resolve once a new outgoing message bubble appears.
+# With text, one of the new bubbles must contain it; only letters and digits are
+# compared (emoji render as images) and only the start, as long texts get folded.
+# arguments: bubble xpath, count before sending, timeout in ms, text or null, callback
+# Returns 'appeared' or 'timeout'.
+WAIT_FOR_OUTGOING = """
+var xpath = arguments[0], before = arguments[1], timeoutMs = arguments[2];
+var done = arguments[arguments.length - 1];
+function key(text) {
+    return (text || '').replace(/[^\\p{L}\\p{N}]+/gu, '').toLowerCase();
+}
+var needle = typeof arguments[3] === 'string' ? key(arguments[3]).slice(0, 40) : '';
+function check() {
+    var bubbles = document.evaluate(xpath, document, null,
+        XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    for (var i = before; i < bubbles.snapshotLength; i++) {
+        if (!needle || key(bubbles.snapshotItem(i).innerText).indexOf(needle) >= 0) return 'appeared';
+    }
+    return null;
+}
+var state = check();
+if (state) {
+    done(state);
+    return;
+}
+var finished = false, timer = null;
+var observer = new MutationObserver(function () {
+    if (!finished) {
+        var result = check();
+        if (result) finish(result);
+    }
+});
+function finish(result) {
+    finished = true;
+    observer.disconnect();
+    clearTimeout(timer);
+    done(result);
+}
+timer = setTimeout(function () { finish('timeout'); }, timeoutMs);
+observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true});
+"""
+
+# WhatsApp id (data-id) of the newest outgoing message in the open chat.
+# arguments: bubble xpath
+# Returns the id, or null if there is no outgoing bubble.
+LAST_OUTGOING_ID = """
+var bubbles = document.evaluate(arguments[0], document, null,
+    XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+if (bubbles.snapshotLength === 0) return null;
+var last = bubbles.snapshotItem(bubbles.snapshotLength - 1);
+var holder = last.closest('[data-id]') || last.querySelector('[data-id]');
+return holder ? holder.getAttribute('data-id') : null;
+"""
+
+# Text of the newest outgoing messages in the open chat, captions and document names included,
+# with the time WhatsApp stamped on them. The stamp comes from data-pre-plain-text
+# ("[10:32, 18/10/2026] Name: "), which only text and captions carry, and is read in the
+# browser's date order; it has minute precision.
+# arguments: bubble xpath, how many
+# Returns a list of {text, time: ms since epoch or null}, oldest first.
+RECENT_OUTGOING_TEXTS = """
+var bubbles = document.evaluate(arguments[0], document, null,
+    XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+var order = new Intl.DateTimeFormat().formatToParts(new Date(2001, 11, 31))
+    .map(function (part) { return part.type; })
+    .filter(function (type) { return type === 'day' || type === 'month' || type === 'year'; });
+function stamp(bubble) {
+    var holder = bubble.querySelector('[data-pre-plain-text]');
+    var label = holder ? holder.getAttribute('data-pre-plain-text') : '';
+    var bracket = /\\[([^\\]]*)\\]/.exec(label || '');
+    if (!bracket) return null;
+    var clock = /(\\d{1,2}):(\\d{2})/.exec(bracket[1]) || /(?:^|\\s)(\\d{1,2})\\.(\\d{2})(?![\\d.])/.exec(bracket[1]);
+    var date = /(\\d{1,4})[\\/.-](\\d{1,2})[\\/.-](\\d{1,4})/.exec(bracket[1]);
+    if (!clock || !date) return null;
+    var hours = parseInt(clock[1], 10), numbers = [date[1], date[2], date[3]], parts = {};
+    if (/p\\.?\\s?m/i.test(bracket[1]) && hours < 12) hours += 12;
+    if (/a\\.?\\s?m/i.test(bracket[1]) && hours === 12) hours = 0;
+    var fields = date[1].length === 4 ? ['year', 'month', 'day'] : order;
+    for (var i = 0; i < 3; i++) parts[fields[i]] = parseInt(numbers[i], 10);
+    if (parts.year < 100) parts.year += 2000;
+    if (parts.month > 12 && parts.day <= 12) parts = {year: parts.year, month: parts.day, day: parts.month};
+    return new Date(parts.year, parts.month - 1, parts.day, hours, parseInt(clock[2], 10)).getTime();
+}
+var found = [];
+for (var i = Math.max(0, bubbles.snapshotLength - arguments[1]); i < bubbles.snapshotLength; i++) {
+    var bubble = bubbles.snapshotItem(i);
+    found.push({text: bubble.innerText || '', time: stamp(bubble)});
+}
+return found;
+"""
+
+# Tick status of outgoing messages by data-id: 'pending' (clock), 'sent', 'delivered',
+# 'read', 'failed', or null when the message is not on screen.
+# Waits until none of them is pending, up to the timeout (0 reads once).
+# arguments: list of message ids, timeout in ms, callback
+# Returns {id: status}.
+MESSAGE_STATUSES = """
+var ids = arguments[0], timeoutMs = arguments[1];
+var done = arguments[arguments.length - 1];
+var ICONS = {
+    'msg-time': 'pending', 'msg-check': 'sent', 'msg-dblcheck': 'delivered',
+    'msg-dblcheck-ack': 'read', 'msg-error': 'failed', 'error': 'failed'
+};
+function statusOf(id) {
+    var holder = document.querySelector('[data-id="' + id.replace(/"/g, '\\\\"') + '"]');
+    if (!holder) return null;
+    var icons = holder.querySelectorAll('span[data-icon]');
+    for (var i = icons.length - 1; i >= 0; i--) {
+        var status = ICONS[icons[i].getAttribute('data-icon')];
+        if (!status) continue;
+        var label = (icons[i].getAttribute('aria-label') || '').trim().toLowerCase();
+        if (status === 'delivered' && label === 'read') status = 'read';
+        return status;
+    }
+    return null;
+}
+function read() {
+    var result = {}, pending = false;
+    for (var i = 0; i < ids.length; i++) {
+        result[ids[i]] = statusOf(ids[i]);
+        if (result[ids[i]] === 'pending') pending = true;
+    }
+    return {statuses: result, pending: pending};
+}
+var state = read();
+if (!state.pending || timeoutMs <= 0) {
+    done(state.statuses);
+    return;
+}
+var finished = false, timer = null;
+var observer = new MutationObserver(function () {
+    if (!finished) {
+        state = read();
+        if (!state.pending) finish();
+    }
+});
+function finish() {
+    finished = true;
+    observer.disconnect();
+    clearTimeout(timer);
+    done(read().statuses);
+}
+timer = setTimeout(finish, timeoutMs);
+observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true});
+"""
+
+# Open a chat inside the loaded app by clicking an injected wa.me link.
+# The current conversation panel is marked stale so the caller can wait for a fresh one.
+# A window-level listener cancels the click if WhatsApp did not handle it itself,
+# so an unhandled link never navigates away from the app.
+# arguments: wa.me link
+# Returns true if WhatsApp handled the click.
+OPEN_CHAT_LINK = """
+var href = arguments[0];
+var main = document.getElementById('main');
+if (main) main.setAttribute('data-bot-stale', '1');
+var root = document.getElementById('app') || document.body;
+var link = document.createElement('a');
+link.href = href;
+link.style.position = 'absolute';
+link.style.opacity = '0';
+var handled = false;
+function guard(event) {
+    handled = event.defaultPrevented;
+    event.preventDefault();
+}
+window.addEventListener('click', guard, false);
+root.appendChild(link);
+try {
+    link.click();
+} finally {
+    window.removeEventListener('click', guard, false);
+    link.remove();
+}
+return handled;
+"""
+
+# Tag the open conversation panel with the number it belongs to, so a follow-up
+# send to the same number can skip navigation. WhatsApp renders a new panel per chat.
+# arguments: phone digits
+MARK_CHAT_OPEN = """
+var main = document.getElementById('main');
+if (main) main.setAttribute('data-bot-chat', arguments[0]);
+"""
+
+# Mark the current conversation panel as stale before navigating in-app.
+MARK_CHAT_STALE = """
+var main = document.getElementById('main');
+if (main) main.setAttribute('data-bot-stale', '1');
+"""
+
+# In-page helper exposed as window.__waBot. Registered for every page load on
+# Chromium (Page.addScriptToEvaluateOnNewDocument) and installed lazily elsewhere.
+# send() does a whole text send - find composer, insert text, press send and
+# wait for the outgoing bubble - and reports a structured result.
+BOT_HELPER = """
+(function () {
+    if (window.__waBot && window.__waBot.version >= 4) return;
+
+    function find(xpaths) {
+        for (var i = 0; i < xpaths.length; i++) {
+            var node = document.evaluate(xpaths[i], document, null,
+                XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+            if (node && node.getClientRects().length > 0) return node;
+        }
+        return null;
+    }
+
+    function count(xpath) {
+        return document.evaluate(xpath, document, null,
+            XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null).snapshotLength;
+    }
+
+    function pressEnter(target, shift) {
+        var init = {key: 'Enter', code: 'Enter', keyCode: 13, which: 13,
+                    shiftKey: !!shift, bubbles: true, cancelable: true};
+        target.dispatchEvent(new KeyboardEvent('keydown', init));
+        target.dispatchEvent(new KeyboardEvent('keyup', init));
+    }
+
+    // Text as the composer shows it: emoji are <img alt>, line breaks are <br> or blocks
+    function composerText(element) {
+        var parts = [];
+        (function walk(node) {
+            if (node.nodeType === 3) {
+                parts.push(node.nodeValue);
+            } else if (node.nodeName === 'IMG') {
+                parts.push(node.getAttribute('alt') || '');
+            } else if (node.nodeName === 'BR') {
+                parts.push('\\n');
+            } else {
+                for (var i = 0; i < node.childNodes.length; i++) walk(node.childNodes[i]);
+            }
+        })(element);
+        return parts.join('');
+    }
+
+    function sameText(a, b) {
+        return a.replace(/\\s+/g, '') === b.replace(/\\s+/g, '');
+    }
+
+    // Insert the whole message in one operation. A synthetic paste keeps line
+    // breaks and any Unicode (emoji, non-BMP) intact; execCommand is the fallback.
+    function insertText(element, text) {
+        element.focus();
+        if (text.length === 0) return true;
+        try {
+            var data = new DataTransfer();
+            data.setData('text/plain', text);
+            element.dispatchEvent(new ClipboardEvent('paste', {
+                clipboardData: data, bubbles: true, cancelable: true
+            }));
+        } catch (e) {}
+        if (sameText(composerText(element), text)) return true;
+
+        clear(element);
+        var lines = text.split('\\n');
+        for (var i = 0; i < lines.length; i++) {
+            if (lines[i]) document.execCommand('insertText', false, lines[i]);
+            if (i < lines.length - 1) pressEnter(element, true);
+        }
+        return composerText(element).length > 0;
+    }
+
+    function clear(element) {
+        element.focus();
+        document.execCommand('selectAll', false, null);
+        document.execCommand('delete', false, null);
+    }
+
+    function waitUntil(check, timeoutMs, callback) {
+        if (check()) return callback(true);
+        var finished = false, timer = null;
+        var observer = new MutationObserver(function () {
+            if (!finished && check()) finish(true);
+        });
+        function finish(result) {
+            finished = true;
+            observer.disconnect();
+            clearTimeout(timer);
+            callback(result);
+        }
+        timer = setTimeout(function () { finish(false); }, timeoutMs);
+        observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true});
+    }
+
+    // opts: {composer: [xpaths], sendButton: [xpaths], outgoing: xpath, timeout: ms,
+    //        prefilled: bool, prefillWait: ms}
+    // With prefilled, text that WhatsApp already put in the composer (send URL
+    // ?text=) is verified and sent as is; anything else is cleared and re-inserted.
+    // The result carries per-step spans in ms: find_composer, type, confirm.
+    function send(text, opts, done) {
+        var started = Date.now(), spans = {};
+        var composer = find(opts.composer);
+        var found = Date.now();
+        spans.find_composer = found - started;
+        if (!composer) return done({ok: false, step: 'composer', ms: Date.now() - started, spans: spans});
+
+        function fill() {
+            if (opts.prefilled && sameText(composerText(composer), text)) return 'prefilled';
+            if (composerText(composer).length > 0) clear(composer);
+            return insertText(composer, text) ? 'inserted' : null;
+        }
+
+        function press(how) {
+            var pressed = Date.now();
+            var before = count(opts.outgoing);
+            var button = find(opts.sendButton);
+            if (button) {
+                button.click();
+            } else {
+                pressEnter(composer, false);
+            }
+            waitUntil(function () { return count(opts.outgoing) > before; }, opts.timeout, function (ok) {
+                spans.confirm = Date.now() - pressed;
+                done({ok: ok, step: ok ? 'sent' : 'confirm', text: how, ms: Date.now() - started, spans: spans});
+            });
+        }
+
+        function proceed() {
+            var how = fill();
+            // Includes waiting for a prefilled text to land
+            spans.type = Date.now() - found;
+            if (!how) {
+                clear(composer);
+                return done({ok: false, step: 'insert', ms: Date.now() - started, spans: spans});
+            }
+            press(how);
+        }
+
+        if (opts.prefilled && composerText(composer).length === 0) {
+            // The prefilled text can land a moment after the composer renders
+            waitUntil(function () { return composerText(composer).length > 0; }, opts.prefillWait || 0, proceed);
+        } else {
+            proceed();
+        }
+    }
+
+    function composerMatches(element, text) {
+        return sameText(composerText(element), text);
+    }
+
+    window.__waBot = {
+        version: 4, find: find, count: count, pressEnter: pressEnter, composerText: composerText,
+        composerMatches: composerMatches,
+        insertText: insertText, clear: clear, waitUntil: waitUntil, send: send
+    };
+})();
+"""
+
+# Run window.__waBot.send in one round trip.
+# arguments: message text, options (see BOT_HELPER), callback
+RUN_SEND_MACRO = """
+var done = arguments[arguments.length - 1];
+if (!window.__waBot) {
+    done({ok: false, step: 'not_installed'});
+    return;
+}
+window.__waBot.send(arguments[0], arguments[1], done);
+"""
+
+# Insert text into an element (or the focused element) via window.__waBot.insertText.
+# arguments: element or null, text
+# Returns true/false, or null if the helper is not installed.
+INSERT_TEXT = """
+if (!window.__waBot) return null;
+var target = arguments[0] || document.activeElement;
+if (!target) return false;
+return window.__waBot.insertText(target, arguments[1]);
+"""
+
+# Check the composer already holds the given text (e.g. prefilled from the send URL).
+# arguments: composer element, text
+# Returns true/false, or null if the helper is not installed.
+COMPOSER_MATCHES = """
+if (!window.__waBot) return null;
+return window.__waBot.composerMatches(arguments[0], arguments[1]);
+"""
+
+# Read the login screen in one round trip: logged in, QR code on screen or still loading.
+# The QR canvas pixels are hashed in the page; the PNG is only encoded and returned
+# when the hash differs from the one the caller already has.
+# arguments: QR canvas xpath, side panel xpath, known QR hash or null
+READ_LOGIN_SCREEN = """
+function first(xpath) {
+    return document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+}
+function fnv(values, step) {
+    var hash = 2166136261;
+    for (var i = 0; i < values.length; i += step) {
+        hash ^= typeof values === 'string' ? values.charCodeAt(i) : values[i];
+        hash = Math.imul(hash, 16777619);
+    }
+    return (hash >>> 0).toString(16);
+}
+var canvas = first(arguments[0]);
+if (canvas && canvas.getClientRects().length > 0) {
+    var hash, png = null;
+    try {
+        // Every pixel's red channel is enough for a black and white code
+        hash = fnv(canvas.getContext('2d').getImageData(0, 0, canvas.width, canvas.height).data, 4);
+    } catch (e) {
+        png = canvas.toDataURL('image/png').substring(22);
+        hash = fnv(png, 1);
+    }
+    if (hash === arguments[2]) return {status: 'qr_ready', hash: hash, qr: null};
+    return {status: 'qr_ready', hash: hash, qr: png || canvas.toDataURL('image/png').substring(22)};
+}
+if (first(arguments[1])) return {status: 'logged_in', hash: null, qr: null};
+return {status: 'waiting', hash: null, qr: null};
+"""
@@ -0,0 +1,127 @@
+"""
+Rate Limiter
+Per-session token bucket that paces sends. The rate backs off when sends fail
+or WhatsApp reports invalid numbers, and creeps back up after a run of successes.
+"""
+import time
+import random
+import threading
+
+from src.logger import bot_logger
+
+logger = bot_logger
+
+
+class RateLimiter:
+    DEFAULTS = {
+        # Off: sends are not paced here (callers use their fixed delay instead)
+        'enabled': True,
+        # Sends per minute every session starts at
+        'rate': 12,
+        # The adaptive rate stays within these bounds (sends per minute)
+        'min_rate': 2,
+        'max_rate': 30,
+        # Sends that may go out back to back before the rate applies
+        'burst': 3,
+        # Random extra wait when pacing, as a fraction of the current send interval
+        'jitter': 0.3,
+        # The rate is multiplied by backoff after a failed send or an invalid number...
+        'backoff': 0.5,
+        # ...and by recovery after recover_after successful sends in a row
+        'recovery': 1.2,
+        'recover_after': 10,
+    }
+
+    def __init__(self, **settings):
+        self.settings = dict(self.DEFAULTS)
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self.configure(**settings)
+
+    def configure(self, **settings):
+        """Update settings; unknown keys and None values are ignored. A new rate resets every session to it."""
+        with self._lock:
+            for key, value in settings.items():
+                if key in self.DEFAULTS and value is not None:
+                    self.settings[key] = value
+            if settings.get('rate') is not None:
+                for bucket in self._buckets.values():
+                    bucket['rate'] = self._clamp(self.settings['rate'])
+
+    def _clamp(self, rate):
+        return min(self.settings['max_rate'], max(self.settings['min_rate'], rate))
+
+    def _bucket(self, session_id):
+        bucket = self._buckets.get(session_id)
+        if bucket is None:
+            bucket = self._buckets[session_id] = {
+                'rate': self._clamp(self.settings['rate']), 'tokens': float(self.settings['burst']),
+                'updated': time.monotonic(), 'streak': 0, 'sends': 0, 'backoffs': 0, 'waited': 0.0,
+            }
+        return bucket
+
+    def _refill(self, bucket):
+        now = time.monotonic()
+        bucket['tokens'] = min(self.settings['burst'],
+                               bucket['tokens'] + (now - bucket['updated']) * bucket['rate'] / 60)
+        bucket['updated'] = now
+
+    def acquire(self, session_id=0):
+        """Block until session_id may send. Returns the seconds waited."""
+        if not self.settings['enabled']:
+            return 0
+        with self._lock:
+            bucket = self._bucket(session_id)
+            self._refill(bucket)
+            interval = 60 / bucket['rate']
+            wait = 0
+            if bucket['tokens'] < 1:
+                wait = (1 - bucket['tokens']) * interval
+                wait += random.uniform(0, self.settings['jitter']) * interval
+            # Take the token now; the sleep below pays it back
+            bucket['tokens'] -= 1
+            bucket['waited'] += wait
+        if wait > 0:
+            logger.debug(f"Session {session_id} waits {wait:.1f}s (rate {bucket['rate']:.1f}/min)")
+            time.sleep(wait)
+        return wait
+
+    def record(self, session_id, success, invalid=False):
+        """Adapt the session's rate to the outcome of a send"""
+        if not self.settings['enabled']:
+            return
+        with self._lock:
+            bucket = self._bucket(session_id)
+            bucket['sends'] += 1
+            if success:
+                bucket['streak'] += 1
+                if bucket['streak'] >= self.settings['recover_after']:
+                    bucket['streak'] = 0
+                    rate = self._clamp(bucket['rate'] * self.settings['recovery'])
+                    if rate != bucket['rate']:
+                        bucket['rate'] = rate
+                        logger.info(f"Session {session_id} speeds up to {rate:.1f} sends/min")
+                return
+            bucket['streak'] = 0
+            bucket['backoffs'] += 1
+            bucket['rate'] = self._clamp(bucket['rate'] * self.settings['backoff'])
+            # No burst right after a failure
+            bucket['tokens'] = min(bucket['tokens'], 0)
+            reason = 'an invalid number' if invalid else 'a failed send'
+            logger.warning(f"Session {session_id} backs off to {bucket['rate']:.1f} sends/min after {reason}")
+
+    def stats(self):
+        with self._lock:
+            for bucket in self._buckets.values():
+                self._refill(bucket)
+            return {
+                'settings': dict(self.settings),
+                'sessions': {session_id: {
+                    'rate_per_minute': round(bucket['rate'], 2),
+                    'tokens': round(bucket['tokens'], 2),
+                    'streak': bucket['streak'],
+                    'sends': bucket['sends'],
+                    'backoffs': bucket['backoffs'],
+                    'waited_seconds': round(bucket['waited'], 1),
+                } for session_id, bucket in self._buckets.items()},
+            }
@@ -0,0 +1,139 @@
+"""
+Adaptive Selector Cache
+Remembers which XPath actually matched for each selector name and profile,
+tries the winner first and temporarily skips selectors that keep failing
+"""
+import os
+import json
+import time
+import threading
+
+from src.logger import bot_logger
+
+logger = bot_logger
+
+
+class SelectorCache:
+    # A selector that misses this many times in a row (while another one matched) is skipped...
+    MAX_CONSECUTIVE_MISSES = 3
+    # ...for this many seconds
+    SKIP_SECONDS = 15 * 60
+    # Write stats to disk at most this often
+    SAVE_INTERVAL = 30
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._dirty = False
+        self._last_save = 0
+        self._load()
+
+    def _load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    self._stats = json.load(f)
+                logger.debug(f"Loaded selector stats from {self.path}")
+        except Exception as e:
+            logger.warning(f"Could not load selector stats: {e}")
+            self._stats = {}
+
+    def save(self, force=False):
+        """Persist stats if they changed (rate limited unless force)"""
+        with self._lock:
+            if not self._dirty or (not force and time.time() - self._last_save < self.SAVE_INTERVAL):
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(self._stats, f, indent=2)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+                self._last_save = time.time()
+            except Exception as e:
+                logger.warning(f"Could not save selector stats: {e}")
+
+    def _entry(self, profile, name, xpath):
+        return (self._stats.setdefault(profile, {})
+                .setdefault(name, {})
+                .setdefault(xpath, {'hits': 0, 'misses': 0, 'consecutive_misses': 0,
+                                    'skip_until': 0, 'last_hit': None, 'avg_ms': 0}))
+
+    def order(self, profile, name, xpaths):
+        """
+        Return (active, skipped) XPath lists. Active ones are sorted so the most
+        successful selector comes first; skipped ones failed repeatedly and are on cooldown.
+        """
+        with self._lock:
+            known = self._stats.get(profile, {}).get(name, {})
+            now = time.time()
+            active, skipped = [], []
+            for xpath in xpaths:
+                entry = known.get(xpath)
+                if entry and entry['skip_until'] > now:
+                    skipped.append(xpath)
+                else:
+                    active.append(xpath)
+
+            def rank(xpath):
+                entry = known.get(xpath)
+                if not entry:
+                    return (0, 0)
+                return (-entry['hits'], entry['misses'])
+
+            # sorted() is stable, so untried selectors keep their profile order
+            active.sort(key=rank)
+            if not active:
+                active, skipped = skipped, []
+            return active, skipped
+
+    def record(self, profile, name, winner, tried, elapsed):
+        """Record that `winner` matched after the `tried` XPaths before it missed"""
+        with self._lock:
+            entry = self._entry(profile, name, winner)
+            entry['hits'] += 1
+            entry['consecutive_misses'] = 0
+            entry['skip_until'] = 0
+            entry['last_hit'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            entry['avg_ms'] = round(entry['avg_ms'] + (elapsed * 1000 - entry['avg_ms']) / entry['hits'], 1)
+            for xpath in tried:
+                if xpath == winner:
+                    continue
+                miss = self._entry(profile, name, xpath)
+                miss['misses'] += 1
+                miss['consecutive_misses'] += 1
+                if miss['consecutive_misses'] >= self.MAX_CONSECUTIVE_MISSES:
+                    miss['skip_until'] = time.time() + self.SKIP_SECONDS
+                    logger.info(f"Skipping selector for '{name}' ({profile}) for {self.SKIP_SECONDS // 60} min: {xpath}")
+            self._dirty = True
+        self.save()
+
+    def stats(self):
+        """Stats for the API: per profile and selector name, with the current winner and skipped selectors"""
+        with self._lock:
+            now = time.time()
+            result = {}
+            for profile, names in self._stats.items():
+                result[profile] = {}
+                for name, entries in names.items():
+                    winner = max(entries.items(), key=lambda item: item[1]['hits'])[0] if entries else None
+                    result[profile][name] = {
+                        'winner': winner,
+                        'selectors': [{
+                            'xpath': xpath,
+                            'hits': entry['hits'],
+                            'misses': entry['misses'],
+                            'avg_ms': entry['avg_ms'],
+                            'last_hit': entry['last_hit'],
+                            'skipped': entry['skip_until'] > now,
+                        } for xpath, entry in entries.items()],
+                    }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self._dirty = True
+        self.save(force=True)
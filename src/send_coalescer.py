@@ -0,0 +1,164 @@
+"""
+Send Coalescer
+Groups messages queued for the same number so the chat is opened once
+and everything pending for it is sent back to back
+"""
+import threading
+
+from src.logger import bot_logger
+
+logger = bot_logger
+
+
+class _PendingSend:
+    def __init__(self, message, attachments, file_type, on_sent):
+        self.message = message
+        self.attachments = attachments
+        self.file_type = file_type
+        self.on_sent = on_sent
+        self.result = None
+        self.done = threading.Event()
+
+
+class SendCoalescer:
+    """
+    Whoever sends to a number first becomes its owner and keeps sending until nothing
+    is left queued for it. Callers that target the same number meanwhile only queue their
+    message and wait for the owner to send it in the already open chat.
+    Owners always hold a bot, so they never wait on anything while others wait on them.
+    """
+
+    # Seconds a caller waits for a session, or for the owner of its number to take its message
+    WAIT_TIMEOUT = 300
+
+    def __init__(self, wait_timeout=None):
+        self.wait_timeout = self.WAIT_TIMEOUT if wait_timeout is None else wait_timeout
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._owners = set()
+
+    @staticmethod
+    def normalize(phone):
+        return ''.join(filter(str.isdigit, str(phone)))
+
+    def send(self, session, phone, message='', attachments=None, file_type='document', on_sent=None):
+        """
+        Queue a text (or attachments with caption) for phone and wait until it is sent.
+        session: a bot, or a callable taking timeout and returning a context manager that
+        yields one (e.g. BotPool.session) - only borrowed if nobody owns the number yet.
+        on_sent(result) runs on the sending thread right after this message went out,
+        before the bot moves on, so history rows exist before delivery ticks settle.
+        Returns {'success', 'message_id', 'invalid', 'session', 'coalesced', 'timings'}.
+        """
+        key = self.normalize(phone)
+        item = _PendingSend(message, list(attachments or []), file_type, on_sent)
+        if not callable(session):
+            return self._send_with(session, key, phone, item)
+
+        with self._lock:
+            queued = key in self._owners
+            if queued:
+                self._pending.setdefault(key, []).append(item)
+        if queued:
+            return self._wait(key, item)
+        # Take the number only once a session is in hand: an owner waiting for a session
+        # could be waited on by the very caller that holds it
+        try:
+            with session(timeout=self.wait_timeout) as bot:
+                return self._send_with(bot, key, phone, item)
+        except TimeoutError:
+            logger.warning(f"No WhatsApp session became available within {self.wait_timeout}s for {key}")
+            self._fail(item, key)
+            return item.result
+
+    def _send_with(self, bot, key, phone, item):
+        """Queue item for key and, unless someone else owns key, send everything queued on bot"""
+        with self._lock:
+            self._pending.setdefault(key, []).append(item)
+            owner = key not in self._owners
+            if owner:
+                self._owners.add(key)
+
+        if not owner:
+            return self._wait(key, item)
+
+        try:
+            self._drain(bot, key, phone)
+        finally:
+            self._release(key)
+        return item.result
+
+    def _wait(self, key, item):
+        """Wait for the owner of key to send item; withdraw it if the owner does not get to it in time"""
+        logger.debug(f"Queued message for {key} behind the open chat")
+        if item.done.wait(self.wait_timeout):
+            return item.result
+        with self._lock:
+            items = self._pending.get(key, [])
+            withdrawn = item in items
+            if withdrawn:
+                items.remove(item)
+        if withdrawn:
+            logger.warning(f"Gave up waiting for the chat with {key} after {self.wait_timeout}s")
+            self._fail(item, key)
+        else:
+            # The owner took it and is sending it now; the send's own waits bound this
+            item.done.wait()
+        return item.result
+
+    def _drain(self, bot, key, phone):
+        """Send everything queued for key on bot, oldest first"""
+        first = True
+        while True:
+            with self._lock:
+                items = self._pending.pop(key, [])
+                if not items:
+                    return
+            if len(items) > 1 or not first:
+                logger.info(f"Sending {len(items)} queued message(s) to {key} in one chat session")
+            for item in items:
+                self._send_one(bot, phone, item, coalesced=not first)
+                first = False
+
+    def _send_one(self, bot, phone, item, coalesced):
+        try:
+            if item.attachments:
+                success = bot.send_message_with_attachments(phone, item.message, item.attachments, item.file_type)
+            else:
+                success = bot.send_message(phone, item.message)
+        except Exception as e:
+            logger.error(f"Coalesced send to {phone} failed: {e}", exc_info=True)
+            success = False
+        item.result = {
+            'success': success,
+            'message_id': bot.last_message_id if success else None,
+            'invalid': bot.last_number_invalid,
+            'session': bot.session_id,
+            'coalesced': coalesced,
+            'timings': bot.last_timings,
+        }
+        if item.on_sent:
+            try:
+                item.on_sent(item.result)
+            except Exception as e:
+                logger.error(f"Send callback failed for {phone}: {e}", exc_info=True)
+        item.done.set()
+
+    def _release(self, key):
+        """Give up ownership; anything still queued (e.g. after an error) is failed"""
+        with self._lock:
+            self._owners.discard(key)
+            leftovers = self._pending.pop(key, [])
+        for item in leftovers:
+            self._fail(item, key)
+
+    def _fail(self, item, key):
+        """Finish an item that was never sent"""
+        item.result = {'success': False, 'message_id': None, 'invalid': False,
+                       'session': None, 'coalesced': False, 'timings': None}
+        if item.on_sent:
+            try:
+                item.on_sent(item.result)
+            except Exception as e:
+                logger.error(f"Send callback failed for {key}: {e}", exc_info=True)
+        item.done.set()
@@ -0,0 +1,41 @@
+"""
+Send Timings
+Named timing spans and WebDriver command counts for a single send,
+so a slow send shows where its time went
+"""
+import time
+from contextlib import contextmanager
+
+
+class SendTimer:
+    # Spans recorded by WhatsAppBot; a span that did not run is left out
+    SPANS = ('open_chat', 'find_composer', 'type', 'attach', 'caption', 'confirm')
+
+    def __init__(self, kind, command_counter):
+        """command_counter() returns the bot's running WebDriver command count"""
+        self.kind = kind
+        self.spans = {}
+        self._command_counter = command_counter
+        self._commands_at_start = command_counter()
+        self._started = time.perf_counter()
+
+    def add(self, name, ms):
+        """Add ms to a span; spans that run more than once (e.g. a retry) add up"""
+        if ms is not None:
+            self.spans[name] = round(self.spans.get(name, 0) + ms, 1)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def finish(self):
+        return {
+            'kind': self.kind,
+            'total_ms': round((time.perf_counter() - self._started) * 1000, 1),
+            'commands': self._command_counter() - self._commands_at_start,
+            'spans': dict(self.spans),
+        }
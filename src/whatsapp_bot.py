@@ -7,6 +7,9 @@ import time
 import platform
 import os
 from pathlib import Path
+from contextlib import nullcontext
+from urllib.parse import quote
+from urllib.request import urlopen
 
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options as ChromeOptions
@@ -14,16 +17,28 @@ from selenium.webdriver.firefox.options import Options as FirefoxOptions
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
 from selenium.webdriver.common.action_chains import ActionChains
 
+try:
+    import psutil
+except ImportError:
+    psutil = None  # Memory reporting is optional
+
 from src.logger import get_logger, bot_logger
+from src import page_scripts
+from src.selector_cache import SelectorCache
+from src.delivery_tracker import DeliveryTracker
+from src.send_timings import SendTimer
 
 logger = bot_logger
 
 
 class WhatsAppBot:
+    # Each session gets its own DevTools port: 9222, 9223, ...
+    BASE_DEBUG_PORT = 9222
+    WHATSAPP_URL = 'https://web.whatsapp.com'
+
     BROWSER_PATHS = {
         'Darwin': {
             'chrome': '/Applications/Google Chrome.app/Contents/MacOS/Google Chrome',
@@ -133,10 +148,92 @@ class WhatsAppBot:
         'side_panel': '//div[@id="side"]',
         'message_input': ['//div[@contenteditable="true"][@data-tab="10"]', '//div[@title="Type a message"]', '//footer//div[@contenteditable="true"]'],
         'file_input': '//input[@type="file"]',
-        'invalid_number': ['//*[contains(text(), "Phone number shared via url is invalid")]', '//*[contains(text(), "invalid")]'],
+        # The invalid-number dialog only, so chat text mentioning "invalid" never matches
+        'invalid_number_dialog': ['//*[contains(text(), "Phone number shared via url is invalid")]', '//div[@role="dialog"]//*[contains(text(), "invalid")]'],
+        'outgoing_message': '//div[contains(@class, "message-out")]',
+        # Composer of a conversation opened after the previous one was marked stale
+        'fresh_composer': '//div[@id="main"][not(@data-bot-stale)]//footer//div[@contenteditable="true"]',
+        # Composer of the conversation the bot opened for {phone} (see MARK_CHAT_OPEN)
+        'open_chat_composer': '//div[@id="main"][@data-bot-chat="{phone}"][not(@data-bot-stale)]//footer//div[@contenteditable="true"]',
+        'new_chat_button': ['//div[@title="New chat"]', '//button[@title="New chat"]', '//span[@data-icon="new-chat-outline"]/..'],
+        'new_chat_search': ['//div[@contenteditable="true"][@data-tab="3"]', '//div[@id="app"]//span//div[@contenteditable="true"][@role="textbox"]'],
+        'new_chat_result': '//div[@id="app"]//span//div[@role="listitem"]',
+    }
+    
+    # Lean mode: requests blocked through CDP. Only downloads are blocked (avatars,
+    # media thumbnails, stickers, GIFs) - uploads use a different path and still work.
+    LEAN_BLOCKED_URLS = [
+        '*.whatsapp.net/v/*',
+        '*.giphy.com/*',
+        '*.tenor.com/*',
+        '*.mp4',
+        '*.webm',
+    ]
+    # Lean mode: smaller window and Chrome's low-memory switches
+    LEAN_WINDOW_SIZE = (1024, 768)
+    LEAN_CHROME_ARGS = [
+        '--enable-low-end-device-mode',
+        '--renderer-process-limit=1',
+        '--disk-cache-size=1',
+        '--media-cache-size=1',
+        '--disable-extensions',
+        '--disable-background-networking',
+        '--disable-component-update',
+        '--disable-default-apps',
+        '--disable-sync',
+        '--mute-audio',
+        '--disable-features=Translate,MediaRouter,OptimizationHints',
+    ]
+    
+    # Chat navigation: 'in_app' opens chats inside the loaded app, 'reload' loads the send URL every time
+    NAVIGATION_MODES = ('in_app', 'reload')
+    # Give up on in-app navigation after this many consecutive failures
+    MAX_IN_APP_FAILURES = 3
+    # Longest send URL used for prefilled text; longer messages are inserted instead
+    MAX_PREFILL_URL_LENGTH = 2000
+    
+    # Deadlines (seconds) for the event-driven waits in the send path
+    WAIT_TIMEOUTS = {
+        'chat_ready': 30,
+        'in_app_chat': 10,
+        'new_chat_search': 5,
+        'prefill': 2,
+        'attachment_menu': 5,
+        'attachment_preview': 20,
+        'outgoing_message': 10,
+        # After a browser restart, wait this long for the saved login to load
+        'restart_login': 90,
+        # On close, wait this long at most for clock icons to turn into ticks
+        'delivery_settle': 60,
     }
 
-    def __init__(self):
+    def __init__(self, session_id=0, navigation_mode='in_app', selector_cache=None, send_macro=True, prefill=True,
+                 delivery_tracker=None, lean=False, attach=False, watchdog=None, base_url=None, rate_limiter=None,
+                 media_preprocessor=None):
+        self.session_id = session_id
+        # WhatsApp Web address; benchmarks point this at the local stand-in (benchmarks/fake_whatsapp.py)
+        self.base_url = (base_url or self.WHATSAPP_URL).rstrip('/')
+        self.navigation_mode = navigation_mode if navigation_mode in self.NAVIGATION_MODES else 'in_app'
+        self._in_app_failures = 0
+        # Send text through the injected window.__waBot helper in one round trip
+        self.send_macro = send_macro
+        # Let WhatsApp prefill short text messages from the send URL instead of typing them
+        self.prefill = prefill
+        # Low-resource browser: blocked media, no disk cache, small window, low-memory flags
+        self.lean = lean
+        # Reuse a browser already listening on debug_port, and leave the browser running on close
+        self.attach = attach
+        self.attached = False
+        # Optional BrowserWatchdog that recycles the browser when it gets unhealthy
+        self.watchdog = watchdog
+        # Optional RateLimiter that paces this session's sends and adapts to their outcome
+        self.rate_limiter = rate_limiter
+        # Optional MediaPreprocessor that shrinks images before they are uploaded
+        self.media_preprocessor = media_preprocessor
+        self._browser_choice = None
+        # Session 0 keeps the original profile folder so existing logins survive
+        self.profile_name = 'whatsapp_profile' if session_id == 0 else f'whatsapp_profile_{session_id}'
+        self.debug_port = self.BASE_DEBUG_PORT + session_id
         self.driver = None
         self.wait = None
         self.is_headless = False
@@ -145,6 +242,25 @@ class WhatsAppBot:
         self.xpath_profile = None  # Will be set during initialize
         # base_dir is the project root (parent of src/)
         self.base_dir = Path(__file__).parent.parent.absolute()
+        # Shared between sessions when created by BotPool
+        self.selector_cache = selector_cache or SelectorCache(str(self.base_dir / 'data' / 'selector_stats.json'))
+        # Follows sent messages until their ticks settle, while the bot moves on
+        self.delivery_tracker = delivery_tracker or DeliveryTracker()
+        # data-id of the message sent by the last successful send_* call
+        self.last_message_id = None
+        # True when the last send_* call failed because WhatsApp says the number is invalid
+        self.last_number_invalid = False
+        # WebDriver commands issued since the browser started (element calls included)
+        self.command_count = 0
+        # Spans and command count of the last send_* call (see SendTimer.finish)
+        self.last_timings = None
+        self._timer = None
+        # Last QR code read from the login screen, as base64 PNG, and the hash of its pixels
+        self._qr_hash = None
+        self._qr_png = None
+        # Last get_qr_code_base64() answer with its time ('checked_at'), kept fresh by the
+        # session's BotWorker so status requests never have to touch the browser
+        self.login_state = None
     
     def _get_xpath_profile_key(self):
         """Determine which XPath profile to use based on OS and browser"""
@@ -202,28 +318,76 @@ class WhatsAppBot:
     
     def _create_chrome_options(self, browser_path, headless=False):
         options = ChromeOptions()
-        profile_dir = self.base_dir / 'whatsapp_profile'
+        profile_dir = self.base_dir / self.profile_name
         profile_dir.mkdir(exist_ok=True)
         options.add_argument(f'--user-data-dir={profile_dir}')
         options.add_argument('--profile-directory=Default')
         options.add_argument('--no-sandbox')
         options.add_argument('--disable-dev-shm-usage')
         options.add_argument('--disable-gpu')
-        options.add_argument('--window-size=1920,1080')
-        options.add_argument('--remote-debugging-port=9222')
+        if self.lean:
+            options.add_argument('--window-size={},{}'.format(*self.LEAN_WINDOW_SIZE))
+            for arg in self.LEAN_CHROME_ARGS:
+                options.add_argument(arg)
+        else:
+            options.add_argument('--window-size=1920,1080')
+        options.add_argument(f'--remote-debugging-port={self.debug_port}')
         options.add_argument('--disable-blink-features=AutomationControlled')
         options.add_experimental_option('excludeSwitches', ['enable-automation'])
         options.add_experimental_option('useAutomationExtension', False)
         if headless:
             options.add_argument('--headless=new')
+        if self.attach:
+            # Keep the browser alive when the driver (or the app) goes away, so it can be reattached
+            options.add_experimental_option('detach', True)
         if browser_path:
             options.binary_location = browser_path
         return options
     
+    def _debugger_available(self):
+        """True if a browser is already listening on this session's DevTools port"""
+        try:
+            with urlopen(f'http://127.0.0.1:{self.debug_port}/json/version', timeout=1) as response:
+                return response.status == 200
+        except Exception:
+            return False
+    
+    def _attach_to_browser(self):
+        """Connect to the running browser on debug_port and switch to its WhatsApp tab"""
+        options = ChromeOptions()
+        options.debugger_address = f'127.0.0.1:{self.debug_port}'
+        self.driver = webdriver.Chrome(options=options)
+        for handle in self.driver.window_handles:
+            self.driver.switch_to.window(handle)
+            if self.driver.current_url.startswith(self.base_url):
+                logger.info(f"Reusing open WhatsApp tab: {self.driver.current_url}")
+                return True
+        logger.info("No WhatsApp tab in the attached browser, opening one")
+        return False
+    
+    def _setup_chromium_session(self):
+        """Per-connection CDP setup: scripts for future page loads and lean mode blocking"""
+        self.driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': 'Object.defineProperty(navigator, "webdriver", {get: () => undefined})'})
+        # Install the send helper on every page load
+        self.driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': page_scripts.BOT_HELPER})
+        if self.lean:
+            self.driver.execute_cdp_cmd('Network.enable', {})
+            self.driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.LEAN_BLOCKED_URLS})
+    
     def _create_firefox_options(self, browser_path, headless=False):
         options = FirefoxOptions()
-        options.add_argument('--width=1920')
-        options.add_argument('--height=1080')
+        if self.lean:
+            width, height = self.LEAN_WINDOW_SIZE
+            options.add_argument(f'--width={width}')
+            options.add_argument(f'--height={height}')
+            # No CDP on Firefox: keep the cache in memory and skip animated images
+            options.set_preference('browser.cache.disk.enable', False)
+            options.set_preference('browser.cache.memory.enable', True)
+            options.set_preference('image.animation_mode', 'none')
+            options.set_preference('media.autoplay.default', 5)
+        else:
+            options.add_argument('--width=1920')
+            options.add_argument('--height=1080')
         if headless:
             options.add_argument('--headless')
         if browser_path:
@@ -231,8 +395,14 @@ class WhatsAppBot:
         return options
     
     def initialize(self, headless=False, browser=None):
+        """
+        Start the browser and open WhatsApp Web.
+        In attach mode a browser already running on debug_port is reused, tab and all,
+        which skips WhatsApp's start-up entirely.
+        """
         try:
             self.is_headless = headless
+            self._browser_choice = browser
             browser_type, browser_path = self._find_available_browser(browser)
             if not browser_path:
                 raise Exception("No supported browser found. Install Chrome, Brave, Firefox, or Edge.")
@@ -240,50 +410,147 @@ class WhatsAppBot:
             
             # Set XPath profile based on OS and browser
             self.xpath_profile = self._get_xpath_profile_key()
-            logger.info(f"Initializing bot with {browser_type}")
+            logger.info(f"Initializing bot session {self.session_id} with {browser_type}")
             logger.info(f"Browser path: {browser_path}")
             logger.info(f"XPath profile: {self.xpath_profile}")
+            logger.info(f"Profile: {self.profile_name} (debug port {self.debug_port})")
             logger.info(f"Headless mode: {headless}")
+            logger.info(f"Lean mode: {self.lean}")
             
+            self.attached = False
+            tab_open = False
             if browser_type == 'firefox':
+                if self.attach:
+                    logger.info("Attach mode is only supported for Chromium browsers, launching Firefox")
                 options = self._create_firefox_options(browser_path, headless)
                 self.driver = webdriver.Firefox(options=options)
             else:
-                options = self._create_chrome_options(browser_path, headless)
-                self.driver = webdriver.Chrome(options=options)
-                self.driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': 'Object.defineProperty(navigator, "webdriver", {get: () => undefined})'})
+                if self.attach and self._debugger_available():
+                    logger.info(f"Attaching to running browser on port {self.debug_port}")
+                    tab_open = self._attach_to_browser()
+                    self.attached = True
+                else:
+                    options = self._create_chrome_options(browser_path, headless)
+                    self.driver = webdriver.Chrome(options=options)
+                self._setup_chromium_session()
+            self._count_commands()
             self.wait = WebDriverWait(self.driver, 30)
+            # Observer-based waits enforce their own deadlines; this is only an upper bound
+            self.driver.set_script_timeout(max(self.WAIT_TIMEOUTS.values()) + 10)
+            if tab_open:
+                # The page is already loaded, so the new-document script will not run on it
+                self.driver.execute_script(page_scripts.BOT_HELPER)
+                logger.info("Attached to WhatsApp Web")
+                return True
             logger.info("Opening WhatsApp Web...")
-            self.driver.get('https://web.whatsapp.com')
+            self.driver.get(self.base_url)
             logger.info("Browser opened! Waiting for QR scan...")
             time.sleep(3)
             return True
         except Exception as e:
             logger.error(f"Bot initialization failed: {e}", exc_info=True)
-            self._cleanup()
+            # Never take down a browser we only attached to
+            self._cleanup(keep_browser=self.attached)
             raise
     
-    def _cleanup(self):
+    def _count_commands(self):
+        """Count every WebDriver command; elements send theirs through driver.execute too"""
+        execute = self.driver.execute
+        
+        def counted(driver_command, params=None):
+            self.command_count += 1
+            return execute(driver_command, params)
+        
+        self.driver.execute = counted
+    
+    def _span(self, name):
+        """Time a step of the current send (no-op outside of send_* calls)"""
+        return self._timer.span(name) if self._timer else nullcontext()
+    
+    def _record_spans(self, spans):
+        """Add spans measured in the page (send macro) to the current send"""
+        if self._timer and spans:
+            for name, ms in spans.items():
+                self._timer.add(name, ms)
+    
+    @staticmethod
+    def memory_reporting_available():
+        return psutil is not None
+    
+    def get_memory_usage(self):
+        """
+        Resident memory (MB) of this session's browser: every process started
+        by the driver service. None if psutil is not installed or there is no browser.
+        """
+        if psutil is None or not self.driver:
+            return None
+        try:
+            service = psutil.Process(self.driver.service.process.pid)
+            processes = service.children(recursive=True)
+        except (AttributeError, psutil.Error):
+            return None
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                continue
+        return round(total / (1024 * 1024), 1)
+    
+    def _cleanup(self, keep_browser=False):
         if self.driver:
             try:
-                self.driver.quit()
-                logger.info("Browser closed")
+                if keep_browser:
+                    # End only the driver; the detached browser stays up for the next attach
+                    self.driver.service.stop()
+                    logger.info(f"Browser left running on port {self.debug_port}")
+                else:
+                    self.driver.quit()
+                    logger.info("Browser closed")
             except:
                 pass
         self.driver = None
         self.wait = None
+        self.attached = False
+        self.login_state = None
+        self._qr_hash = self._qr_png = None
     
-    def _find_element(self, selectors, timeout=10):
+    def _find_element(self, selectors, timeout=10, name=None, visible=True):
+        """
+        Find the first matching element among selectors.
+        Every selector is checked on each poll, so a stale XPath no longer costs a full timeout.
+        With a selector name, the selector cache picks the order and records which XPath matched.
+        """
         if isinstance(selectors, str):
             selectors = [selectors]
+        profile = self.xpath_profile or 'default'
+        skipped = []
+        if name and self.selector_cache:
+            selectors, skipped = self.selector_cache.order(profile, name, selectors)
+        
+        start = time.time()
+        try:
+            element, xpath = WebDriverWait(self.driver, timeout, poll_frequency=0.25).until(
+                lambda driver: self._first_match(selectors, visible))
+        except TimeoutException:
+            # Selectors on cooldown still get one last look before giving up
+            element, xpath = self._first_match(skipped, visible) or (None, None)
+        
+        if element is not None and name and self.selector_cache:
+            tried = selectors[:selectors.index(xpath)] if xpath in selectors else selectors
+            self.selector_cache.record(profile, name, xpath, tried, time.time() - start)
+        return element
+    
+    def _first_match(self, selectors, visible=True):
+        """Return (element, xpath) for the first selector that matches right now, else False"""
         for selector in selectors:
             try:
-                element = WebDriverWait(self.driver, timeout).until(EC.presence_of_element_located((By.XPATH, selector)))
-                if element and element.is_displayed():
-                    return element
-            except (TimeoutException, NoSuchElementException):
+                for element in self.driver.find_elements(By.XPATH, selector):
+                    if not visible or element.is_displayed():
+                        return element, selector
+            except WebDriverException:
                 continue
-        return None
+        return False
     
     def _find_element_no_wait(self, selectors):
         if isinstance(selectors, str):
@@ -297,6 +564,146 @@ class WhatsAppBot:
                 continue
         return None
     
+    def _wait_for(self, targets, timeout, label, visible=True):
+        """
+        Block until one of the target XPaths appears, using an in-page MutationObserver.
+        targets: {name: xpath or [xpaths]}. Returns the matching name, or None on timeout.
+        """
+        names, xpaths = [], []
+        for name, selectors in targets.items():
+            if isinstance(selectors, str):
+                selectors = [selectors]
+            for selector in selectors:
+                names.append(name)
+                xpaths.append(selector)
+        
+        start = time.time()
+        try:
+            index = self.driver.execute_async_script(page_scripts.WAIT_FOR_XPATH, xpaths, int(timeout * 1000), visible)
+        except WebDriverException as e:
+            logger.debug(f"Observer wait '{label}' unavailable ({e.__class__.__name__}), polling instead")
+            index = self._poll_for(xpaths, timeout - (time.time() - start), visible)
+        elapsed = time.time() - start
+        
+        if index is None or index < 0:
+            logger.warning(f"Wait '{label}' timed out after {elapsed:.2f}s")
+            return None
+        logger.debug(f"Wait '{label}' -> {names[index]} in {elapsed:.2f}s")
+        return names[index]
+    
+    def _poll_for(self, xpaths, timeout, visible=True):
+        """Fallback for _wait_for when async scripts are not available"""
+        deadline = time.time() + max(timeout, 0)
+        while True:
+            try:
+                for index, xpath in enumerate(xpaths):
+                    for element in self.driver.find_elements(By.XPATH, xpath):
+                        if not visible or element.is_displayed():
+                            return index
+            except WebDriverException:
+                # Stale element or a page in the middle of navigating - not there yet
+                pass
+            if time.time() >= deadline:
+                return -1
+            time.sleep(0.25)
+    
+    def _count_outgoing(self):
+        try:
+            return self.driver.execute_script(page_scripts.COUNT_XPATH, self.SELECTORS['outgoing_message'])
+        except WebDriverException:
+            return 0
+    
+    def _wait_for_outgoing(self, before, timeout, label, text=None):
+        """Wait for a new outgoing bubble after pressing send; with text, one that contains it"""
+        start = time.time()
+        try:
+            state = self.driver.execute_async_script(
+                page_scripts.WAIT_FOR_OUTGOING, self.SELECTORS['outgoing_message'], before,
+                int(timeout * 1000), text
+            )
+        except WebDriverException as e:
+            logger.debug(f"Observer wait '{label}' unavailable ({e.__class__.__name__})")
+            state = 'timeout'
+        elapsed = time.time() - start
+        
+        if state == 'timeout':
+            logger.warning(f"Wait '{label}' timed out after {elapsed:.2f}s")
+            return False
+        logger.debug(f"Wait '{label}' -> {state} in {elapsed:.2f}s")
+        return True
+    
+    def _track_last_message(self, phone):
+        """Remember the newest outgoing bubble so its ticks are checked later, off the send path"""
+        try:
+            message_id = self.driver.execute_script(page_scripts.LAST_OUTGOING_ID, self.SELECTORS['outgoing_message'])
+        except WebDriverException:
+            message_id = None
+        self.last_message_id = message_id
+        if message_id:
+            self.delivery_tracker.track(message_id, phone, self.session_id)
+        else:
+            logger.debug(f"No message id found for {phone}, delivery will not be tracked")
+    
+    def check_deliveries(self):
+        """
+        Read the ticks of this session's pending messages once, staying in the chat.
+        Run by the session's BotWorker while idle, so ticks are collected off the send path.
+        """
+        self._settle_deliveries(leaving=False)
+    
+    def _settle_deliveries(self, leaving=True, timeout=0):
+        """
+        Read the ticks of messages sent from this session, waiting up to timeout seconds
+        for clocks to turn into ticks (0 reads once). With leaving=True the session is closing,
+        so messages still showing the clock are reported as unconfirmed; otherwise they stay
+        tracked until they settle or the tracker's timeout expires.
+        """
+        pending = self.delivery_tracker.pending_ids(self.session_id)
+        if not pending or not self.driver:
+            return
+        start = time.time()
+        try:
+            statuses = self.driver.execute_async_script(page_scripts.MESSAGE_STATUSES, pending, int(timeout * 1000))
+        except WebDriverException as e:
+            logger.debug(f"Could not read message statuses: {e.__class__.__name__}")
+            statuses = {message_id: None for message_id in pending}
+        settled = self.delivery_tracker.update(statuses or {}, leaving=leaving)
+        if settled:
+            logger.debug(f"Settled {len(settled)} message(s) in {time.time() - start:.2f}s")
+    
+    def find_sent_message(self, phone, text, since=None, recent=20):
+        """
+        Whether one of the newest outgoing messages in phone's chat contains text (a message,
+        caption or document name), to tell if a send that was cut off went out.
+        With since (Unix time, e.g. when the send started) only messages stamped that minute
+        or later count, so one left from an earlier campaign is not taken for it.
+        None if the chat could not be read, or a match carries no time stamp to check.
+        """
+        if not self.driver or not text:
+            return None
+        self.last_number_invalid = False
+        success, _ = self._open_chat(phone)
+        if not success:
+            # Nothing can have been sent to a number that is not on WhatsApp
+            return False if self.last_number_invalid else None
+        try:
+            bubbles = self.driver.execute_script(page_scripts.RECENT_OUTGOING_TEXTS,
+                                                 self.SELECTORS['outgoing_message'], recent)
+        except WebDriverException as e:
+            logger.debug(f"Could not read the chat with {phone}: {e.__class__.__name__}")
+            return None
+        needle = ' '.join(text.split())
+        matches = [bubble for bubble in bubbles or [] if needle in ' '.join(bubble['text'].split())]
+        if since is None:
+            return bool(matches)
+        # Stamps have minute precision
+        earliest = (int(since) // 60) * 60 * 1000
+        if any(bubble['time'] is not None and bubble['time'] >= earliest for bubble in matches):
+            return True
+        if any(bubble['time'] is None for bubble in matches):
+            return None
+        return False
+    
     def is_logged_in(self):
         if not self.driver:
             return False
@@ -316,29 +723,39 @@ class WhatsAppBot:
         except:
             return False
     
+    def read_login_screen(self):
+        """
+        Login state and QR code in one script call: {'status': 'logged_in' | 'qr_ready' | 'waiting',
+        'hash', 'qr'}. The page only encodes the QR when its pixels changed; otherwise the cached PNG is used.
+        """
+        state = self.driver.execute_script(page_scripts.READ_LOGIN_SCREEN, self.SELECTORS['qr_canvas'],
+                                           self.SELECTORS['side_panel'], self._qr_hash)
+        if state['status'] == 'qr_ready':
+            if state['qr']:
+                self._qr_hash, self._qr_png = state['hash'], state['qr']
+            state['qr'] = self._qr_png
+        return state
+    
     def get_qr_code(self):
         if not self.driver:
             return None
         try:
-            qr = self.driver.find_element(By.XPATH, self.SELECTORS['qr_canvas'])
-            if qr and qr.is_displayed():
-                return self.driver.execute_script("return arguments[0].toDataURL('image/png').substring(22);", qr)
+            return self.read_login_screen()['qr']
         except:
             pass
         return None
     
     def get_qr_code_base64(self):
         if not self.driver:
-            return {'status': 'not_initialized', 'qr': None, 'error': 'Bot not initialized'}
+            return {'status': 'not_initialized', 'qr': None, 'hash': None, 'error': 'Bot not initialized'}
         try:
-            if self.is_logged_in():
-                return {'status': 'logged_in', 'qr': None, 'error': None}
-            qr_base64 = self.get_qr_code()
-            if qr_base64:
-                return {'status': 'qr_ready', 'qr': qr_base64, 'error': None}
-            return {'status': 'waiting', 'qr': None, 'error': 'QR code not yet available'}
+            state = self.read_login_screen()
+            error = 'QR code not yet available' if state['status'] == 'waiting' else None
+            result = {'status': state['status'], 'qr': state['qr'], 'hash': state['hash'], 'error': error}
         except Exception as e:
-            return {'status': 'error', 'qr': None, 'error': str(e)}
+            result = {'status': 'error', 'qr': None, 'hash': None, 'error': str(e)}
+        self.login_state = dict(result, checked_at=time.time())
+        return result
     
     def wait_for_login(self, timeout=120):
         start = time.time()
@@ -349,46 +766,325 @@ class WhatsAppBot:
             time.sleep(2)
         return False
     
-    def _open_chat(self, phone):
+    def _app_loaded(self):
+        """True when WhatsApp Web is already loaded and logged in on the current tab"""
+        try:
+            return bool(self.driver.find_elements(By.XPATH, self.SELECTORS['side_panel']))
+        except WebDriverException:
+            return False
+    
+    def _open_chat_in_app(self, phone, text=None):
+        """
+        Open a chat without reloading WhatsApp Web.
+        Tries an injected wa.me link first (prefilled with text if given), then the new-chat search.
+        Returns 'composer', 'invalid' or None if in-app navigation did not work.
+        """
+        targets = {
+            'composer': self.SELECTORS['fresh_composer'],
+            'invalid': self.SELECTORS['invalid_number_dialog'],
+        }
+        try:
+            link = f'https://wa.me/{phone}' + (f'?text={quote(text)}' if text else '')
+            if self.driver.execute_script(page_scripts.OPEN_CHAT_LINK, link):
+                ready = self._wait_for(targets, self.WAIT_TIMEOUTS['in_app_chat'], 'in_app_chat')
+                if ready:
+                    return ready
+            else:
+                logger.debug("wa.me link not handled in-app, trying new-chat search")
+            
+            new_chat = self._find_element_no_wait(self.SELECTORS['new_chat_button'])
+            if not new_chat:
+                return None
+            self.driver.execute_script(page_scripts.MARK_CHAT_STALE)
+            new_chat.click()
+            if not self._wait_for({'search': self.SELECTORS['new_chat_search']}, self.WAIT_TIMEOUTS['new_chat_search'], 'new_chat_search'):
+                return None
+            search = self._find_element_no_wait(self.SELECTORS['new_chat_search'])
+            if search is None:
+                return None
+            search.send_keys(phone)
+            if not self._wait_for({'result': self.SELECTORS['new_chat_result']}, self.WAIT_TIMEOUTS['new_chat_search'], 'new_chat_result'):
+                search.send_keys(Keys.ESCAPE)
+                return None
+            search.send_keys(Keys.ENTER)
+            return self._wait_for(targets, self.WAIT_TIMEOUTS['in_app_chat'], 'in_app_chat')
+        except WebDriverException as e:
+            logger.debug(f"In-app navigation failed: {e.__class__.__name__}")
+            return None
+    
+    def _prefill_text(self, phone, message):
+        """Message to prefill through the send URL, or None if prefill does not apply"""
+        if not self.prefill or not message:
+            return None
+        url = f'{self.base_url}/send?phone={phone}&text={quote(message)}'
+        if len(url) > self.MAX_PREFILL_URL_LENGTH:
+            return None
+        return message
+    
+    def _chat_is_open(self, phone):
+        """True if the bot's last opened chat is still on screen for phone (digits)"""
+        try:
+            xpath = self.SELECTORS['open_chat_composer'].format(phone=phone)
+            return bool(self.driver.find_elements(By.XPATH, xpath))
+        except WebDriverException:
+            return False
+    
+    def _open_chat(self, phone, text=None):
+        """Open the chat for phone. text is prefilled into the composer by WhatsApp itself."""
         phone = ''.join(filter(str.isdigit, str(phone)))
         if not phone:
             return False, "Invalid phone number"
-        self.driver.get(f'https://web.whatsapp.com/send?phone={phone}')
-        time.sleep(6)
-        invalid = self._find_element_no_wait(self.SELECTORS['invalid_number'])
-        if invalid:
+        
+        # Back-to-back sends to the same number stay in the open chat
+        if not text and self._chat_is_open(phone):
+            logger.debug(f"Chat with {phone} already open")
+            return True, phone
+        
+        # Collect the ticks the previous sends show now (one read, no waiting). Ones still on the
+        # clock stay tracked; they settle if their chat comes back or time out as unconfirmed
+        self._settle_deliveries(leaving=False)
+        
+        ready = None
+        if (self.navigation_mode == 'in_app' and self._in_app_failures < self.MAX_IN_APP_FAILURES
+                and self._app_loaded()):
+            ready = self._open_chat_in_app(phone, text)
+            if ready:
+                self._in_app_failures = 0
+            else:
+                self._in_app_failures += 1
+                if self._in_app_failures >= self.MAX_IN_APP_FAILURES:
+                    logger.warning("In-app navigation keeps failing, using page reloads from now on")
+                else:
+                    logger.info(f"In-app navigation to {phone} failed, reloading WhatsApp Web")
+        
+        if ready is None:
+            url = f'{self.base_url}/send?phone={phone}'
+            if text:
+                url += f'&text={quote(text)}'
+            self.driver.get(url)
+            # Return as soon as either the composer or the invalid-number dialog shows up
+            # (only the dialog itself: a chat that merely mentions "invalid" must not count)
+            ready = self._wait_for({
+                'composer': self.SELECTORS['message_input'],
+                'invalid': self.SELECTORS['invalid_number_dialog'],
+            }, self.WAIT_TIMEOUTS['chat_ready'], 'chat_ready')
+        if ready is None:
+            return False, "Chat did not load"
+        if ready == 'invalid':
+            self.last_number_invalid = True
             try:
                 self.driver.find_element(By.XPATH, '//div[@role="button"]').click()
             except:
                 pass
             return False, "Invalid phone number"
+        try:
+            self.driver.execute_script(page_scripts.MARK_CHAT_OPEN, phone)
+        except WebDriverException:
+            pass
         return True, phone
     
+    def _run_send_macro(self, message, prefilled=False):
+        """
+        Insert and send text with a single execute_async_script call.
+        Returns the helper's result dict ({'ok', 'step', 'ms'}), or None if the helper could not run.
+        """
+        options = {
+            'composer': self.SELECTORS['message_input'],
+            'sendButton': self._get_selector('send_button'),
+            'outgoing': self.SELECTORS['outgoing_message'],
+            'timeout': int(self.WAIT_TIMEOUTS['outgoing_message'] * 1000),
+            'prefilled': prefilled,
+            'prefillWait': int(self.WAIT_TIMEOUTS['prefill'] * 1000),
+        }
+        try:
+            result = self.driver.execute_async_script(page_scripts.RUN_SEND_MACRO, message, options)
+            if result and result.get('step') == 'not_installed':
+                # Non-Chromium browsers (or a page loaded before registration): install now
+                self.driver.execute_script(page_scripts.BOT_HELPER)
+                result = self.driver.execute_async_script(page_scripts.RUN_SEND_MACRO, message, options)
+            return result
+        except WebDriverException as e:
+            logger.debug(f"Send macro unavailable: {e.__class__.__name__}")
+            return None
+    
+    def _insert_text(self, element, text):
+        """
+        Insert the whole text in one operation through the page helper.
+        Keeps line breaks, emoji and non-BMP characters that send_keys cannot type.
+        element=None targets the focused element. Returns True on success.
+        """
+        try:
+            inserted = self.driver.execute_script(page_scripts.INSERT_TEXT, element, text)
+            if inserted is None:
+                self.driver.execute_script(page_scripts.BOT_HELPER)
+                inserted = self.driver.execute_script(page_scripts.INSERT_TEXT, element, text)
+            return bool(inserted)
+        except WebDriverException as e:
+            logger.debug(f"Text insertion failed: {e.__class__.__name__}")
+            return False
+    
+    @staticmethod
+    def _is_bmp(text):
+        """ChromeDriver's send_keys only supports characters in the Basic Multilingual Plane"""
+        return all(ord(ch) <= 0xFFFF for ch in text)
+    
+    def _send_keys_lines(self, element, text):
+        """Type text with send_keys, using Shift+Enter for line breaks"""
+        lines = text.split('\n')
+        for i, line in enumerate(lines):
+            element.send_keys(line)
+            if i < len(lines) - 1:
+                element.send_keys(Keys.SHIFT + Keys.ENTER)
+    
+    def _composer_matches(self, box, message):
+        """True if the composer already holds exactly this message"""
+        try:
+            matches = self.driver.execute_script(page_scripts.COMPOSER_MATCHES, box, message)
+        except WebDriverException:
+            matches = None
+        if matches is None:
+            # No helper: compare the rendered text (emoji render as images and are missed)
+            return ''.join(box.text.split()) == ''.join(message.split())
+        return bool(matches)
+    
+    def _type_and_send(self, phone, message, prefilled=False):
+        """Selenium send path: find the composer, insert the text and press Enter"""
+        with self._span('find_composer'):
+            box = self._find_element(self.SELECTORS['message_input'], name='message_input')
+        if not box:
+            logger.error(f"Could not find message input for {phone}")
+            return False
+        with self._span('type'):
+            box.click()
+            if prefilled and self._composer_matches(box, message):
+                logger.debug(f"Using prefilled text for {phone}")
+            elif box.text.strip() and not self._clear_composer(box):
+                logger.error(f"Could not clear unexpected composer text for {phone}")
+                return False
+            elif not self._insert_text(box, message):
+                if not self._is_bmp(message):
+                    logger.error(f"Could not insert message for {phone}: it contains characters send_keys cannot type")
+                    return False
+                self._send_keys_lines(box, message)
+        with self._span('confirm'):
+            before = self._count_outgoing()
+            box.send_keys(Keys.ENTER)
+            if not self._wait_for_outgoing(before, self.WAIT_TIMEOUTS['outgoing_message'], 'outgoing_message'):
+                logger.error(f"Message to {phone} did not appear in the chat")
+                return False
+        return True
+    
+    def _clear_composer(self, box):
+        """Remove leftover text (e.g. a prefill that did not match) from the composer"""
+        select_all = Keys.COMMAND if self.system == 'Darwin' else Keys.CONTROL
+        box.send_keys(select_all, 'a')
+        box.send_keys(Keys.DELETE)
+        return not box.text.strip()
+    
+    def restart(self):
+        """
+        Quit the browser and start a fresh one on the same profile, so the login survives.
+        Messages whose ticks were still being tracked are reported as unconfirmed.
+        """
+        pending = self.delivery_tracker.pending_ids(self.session_id)
+        if pending:
+            self.delivery_tracker.update({message_id: None for message_id in pending}, leaving=True)
+        # The old browser may be hung, so no page access here - and it must really go,
+        # otherwise the new one cannot open the profile
+        self._cleanup(keep_browser=False)
+        self._in_app_failures = 0
+        self.initialize(headless=self.is_headless, browser=self._browser_choice)
+        if not self._wait_for({'app': self.SELECTORS['side_panel']}, self.WAIT_TIMEOUTS['restart_login'], 'restart_login'):
+            logger.error(f"Session {self.session_id} did not log back in after restart (QR scan needed?)")
+            return False
+        return True
+    
+    @staticmethod
+    def _recognizable_text(kind, args):
+        """Text a send leaves in the chat to recognize it by: its message or caption, else a document's name"""
+        message = args[1]
+        if message:
+            return message
+        if kind == 'attachment' and args[3] not in ['image', 'video']:
+            return os.path.basename(args[2][-1])
+        return None
+    
+    def _guarded_send(self, kind, send, *args):
+        """
+        Run a send under the watchdog (if any): recycle an unhealthy browser first,
+        and retry once if the browser turned out to be dead when the send failed -
+        unless the chat shows it went out anyway, or cannot tell (a retry could send it twice).
+        The send is timed; its spans end up in last_timings. The rate limiter learns the outcome;
+        its pacing is up to bulk callers (BotPool.dispatch, send_bulk_messages), which wait
+        for a token before they take the session, so single sends are never held up by it.
+        """
+        self._timer = SendTimer(kind, lambda: self.command_count)
+        success = False
+        try:
+            if not self.watchdog:
+                success = send(*args)
+                return success
+            self.watchdog.before_send(self)
+            started = time.time()
+            success = send(*args)
+            if self.watchdog.after_send(self, success):
+                sent = self.find_sent_message(args[0], self._recognizable_text(kind, args), since=started)
+                if sent:
+                    logger.info("The send interrupted by the browser failure went out, not sending it again")
+                    success = True
+                elif sent is None:
+                    logger.warning("Could not tell whether the send interrupted by the browser failure went out, not retrying")
+                else:
+                    logger.info("Retrying the send interrupted by the browser failure")
+                    success = send(*args)
+                    self.watchdog.after_send(self, success)
+            return success
+        finally:
+            self.last_timings = self._timer.finish()
+            self._timer = None
+            logger.debug(f"Send timings: {self.last_timings}")
+            if self.rate_limiter:
+                self.rate_limiter.record(self.session_id, success, self.last_number_invalid)
+    
     def send_message(self, phone, message):
+        return self._guarded_send('text', self._send_message, phone, message)
+    
+    def _send_message(self, phone, message):
         try:
+            self.last_message_id = None
+            self.last_number_invalid = False
             if not self.driver:
                 logger.warning("Bot not initialized")
                 return False
-            success, result = self._open_chat(phone)
+            digits = ''.join(filter(str.isdigit, str(phone)))
+            # Prefilling needs a navigation, so not when the chat is already open
+            prefill = None if self._chat_is_open(digits) else self._prefill_text(digits, message)
+            with self._span('open_chat'):
+                success, result = self._open_chat(phone, text=prefill)
             if not success:
                 return False
             phone = result
-            logger.debug(f"Sending text message to {phone}")
-            box = self._find_element(self.SELECTORS['message_input'])
-            if not box:
-                logger.error(f"Could not find message input for {phone}")
+            prefilled = prefill is not None
+            logger.debug(f"Sending text message to {phone}" + (" (prefilled)" if prefilled else ""))
+            
+            if self.send_macro:
+                macro = self._run_send_macro(message, prefilled=prefilled)
+                self._record_spans((macro or {}).get('spans'))
+                if macro and macro.get('ok'):
+                    self._track_last_message(phone)
+                    logger.info(f"Message sent to {phone}")
+                    logger.debug(f"Send macro finished in {macro.get('ms')}ms (text {macro.get('text')})")
+                    return True
+                if macro and macro.get('step') == 'confirm':
+                    # Send was pressed - retrying could deliver the message twice
+                    logger.error(f"Message to {phone} did not appear in the chat")
+                    return False
+                logger.info(f"Send macro failed at '{(macro or {}).get('step', 'script')}', using Selenium path")
+            
+            if not self._type_and_send(phone, message, prefilled=prefilled):
                 return False
-            box.click()
-            time.sleep(0.3)
-            lines = message.split('\n')
-            for i, line in enumerate(lines):
-                box.send_keys(line)
-                if i < len(lines) - 1:
-                    box.send_keys(Keys.SHIFT + Keys.ENTER)
-            time.sleep(0.3)
-            box.send_keys(Keys.ENTER)
+            self._track_last_message(phone)
             logger.info(f"Message sent to {phone}")
-            time.sleep(2)
             return True
         except Exception as e:
             logger.error(f"Error sending to {phone}: {e}", exc_info=True)
@@ -399,128 +1095,188 @@ class WhatsAppBot:
         Send a message with an attachment.
         file_type: 'image', 'document', 'audio', 'video' (image/video use photo option, others use document)
         """
+        return self.send_message_with_attachments(phone, message, [file_path], file_type)
+    
+    def send_message_with_attachments(self, phone, message, file_paths, file_type='document'):
+        """
+        Send several attachments through one attachment dialog, with the caption added once.
+        All files go through the same input, so file_type applies to all of them
+        (use 'document' for a mix of images and other files).
+        """
+        return self._guarded_send('attachment', self._send_attachments, phone, message, file_paths, file_type)
+    
+    def _send_attachments(self, phone, message, file_paths, file_type):
         try:
+            self.last_message_id = None
+            self.last_number_invalid = False
             if not self.driver:
                 logger.warning("Bot not initialized")
                 return False
-            if not os.path.exists(file_path):
-                logger.error(f"File not found: {file_path}")
+            if not file_paths:
+                logger.error("No attachments given")
                 return False
-            file_path = os.path.abspath(file_path)
-            success, result = self._open_chat(phone)
+            for file_path in file_paths:
+                if not os.path.exists(file_path):
+                    logger.error(f"File not found: {file_path}")
+                    return False
+            # Photos are recompressed by WhatsApp anyway; documents are sent untouched
+            if self.media_preprocessor and file_type == 'image':
+                file_paths = [self.media_preprocessor.prepare(file_path) for file_path in file_paths]
+            file_paths = [os.path.abspath(file_path) for file_path in file_paths]
+            with self._span('open_chat'):
+                success, result = self._open_chat(phone)
             if not success:
                 return False
             phone = result
-            logger.info(f"Sending attachment ({file_type}) to {phone}")
+            logger.info(f"Sending {len(file_paths)} attachment(s) ({file_type}) to {phone}")
             
-            # Click attachment button to open menu
-            attach_btn = self._find_element(self._get_selector('attachment_button'))
-            if not attach_btn:
-                logger.error("Could not find attachment button")
-                return False
-            attach_btn.click()
-            time.sleep(1)
-            
-            # Select correct input based on file type
-            if file_type in ['image', 'video']:
-                input_xpath = self._get_selector('photo_input')
-                input_name = 'photo/video'
-            elif file_type == 'audio':
-                input_xpath = self._get_selector('audio_input')
-                input_name = 'audio'
-            else:
-                input_xpath = self._get_selector('document_input')
-                input_name = 'document'
-            
-            # Find and use the file input directly
-            try:
-                file_input = self.driver.find_element(By.XPATH, input_xpath)
-                file_input.send_keys(file_path)
-                logger.debug(f"File sent to {input_name} input")
-            except Exception as e:
-                logger.warning(f"Could not find {input_name} input: {e}")
-                # Fallback to generic file input
-                inputs = self.driver.find_elements(By.XPATH, self._get_selector('file_input'))
-                if not inputs:
-                    logger.error("Could not find any file input")
+            with self._span('attach'):
+                # Click attachment button to open menu
+                attach_btn = self._find_element(self._get_selector('attachment_button'), name='attachment_button')
+                if not attach_btn:
+                    logger.error("Could not find attachment button")
                     return False
-                inputs[0].send_keys(file_path)
-                logger.debug("File sent via fallback input")
-            
-            time.sleep(4)
-            
-            # Add caption if provided
-            if message:
-                caption_added = False
+                attach_btn.click()
                 
-                # Get caption input selectors from profile
-                caption_selectors = self._get_selector('caption_input')
-                if not isinstance(caption_selectors, list):
-                    caption_selectors = [caption_selectors]
+                # Select correct input based on file type
+                if file_type in ['image', 'video']:
+                    input_xpath = self._get_selector('photo_input')
+                    input_name = 'photo/video'
+                elif file_type == 'audio':
+                    input_xpath = self._get_selector('audio_input')
+                    input_name = 'audio'
+                else:
+                    input_xpath = self._get_selector('document_input')
+                    input_name = 'document'
                 
-                # Try each caption selector
-                for caption_xpath in caption_selectors:
-                    if caption_added:
-                        break
-                    try:
-                        # Wait for caption input to be present
-                        cap = WebDriverWait(self.driver, 3).until(
-                            EC.presence_of_element_located((By.XPATH, caption_xpath))
-                        )
-                        # Click on the element
-                        cap.click()
-                        time.sleep(0.3)
-                        # Type the message
-                        cap.send_keys(message)
-                        caption_added = True
-                        logger.debug(f"Caption added using selector")
-                    except Exception as e:
-                        logger.debug(f"Caption selector failed: {e}")
+                # Wait for the attachment menu to render its file inputs (they are hidden)
+                self._wait_for({'menu': [input_xpath, self._get_selector('file_input')]},
+                               self.WAIT_TIMEOUTS['attachment_menu'], 'attachment_menu', visible=False)
                 
-                # Fallback: Try ActionChains if direct input failed
-                if not caption_added:
-                    try:
-                        # Try using ActionChains to type into active element
-                        actions = ActionChains(self.driver)
-                        actions.send_keys(message).perform()
-                        caption_added = True
-                        logger.debug("Caption added via ActionChains fallback")
-                    except Exception as e2:
-                        logger.warning(f"ActionChains fallback failed: {e2}")
+                # Find and use the file input directly - several paths are newline-separated
+                files = '\n'.join(file_paths)
+                try:
+                    file_input = self.driver.find_element(By.XPATH, input_xpath)
+                    file_input.send_keys(files)
+                    logger.debug(f"{len(file_paths)} file(s) sent to {input_name} input")
+                except Exception as e:
+                    logger.warning(f"Could not find {input_name} input: {e}")
+                    # Fallback to generic file input
+                    inputs = self.driver.find_elements(By.XPATH, self._get_selector('file_input'))
+                    if not inputs:
+                        logger.error("Could not find any file input")
+                        return False
+                    inputs[0].send_keys(files)
+                    logger.debug("Files sent via fallback input")
                 
-                if not caption_added:
-                    logger.warning("Could not add caption, sending without caption")
+                # Wait for the attachment preview (caption box or its send button)
+                preview = self._wait_for({
+                    'caption': self._get_selector('caption_input'),
+                    'send': self._get_selector('attachment_send_button'),
+                }, self.WAIT_TIMEOUTS['attachment_preview'], 'attachment_preview')
+                if preview is None:
+                    logger.error("Attachment preview did not open")
+                    return False
             
-            time.sleep(1)
-            # Use attachment_send_button for the send button in attachment dialog
-            send_btn = self._find_element(self._get_selector('attachment_send_button'), timeout=5)
-            if not send_btn:
-                # Fallback to regular send button
-                send_btn = self._find_element(self._get_selector('send_button'), timeout=5)
-            if not send_btn:
-                logger.error("Could not find send button")
-                return False
-            send_btn.click()
-            logger.info(f"Attachment sent to {phone}")
-            time.sleep(5)
+            # Add caption if provided
+            if message:
+                with self._span('caption'):
+                    caption_added = False
+                    
+                    # Get caption input selectors from profile (cache picks the order)
+                    cap = self._find_element(self._get_selector('caption_input'), timeout=3, name='caption_input', visible=False)
+                    if cap:
+                        try:
+                            # Click on the element
+                            cap.click()
+                            # Insert the whole caption at once; type it only if that fails
+                            if self._insert_text(cap, message):
+                                caption_added = True
+                            elif self._is_bmp(message):
+                                self._send_keys_lines(cap, message)
+                                caption_added = True
+                            if caption_added:
+                                logger.debug(f"Caption added using selector")
+                        except Exception as e:
+                            logger.debug(f"Caption selector failed: {e}")
+                    
+                    # Fallback: insert into whatever has focus (the preview focuses its caption box)
+                    if not caption_added and self._insert_text(None, message):
+                        caption_added = True
+                        logger.debug("Caption added to focused element")
+                    
+                    # Last resort: ActionChains typing (BMP text only)
+                    if not caption_added and self._is_bmp(message):
+                        try:
+                            # Try using ActionChains to type into active element
+                            actions = ActionChains(self.driver)
+                            actions.send_keys(message).perform()
+                            caption_added = True
+                            logger.debug("Caption added via ActionChains fallback")
+                        except Exception as e2:
+                            logger.warning(f"ActionChains fallback failed: {e2}")
+                    
+                    if not caption_added:
+                        logger.warning("Could not add caption, sending without caption")
+            
+            with self._span('confirm'):
+                # Use attachment_send_button for the send button in attachment dialog
+                send_btn = self._find_element(self._get_selector('attachment_send_button'), timeout=5, name='attachment_send_button')
+                if not send_btn:
+                    # Fallback to regular send button
+                    send_btn = self._find_element(self._get_selector('send_button'), timeout=5, name='send_button')
+                if not send_btn:
+                    logger.error("Could not find send button")
+                    return False
+                # Files become one bubble each, or one album for 4+ photos, so wait for a new
+                # bubble carrying the caption (or, for documents, the last file's name)
+                before = self._count_outgoing()
+                if message:
+                    expected = message
+                elif file_type in ['image', 'video']:
+                    expected = None
+                else:
+                    expected = os.path.basename(file_paths[-1])
+                send_btn.click()
+                # The upload finishes in the background; its tick is read later
+                if not self._wait_for_outgoing(before, self.WAIT_TIMEOUTS['outgoing_message'], 'outgoing_message',
+                                               text=expected):
+                    logger.error(f"Attachment to {phone} did not appear in the chat")
+                    return False
+            self._track_last_message(phone)
+            logger.info(f"{len(file_paths)} attachment(s) sent to {phone}")
             return True
         except Exception as e:
             logger.error(f"Error sending attachment to {phone}: {e}", exc_info=True)
             return False
     
     def send_bulk_messages(self, contacts, message, delay=5):
+        # The rate limiter already spaces the sends; a fixed delay on top would add up
+        if self.rate_limiter and self.rate_limiter.settings['enabled']:
+            delay = 0
         results = []
         for contact in contacts:
             phone = contact.get('phone') if isinstance(contact, dict) else contact
+            if self.rate_limiter:
+                self.rate_limiter.acquire(self.session_id)
             success = self.send_message(phone, message)
             results.append({'phone': phone, 'success': success})
             if delay > 0:
                 time.sleep(delay)
         return results
     
-    def close(self):
+    def close(self, keep_browser=None):
+        """Close the bot. In attach mode the browser keeps running unless keep_browser=False."""
+        if keep_browser is None:
+            keep_browser = self.attach and self.browser_type != 'firefox'
         logger.info("Closing WhatsApp bot")
-        self._cleanup()
+        try:
+            self._settle_deliveries(timeout=self.WAIT_TIMEOUTS['delivery_settle'])
+        except Exception as e:
+            logger.debug(f"Could not settle deliveries on close: {e}")
+        if self.selector_cache:
+            self.selector_cache.save(force=True)
+        self._cleanup(keep_browser=keep_browser)
 
 
 bot = WhatsAppBot()
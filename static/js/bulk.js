@@ -6,6 +6,9 @@ let contacts = [];
 let uploadedAttachment = null;
 let isSending = false;
 let isPaused = false;
+// Server-side campaign (outbox job) this page follows, and its progress stream
+let activeJobId = null;
+let jobEvents = null;
 let appSettings = { default_country_code: '91' };
 let botConnected = false;
 
@@ -82,6 +85,8 @@ document.addEventListener('DOMContentLoaded', function() {
     initEventListeners();
     loadSavedContacts();
     updateContactCount();
+    // A campaign started before the page was closed keeps running on the server
+    reattachToJob();
     
     // Check bot status every 10 seconds
     setInterval(checkBotStatus, 10000);
@@ -150,9 +155,19 @@ function loadSavedContacts() {
 }
 
 function saveContactsToStorage() {
+    clearTimeout(saveContactsTimer);
+    saveContactsTimer = null;
     localStorage.setItem('bulkContacts', JSON.stringify(contacts));
 }
 
+// Progress updates save at most every few seconds instead of re-serializing the list per message
+let saveContactsTimer = null;
+function scheduleContactsSave() {
+    if (!saveContactsTimer) {
+        saveContactsTimer = setTimeout(saveContactsToStorage, 3000);
+    }
+}
+
 // Parse phone number to extract country code and local number
 function parsePhoneNumber(phone) {
     phone = phone.replace(/[^\d]/g, ''); // Remove non-digits
@@ -374,6 +389,16 @@ function renderContacts() {
     tbody.innerHTML = html;
 }
 
+// Patch the status badge of one row instead of re-rendering the table
+function updateContactRow(index) {
+    const badge = document.querySelector('tr[data-index="' + index + '"] .status-badge');
+    if (badge) {
+        const status = contacts[index].status;
+        badge.className = 'status-badge status-' + status;
+        badge.textContent = status;
+    }
+}
+
 function updateContactCount() {
     document.getElementById('contactCount').textContent = contacts.length;
 }
@@ -590,19 +615,10 @@ async function startBulkSend() {
     isPaused = false;
     updateSendUI();
     
-    const progressSection = document.querySelector('.progress-section');
-    const progressFill = document.querySelector('.progress-fill');
-    const sentCount = document.querySelector('.sent-count');
-    const totalCount = document.querySelector('.total-count');
     const logContent = document.getElementById('sendLogContent');
-    
-    progressSection.style.display = 'block';
-    totalCount.textContent = validContacts.length;
+    showProgress(validContacts.length);
     logContent.innerHTML = '';
     
-    let sent = 0;
-    let failed = 0;
-    
     let attachmentPath = null;
     if (hasAttachment && uploadedAttachment) {
         try {
@@ -630,67 +646,134 @@ async function startBulkSend() {
         }
     }
     
-    for (let i = 0; i < validContacts.length; i++) {
-        if (!isSending) break;
-        
-        while (isPaused && isSending) {
-            await sleep(500);
+    // The server runs the campaign; this page only follows its progress
+    validContacts.forEach(contact => contact.status = 'pending');
+    renderContacts();
+    saveContactsToStorage();
+    try {
+        const response = await fetch('/api/bulk-send', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                contacts: validContacts.map(contact => ({
+                    name: contact.name,
+                    number: contact.phone,
+                    message: message.replace(/{name}/gi, contact.name || 'there')
+                })),
+                message: message,
+                attachment_path: attachmentPath,
+                attachment_type: attachmentType || 'document',
+                delay: delay
+            })
+        });
+        const result = await response.json();
+        if (!result.success) {
+            throw new Error(result.error);
         }
+        addLogEntry(logContent, result.message, 'info');
+        localStorage.setItem('bulkJobId', result.job_id);
+        watchJob(result.job_id);
+    } catch (error) {
+        addLogEntry(logContent, 'Could not start sending: ' + error.message, 'error');
+        isSending = false;
+        updateSendUI();
+    }
+}
+
+function showProgress(total) {
+    document.querySelector('.progress-section').style.display = 'block';
+    document.querySelector('.total-count').textContent = total;
+    document.querySelector('.sent-count').textContent = 0;
+    document.querySelector('.progress-fill').style.width = '0%';
+}
+
+// Follow a job's progress stream; rows are matched to recipients by phone number
+function watchJob(jobId) {
+    stopJobEvents();
+    activeJobId = jobId;
+    const logContent = document.getElementById('sendLogContent');
+    const rowByPhone = new Map(contacts.map((contact, index) => [contact.phone, index]));
+    const settled = new Set();
+    
+    jobEvents = new EventSource('/api/outbox/jobs/' + jobId + '/events');
+    jobEvents.addEventListener('item', event => {
+        const item = JSON.parse(event.data);
+        // A reconnecting stream replays settled recipients
+        if (settled.has(item.id)) return;
+        settled.add(item.id);
         
-        if (!isSending) break;
-        
-        const contact = validContacts[i];
-        const personalizedMessage = message.replace(/{name}/gi, contact.name || 'there');
-        
-        addLogEntry(logContent, 'Sending to ' + contact.phone + '...', 'info');
-        
-        try {
-            const response = await fetch('/api/send-message', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    phone: contact.phone,
-                    message: personalizedMessage,
-                    attachment_path: attachmentPath,
-                    file_type: attachmentType
-                })
-            });
-            
-            const result = await response.json();
-            
-            // Find original index to update status
-            const originalIndex = contacts.findIndex(c => c.phone === contact.phone);
-            
-            if (result.success) {
-                if (originalIndex !== -1) contacts[originalIndex].status = 'sent';
-                sent++;
-                addLogEntry(logContent, 'Sent to ' + contact.phone, 'success');
-            } else {
-                if (originalIndex !== -1) contacts[originalIndex].status = 'failed';
-                failed++;
-                addLogEntry(logContent, 'Failed: ' + contact.phone + ' - ' + result.error, 'error');
-            }
-        } catch (error) {
-            const originalIndex = contacts.findIndex(c => c.phone === contact.phone);
-            if (originalIndex !== -1) contacts[originalIndex].status = 'failed';
-            failed++;
-            addLogEntry(logContent, 'Error: ' + contact.phone + ' - ' + error.message, 'error');
+        const index = rowByPhone.get(item.phone);
+        const status = item.status === 'sent' || item.status === 'invalid' ? item.status : 'failed';
+        if (index !== undefined) {
+            contacts[index].status = status;
+            updateContactRow(index);
+            scheduleContactsSave();
         }
+        if (item.status === 'sent') {
+            addLogEntry(logContent, 'Sent to ' + item.phone, 'success');
+        } else if (item.status === 'invalid') {
+            addLogEntry(logContent, 'Skipped: ' + item.phone + ' - Phone number is not on WhatsApp', 'error');
+        } else if (item.status !== 'cancelled') {
+            addLogEntry(logContent, 'Failed: ' + item.phone + ((item.result && item.result.error) ? ' - ' + item.result.error : ''), 'error');
+        }
+    });
+    jobEvents.addEventListener('job', event => {
+        const job = JSON.parse(event.data);
+        const counts = job.counts;
+        const done = job.total - (counts.pending || 0) - (counts.in_flight || 0) - (counts.cancelled || 0);
+        document.querySelector('.total-count').textContent = job.total;
+        document.querySelector('.sent-count').textContent = done;
+        document.querySelector('.progress-fill').style.width = (job.total ? done / job.total * 100 : 100) + '%';
         
-        sentCount.textContent = sent + failed;
-        progressFill.style.width = ((sent + failed) / validContacts.length * 100) + '%';
-        renderContacts();
-        saveContactsToStorage();
-        
-        if (i < validContacts.length - 1 && isSending) {
-            await sleep(delay * 1000);
+        isPaused = job.status === 'paused';
+        isSending = true;
+        updateSendUI();
+        if (job.status === 'completed' || job.status === 'cancelled' || job.status === 'failed') {
+            finishJob(job);
         }
-    }
-    
+    });
+}
+
+function finishJob(job) {
+    const counts = job.counts;
+    const sent = counts.sent || 0;
+    const failed = (counts.failed || 0) + (counts.invalid || 0) + (counts.error || 0);
+    const logContent = document.getElementById('sendLogContent');
+    stopJobEvents();
+    localStorage.removeItem('bulkJobId');
+    activeJobId = null;
     isSending = false;
+    isPaused = false;
     updateSendUI();
-    addLogEntry(logContent, 'Completed! Sent: ' + sent + ', Failed: ' + failed, sent > 0 ? 'success' : 'error');
-    showAlert('Bulk send complete. Sent: ' + sent + ', Failed: ' + failed, sent > 0 ? 'success' : 'error');
+    saveContactsToStorage();
+    const verb = job.status === 'completed' ? 'Completed' : 'Stopped';
+    addLogEntry(logContent, verb + '! Sent: ' + sent + ', Failed: ' + failed, sent > 0 ? 'success' : 'error');
+    showAlert('Bulk send ' + job.status + '. Sent: ' + sent + ', Failed: ' + failed, sent > 0 ? 'success' : 'error');
+}
+
+function stopJobEvents() {
+    if (jobEvents) {
+        jobEvents.close();
+        jobEvents = null;
+    }
+}
+
+async function reattachToJob() {
+    const jobId = localStorage.getItem('bulkJobId');
+    if (!jobId) return;
+    try {
+        const response = await fetch('/api/outbox/jobs/' + jobId + '?results=0');
+        const data = await response.json();
+        if (!data.success || ['completed', 'cancelled', 'failed'].includes(data.job.status)) {
+            localStorage.removeItem('bulkJobId');
+            return;
+        }
+        document.getElementById('sendLogContent').innerHTML = '';
+        showProgress(data.job.total);
+        watchJob(jobId);
+    } catch (error) {
+        console.error('Error reattaching to bulk send:', error);
+    }
 }
 
 // Send to a single contact from the table
@@ -770,6 +853,9 @@ async function sendToSingle(index) {
         if (result.success) {
             contacts[index].status = 'sent';
             showAlert(`Message sent to ${contact.name || contact.phone}`, 'success');
+        } else if (result.status === 'invalid') {
+            contacts[index].status = 'invalid';
+            showAlert(`${contact.name || contact.phone}: ${result.error}`, 'error');
         } else {
             contacts[index].status = 'failed';
             showAlert(`Failed to send to ${contact.name || contact.phone}: ${result.error}`, 'error');
@@ -783,17 +869,27 @@ async function sendToSingle(index) {
     saveContactsToStorage();
 }
 
+async function controlJob(action) {
+    if (!activeJobId) return;
+    try {
+        const response = await fetch('/api/outbox/jobs/' + activeJobId + '/' + action, { method: 'POST' });
+        const result = await response.json();
+        if (!result.success) {
+            showAlert(result.error, 'warning');
+        }
+    } catch (error) {
+        showAlert('Could not ' + action + ' sending: ' + error.message, 'error');
+    }
+}
+
 function pauseSend() {
-    isPaused = !isPaused;
-    const pauseBtn = document.getElementById('pauseSendBtn');
-    pauseBtn.innerHTML = isPaused ? '<i class="fas fa-play"></i> Resume' : '<i class="fas fa-pause"></i> Pause';
+    // The job event that follows updates the button
+    controlJob(isPaused ? 'resume' : 'pause');
 }
 
 function stopSend() {
     if (confirm('Stop sending messages?')) {
-        isSending = false;
-        isPaused = false;
-        updateSendUI();
+        controlJob('cancel');
     }
 }
 
@@ -806,6 +902,7 @@ function updateSendUI() {
         startBtn.style.display = 'none';
         pauseBtn.style.display = 'inline-flex';
         stopBtn.style.display = 'inline-flex';
+        pauseBtn.innerHTML = isPaused ? '<i class="fas fa-play"></i> Resume' : '<i class="fas fa-pause"></i> Pause';
     } else {
         startBtn.style.display = 'inline-flex';
         pauseBtn.style.display = 'none';
@@ -836,10 +933,6 @@ function formatFileSize(bytes) {
     return Math.round(bytes / Math.pow(k, i) * 100) / 100 + ' ' + sizes[i];
 }
 
-function sleep(ms) {
-    return new Promise(resolve => setTimeout(resolve, ms));
-}
-
 function showAlert(message, type) {
     const container = document.getElementById('alertContainer');
     if (container) {